@@ -20,15 +20,30 @@ import os
 import shutil
 import logging
 import time
-from typing import Dict, List, Any, Optional, Callable, Union
+import atexit
+import base64
+import bisect
+import bz2
+import heapq
+import lzma
+import math
+import pickle
+import re
+import struct
+import threading
+import weakref
+import zlib
+from functools import lru_cache, wraps
+from itertools import islice
+from collections import Counter, OrderedDict
+from typing import Dict, List, Any, Optional, Callable, Union, BinaryIO
 from datetime import datetime
 from contextlib import contextmanager
 from pathlib import Path
 
 # 添加Flask API支持
 try:
-    from flask import Flask, request, jsonify
-    from functools import wraps
+    from flask import Flask, Response, request, jsonify
     FLASK_AVAILABLE = True
 except ImportError:
     FLASK_AVAILABLE = False
@@ -50,6 +65,106 @@ try:
 except ImportError:
     DOTENV_AVAILABLE = False
 
+# 进程退出时需要刷盘的数据库实例
+_open_databases = weakref.WeakSet()
+
+@atexit.register
+def _close_open_databases():
+    """进程退出前把所有未落盘的变更写入磁盘（存储目录已被删除的实例不再写入，避免重新创建目录）"""
+    for db in list(_open_databases):
+        if db._storage_missing():
+            db.logger.warning(f"数据库目录已不存在，退出时不再写入: {db.db_path}")
+            _open_databases.discard(db)
+            continue
+        db.close()
+
+def _synchronized(method):
+    """在实例锁内执行方法，使写操作与后台刷盘互斥"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+# 二进制快照缓存：魔数、格式版本、源文件mtime(ns)、源文件大小、负载CRC32
+_CACHE_MAGIC = b'ADBC'
+_CACHE_VERSION = 1
+_CACHE_HEADER = struct.Struct('<4sHqQI')
+
+def _cache_path(source_path: Path) -> Path:
+    """数据文件对应的二进制快照缓存路径"""
+    return source_path.with_name(source_path.name + '.cache')
+
+def _write_snapshot_cache(source_path: Path, content: Any) -> None:
+    """在数据文件旁写入二进制快照缓存，记录源文件的mtime和大小"""
+    payload = pickle.dumps(content, protocol=pickle.HIGHEST_PROTOCOL)
+    stat = source_path.stat()
+    header = _CACHE_HEADER.pack(_CACHE_MAGIC, _CACHE_VERSION, stat.st_mtime_ns,
+                                stat.st_size, zlib.crc32(payload))
+    cache_path = _cache_path(source_path)
+    temp_path = cache_path.with_name(cache_path.name + '.tmp')
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(payload)
+    temp_path.replace(cache_path)
+
+def _read_snapshot_cache(source_path: Path) -> Optional[Any]:
+    """读取二进制快照缓存；缓存不存在、过期或校验失败时返回None"""
+    cache_path = _cache_path(source_path)
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        magic, version, mtime_ns, size, checksum = _CACHE_HEADER.unpack_from(data)
+        stat = source_path.stat()
+        if (magic != _CACHE_MAGIC or version != _CACHE_VERSION or
+                mtime_ns != stat.st_mtime_ns or size != stat.st_size):
+            return None
+        payload = memoryview(data)[_CACHE_HEADER.size:]
+        if zlib.crc32(payload) != checksum:
+            return None
+        return pickle.loads(payload)
+    except (OSError, struct.error, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+
+# 延迟加载模式下尚未读取的表的占位符
+_NOT_LOADED = object()
+
+class _LazyTables(dict):
+    """
+    按需加载的表字典
+    
+    未加载的表以占位符保存，表名判断、遍历表名和删除都不会触发加载；
+    首次按表名取值时调用loader读取该表的数据文件。
+    """
+    
+    def __init__(self, loader: Callable[[str], None], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loader = loader
+    
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if value is _NOT_LOADED:
+            self._loader(key)
+            value = dict.__getitem__(self, key)
+        return value
+    
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+    
+    def values(self):
+        return [self[key] for key in self]
+    
+    def items(self):
+        return [(key, self[key]) for key in self]
+    
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        return None if value is _NOT_LOADED else value
+    
+    def is_loaded(self, key) -> bool:
+        """表是否已读入内存"""
+        return dict.get(self, key) is not _NOT_LOADED
+
 class ADBError(Exception):
     """ADB自定义异常"""
     def __init__(self, message: str, error_code: str = None):
@@ -65,6 +180,1417 @@ class TableNotFoundError(ADBError):
     """表不存在错误"""
     pass
 
+# 表结构中允许的字段类型（持久化时以类型名保存）
+_SCHEMA_TYPES = {t.__name__: t for t in (str, int, float, bool, list, dict)}
+
+def _encode_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """将表结构转换为可JSON序列化的形式（类型对象 -> 类型名）"""
+    encoded = {}
+    for field, constraints in schema.items():
+        if isinstance(constraints, dict) and isinstance(constraints.get('type'), type):
+            constraints = dict(constraints, type=constraints['type'].__name__)
+        encoded[field] = constraints
+    return encoded
+
+def _decode_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """还原表结构中的类型名为类型对象"""
+    decoded = {}
+    for field, constraints in schema.items():
+        if isinstance(constraints, dict) and constraints.get('type') in _SCHEMA_TYPES:
+            constraints = dict(constraints, type=_SCHEMA_TYPES[constraints['type']])
+        decoded[field] = constraints
+    return decoded
+
+# 压缩快照格式：前导(魔数、格式版本、头部长度、头部CRC32) + 头部JSON + 各表数据块
+# 头部记录每个数据块的偏移、长度、压缩算法和CRC32，数据块为压缩后的紧凑JSON
+_BLOCK_MAGIC = b'ADBZ'
+_BLOCK_FORMAT_VERSION = 1
+_BLOCK_PREAMBLE = struct.Struct('<4sHII')
+_CODECS = {'zlib': zlib, 'bz2': bz2, 'lzma': lzma}
+
+def _compress_block(content: Any, codec: str, level: int) -> bytes:
+    """将内容序列化为紧凑JSON并压缩"""
+    raw = json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if codec == 'zlib':
+        return zlib.compress(raw, level)
+    if codec == 'bz2':
+        return bz2.compress(raw, max(1, min(level, 9)))
+    if codec == 'lzma':
+        return lzma.compress(raw, preset=level)
+    raise ADBError(f"不支持的压缩算法: {codec}")
+
+def _decompress_block(data: bytes, codec: str) -> Any:
+    """解压数据块并解析JSON"""
+    return json.loads(_CODECS[codec].decompress(data))
+
+def _is_block_file(path: Path) -> bool:
+    """通过魔数判断文件是否为压缩快照格式"""
+    with open(path, 'rb') as f:
+        return f.read(len(_BLOCK_MAGIC)) == _BLOCK_MAGIC
+
+def supports_lazy_load(db_path: Union[str, Path]) -> bool:
+    """
+    数据库是否支持延迟加载（目录布局或压缩快照格式）
+    
+    已存在的数据库按实际布局和格式判断，新建的数据库按配置判断；命令行工具和API服务器
+    据此决定是否开启 lazy_load，单文件JSON数据库上不会因此记录警告。
+    """
+    path = Path(db_path)
+    if path.is_dir():
+        return True
+    if path.is_file():
+        return _is_block_file(path)
+    if CONFIG_AVAILABLE:
+        return (config.get('database.storage_layout', 'file') == 'directory' or
+                config.get('database.snapshot_format', 'json') == 'compressed')
+    return False
+
+def _write_block_file(path: Path, meta: Dict[str, Any], blocks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    写入压缩快照文件
+    
+    Args:
+        path: 目标路径
+        meta: 头部元数据
+        blocks: 数据块列表，每项包含 name、codec、data(已压缩字节) 及其他元数据
+        
+    Returns:
+        Dict: 写入的头部（含 data_start）
+    """
+    entries = []
+    offset = 0
+    for block in blocks:
+        entry = {key: value for key, value in block.items() if key != 'data'}
+        entry.update(offset=offset, length=len(block['data']), crc32=zlib.crc32(block['data']))
+        entries.append(entry)
+        offset += len(block['data'])
+    
+    header = {'meta': meta, 'blocks': entries}
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(_BLOCK_PREAMBLE.pack(_BLOCK_MAGIC, _BLOCK_FORMAT_VERSION,
+                                     len(header_bytes), zlib.crc32(header_bytes)))
+        f.write(header_bytes)
+        for block in blocks:
+            f.write(block['data'])
+    
+    header['data_start'] = _BLOCK_PREAMBLE.size + len(header_bytes)
+    return header
+
+def _read_block_header(f: BinaryIO) -> Dict[str, Any]:
+    """读取并校验压缩快照的头部"""
+    preamble = f.read(_BLOCK_PREAMBLE.size)
+    if len(preamble) != _BLOCK_PREAMBLE.size:
+        raise ADBError("快照文件不完整")
+    magic, version, header_length, header_crc = _BLOCK_PREAMBLE.unpack(preamble)
+    if magic != _BLOCK_MAGIC:
+        raise ADBError("不是压缩快照文件")
+    if version > _BLOCK_FORMAT_VERSION:
+        raise ADBError(f"不支持的快照格式版本: {version}")
+    
+    header_bytes = f.read(header_length)
+    if len(header_bytes) != header_length or zlib.crc32(header_bytes) != header_crc:
+        raise ADBError("快照头部校验失败，文件可能在写入时中断")
+    header = json.loads(header_bytes)
+    header['data_start'] = _BLOCK_PREAMBLE.size + header_length
+    return header
+
+def _read_raw_block(f: BinaryIO, data_start: int, block: Dict[str, Any]) -> bytes:
+    """读取一个数据块的压缩字节并校验CRC"""
+    f.seek(data_start + block['offset'])
+    data = f.read(block['length'])
+    if len(data) != block['length'] or zlib.crc32(data) != block['crc32']:
+        raise ADBError(f"数据块 '{block['name']}' 校验失败，文件可能在写入时中断")
+    return data
+
+_RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+_SCAN_ROW_COST = 1.0   # 代价模型：逐条检查一条记录是否满足条件的代价
+_INDEX_ROW_COST = 0.1  # 代价模型：从索引取出（合并、排序）一个候选记录位置的代价
+_HISTOGRAM_BUCKETS = 32  # analyze_table 为每列生成的等深直方图桶数
+_MCV_SIZE = 10           # analyze_table 为每列记录的最常见值个数
+_STATS_SAMPLE_SIZE = 256  # analyze_table 为每列保留的样本数（用于估计 $like 的选择率）
+_PREDICATE_CACHE_SIZE = 256  # 按条件结构缓存的已编译谓词数量
+_DEFAULT_SELECTIVITY = {'eq': 0.1, 'range': 1 / 3, 'like': 0.1, 'text': 0.1}  # 没有统计信息时的选择率
+_INDEX_BUILD_CHUNK = 10000  # 在线构建索引时每次持锁处理的记录数
+_AUTO_INDEX_INTERVAL = 100  # 自动索引模式下每张表每执行多少次查询评估一次索引建议
+
+def _order_key(value: Any) -> Optional[tuple]:
+    """有序索引的排序键：数字和字符串分组排序，其他类型（及NaN）不参与有序索引"""
+    if isinstance(value, (int, float)) and value == value:
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    return None
+
+def _sort_key(value: Any) -> tuple:
+    """order_by 的排序键：数字在字符串之前；缺失、null 和不可排序的值（列表、字典等）排在最前"""
+    key = _order_key(value) if value is not None else None
+    return key if key is not None else (-1,)
+
+class _Descending:
+    """降序排序键：比较结果与原排序键相反"""
+    
+    __slots__ = ('key',)
+    
+    def __init__(self, key: tuple):
+        self.key = key
+    
+    def __lt__(self, other: '_Descending') -> bool:
+        return other.key < self.key
+    
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, _Descending) and self.key == other.key
+
+def _parse_order_by(order_by: Any) -> List[tuple]:
+    """
+    解析 order_by：列名，或列名与 'asc'/'desc' 组成的对的列表（如 [('price', 'desc'), '_id']）
+    
+    Returns:
+        List[tuple]: (列名, 是否降序) 的列表
+    """
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    if not isinstance(order_by, (list, tuple)) or not order_by:
+        raise ValidationError("order_by 必须是列名或 (列名, 'asc'/'desc') 的列表")
+    result = []
+    for item in order_by:
+        column, direction = (item, 'asc') if isinstance(item, str) else tuple(item)
+        if not isinstance(column, str) or str(direction).lower() not in ('asc', 'desc'):
+            raise ValidationError(f"无效的排序项: {item}")
+        result.append((column, str(direction).lower() == 'desc'))
+    return result
+
+def _record_sort_key(order: List[tuple]) -> Callable[[Dict[str, Any]], tuple]:
+    """按解析后的 order_by 生成记录的排序键函数（降序列的键比较结果相反）"""
+    if not any(descending for _, descending in order):
+        return lambda record: tuple(_sort_key(record.get(column)) for column, _ in order)
+    return lambda record: tuple(_Descending(_sort_key(record.get(column))) if descending
+                                else _sort_key(record.get(column)) for column, descending in order)
+
+def _shift_positions(positions: List[int], removed: List[int]) -> List[int]:
+    """删除记录后，将位置列表中的位置前移（removed 为已排序的被删除位置）"""
+    return [position - bisect.bisect_left(removed, position) for position in positions]
+
+def _remove_sorted(positions: List[int], position: int) -> None:
+    """从有序位置列表中移除一个位置（不存在时忽略）"""
+    i = bisect.bisect_left(positions, position)
+    if i < len(positions) and positions[i] == position:
+        del positions[i]
+
+class _HashIndex:
+    """哈希索引：值 -> 记录位置列表（有序），只支持等值查询"""
+    
+    kind = 'hash'
+    
+    def __init__(self, column: str, entries: Optional[Dict[Any, List[int]]] = None):
+        self.column = column
+        self.columns = [column]
+        self.entries = entries if entries is not None else {}
+    
+    def empty(self) -> '_HashIndex':
+        """创建同一列上的空索引"""
+        return _HashIndex(self.column)
+    
+    def build(self, records: List[Dict[str, Any]]) -> None:
+        """根据全部记录重建索引"""
+        self.entries = {}
+        for i, record in enumerate(records):
+            if record is not None:
+                self.add(record, i)
+    
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        """加入一条记录"""
+        if self.column in record:
+            bisect.insort(self.entries.setdefault(record[self.column], []), position)
+    
+    def remove(self, record: Dict[str, Any], position: int) -> None:
+        """移除一条记录（record 为记录修改前的内容）"""
+        if self.column not in record:
+            return
+        bucket = self.entries.get(record[self.column])
+        if bucket is None:
+            return
+        i = bisect.bisect_left(bucket, position)
+        if i < len(bucket) and bucket[i] == position:
+            del bucket[i]
+            if not bucket:
+                del self.entries[record[self.column]]
+    
+    def shift(self, removed: List[int]) -> None:
+        """删除记录后调整其余记录的位置"""
+        for value, bucket in self.entries.items():
+            self.entries[value] = _shift_positions(bucket, removed)
+    
+    def clear(self) -> None:
+        """清空索引"""
+        self.entries = {}
+    
+    def lookup(self, value: Any) -> Optional[List[int]]:
+        """等值查询，值不可哈希时返回None"""
+        try:
+            return self.entries.get(value, [])
+        except TypeError:
+            return None
+    
+    def range(self, low: Any = None, low_inclusive: bool = True,
+              high: Any = None, high_inclusive: bool = True) -> Optional[List[int]]:
+        """哈希索引不支持范围查询"""
+        return None
+    
+    def __eq__(self, other: Any) -> bool:
+        return (type(self) is type(other) and self.columns == other.columns
+                and self.entries == other.entries)
+    
+    def to_json(self) -> Dict[str, Any]:
+        """
+        序列化为快照中保存的格式
+        
+        保存为 [值, 位置列表] 对而不是以值为键的对象，
+        JSON对象的键只能是字符串，按对保存可保留 int/float/bool/None 等类型。
+        """
+        return {
+            'kind': self.kind,
+            'entries': [[key, positions] for key, positions in self.entries.items()]
+        }
+
+class _SortedIndex:
+    """
+    有序索引：按值排序的数组，通过二分查找回答等值和范围查询
+    
+    keys 与 positions 一一对应；不含该列的记录单独记录在 missing 中，
+    因为范围条件对缺少该列的记录不做限制（与全表扫描的语义一致）。
+    """
+    
+    kind = 'sorted'
+    
+    def __init__(self, column: str):
+        self.column = column
+        self.columns = [column]
+        self.keys = []       # 排序后的 (类型序, 值)
+        self.positions = []  # 每个键对应的记录位置列表
+        self.missing = []    # 不含该列的记录位置
+    
+    def empty(self) -> '_SortedIndex':
+        """创建同一列上的空索引"""
+        return _SortedIndex(self.column)
+    
+    def build(self, records: List[Dict[str, Any]]) -> None:
+        """根据全部记录重建索引"""
+        groups = {}
+        self.missing = []
+        for i, record in enumerate(records):
+            if record is None:
+                continue
+            if self.column not in record:
+                self.missing.append(i)
+                continue
+            key = _order_key(record[self.column])
+            if key is not None:
+                groups.setdefault(key, []).append(i)
+        self.keys = sorted(groups)
+        self.positions = [groups[key] for key in self.keys]
+    
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        """加入一条记录"""
+        if self.column not in record:
+            bisect.insort(self.missing, position)
+            return
+        key = _order_key(record[self.column])
+        if key is None:
+            return
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            bisect.insort(self.positions[i], position)
+        else:
+            self.keys.insert(i, key)
+            self.positions.insert(i, [position])
+    
+    def remove(self, record: Dict[str, Any], position: int) -> None:
+        """移除一条记录（record 为记录修改前的内容）"""
+        if self.column not in record:
+            bucket, i = self.missing, None
+        else:
+            key = _order_key(record[self.column])
+            if key is None:
+                return
+            i = bisect.bisect_left(self.keys, key)
+            if i == len(self.keys) or self.keys[i] != key:
+                return
+            bucket = self.positions[i]
+        
+        j = bisect.bisect_left(bucket, position)
+        if j < len(bucket) and bucket[j] == position:
+            del bucket[j]
+            if not bucket and i is not None:
+                del self.keys[i]
+                del self.positions[i]
+    
+    def shift(self, removed: List[int]) -> None:
+        """删除记录后调整其余记录的位置"""
+        self.positions = [_shift_positions(bucket, removed) for bucket in self.positions]
+        self.missing = _shift_positions(self.missing, removed)
+    
+    def clear(self) -> None:
+        """清空索引"""
+        self.keys, self.positions, self.missing = [], [], []
+    
+    def lookup(self, value: Any) -> Optional[List[int]]:
+        """等值查询，值不能排序时返回None"""
+        key = _order_key(value)
+        if key is None:
+            return None
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.positions[i]
+        return []
+    
+    def range(self, low: Any = None, low_inclusive: bool = True,
+              high: Any = None, high_inclusive: bool = True) -> Optional[List[int]]:
+        """
+        范围查询，返回按位置排序的候选记录
+        
+        边界值不能排序，或上下界类型不可比较时返回None（由调用方回退到全表扫描）。
+        """
+        bounds = self._range_slice(low, low_inclusive, high, high_inclusive)
+        if bounds is None:
+            return None
+        result = [position for group in self.positions[bounds[0]:bounds[1]] for position in group]
+        result.extend(self.missing)
+        result.sort()
+        return result
+    
+    def range_count(self, low: Any = None, low_inclusive: bool = True,
+                    high: Any = None, high_inclusive: bool = True) -> Optional[int]:
+        """范围查询的候选记录数（不展开位置列表），不能回答时返回None"""
+        bounds = self._range_slice(low, low_inclusive, high, high_inclusive)
+        if bounds is None:
+            return None
+        return sum(map(len, self.positions[bounds[0]:bounds[1]])) + len(self.missing)
+    
+    def _range_slice(self, low: Any, low_inclusive: bool, high: Any, high_inclusive: bool) -> Optional[tuple]:
+        """范围条件对应的键下标区间 (start, end)"""
+        low_key = _order_key(low) if low is not None else None
+        high_key = _order_key(high) if high is not None else None
+        if (low is not None and low_key is None) or (high is not None and high_key is None):
+            return None
+        if low_key is None and high_key is None:
+            return None
+        if low_key and high_key and low_key[0] != high_key[0]:
+            return None
+        
+        # 无上界或下界时限定在同类型的键范围内
+        rank = (low_key or high_key)[0]
+        if low_key is None:
+            start = bisect.bisect_left(self.keys, (rank,))
+        elif low_inclusive:
+            start = bisect.bisect_left(self.keys, low_key)
+        else:
+            start = bisect.bisect_right(self.keys, low_key)
+        if high_key is None:
+            end = bisect.bisect_left(self.keys, (rank + 1,))
+        elif high_inclusive:
+            end = bisect.bisect_right(self.keys, high_key)
+        else:
+            end = bisect.bisect_left(self.keys, high_key)
+        return start, end
+    
+    def __eq__(self, other: Any) -> bool:
+        return (type(self) is type(other) and self.columns == other.columns
+                and self.keys == other.keys and self.positions == other.positions
+                and self.missing == other.missing)
+    
+    def to_json(self) -> Dict[str, Any]:
+        """序列化为快照中保存的格式（按键的顺序保存 [值, 位置列表] 对）"""
+        return {
+            'kind': self.kind,
+            'entries': [[key[1], positions] for key, positions in zip(self.keys, self.positions)],
+            'missing': self.missing
+        }
+
+class _CompositeIndex(_HashIndex):
+    """
+    复合索引：多列取值组成的元组 -> 记录位置列表
+    
+    只回答所有列都是等值条件的查询；缺少任一列的记录不进入索引。
+    """
+    
+    kind = 'composite'
+    
+    def __init__(self, columns: List[str], entries: Optional[Dict[tuple, List[int]]] = None):
+        super().__init__(_index_name(columns), entries)
+        self.columns = list(columns)
+    
+    def empty(self) -> '_CompositeIndex':
+        """创建同一组列上的空索引"""
+        return _CompositeIndex(self.columns)
+    
+    def _key(self, record: Dict[str, Any]) -> Optional[tuple]:
+        """记录在索引中的键，缺少任一列时返回None"""
+        if not all(column in record for column in self.columns):
+            return None
+        return tuple(record[column] for column in self.columns)
+    
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        """加入一条记录"""
+        key = self._key(record)
+        if key is not None:
+            bisect.insort(self.entries.setdefault(key, []), position)
+    
+    def remove(self, record: Dict[str, Any], position: int) -> None:
+        """移除一条记录（record 为记录修改前的内容）"""
+        key = self._key(record)
+        bucket = self.entries.get(key) if key is not None else None
+        if bucket is None:
+            return
+        i = bisect.bisect_left(bucket, position)
+        if i < len(bucket) and bucket[i] == position:
+            del bucket[i]
+            if not bucket:
+                del self.entries[key]
+    
+    def to_json(self) -> Dict[str, Any]:
+        """序列化为快照中保存的格式（元组键保存为列表）"""
+        return {
+            'kind': self.kind,
+            'columns': self.columns,
+            'entries': [[list(key), positions] for key, positions in self.entries.items()]
+        }
+
+# 位图索引中稀疏取值按位置列表存储时，每个位置的估计内存占用（列表指针加整数对象）
+_BITMAP_SPARSE_BYTES = 32
+
+# 每个字节值中置位的比特序号，用于把位图展开为记录位置
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+def _popcount(bits: int) -> int:
+    """位图中置位的数量"""
+    return bin(bits).count('1')
+
+def _bits_to_positions(bits: int) -> List[int]:
+    """将位图展开为有序的记录位置列表"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    return [i * 8 + bit for i, byte in enumerate(data) if byte for bit in _BYTE_BITS[byte]]
+
+class _BitmapIndex:
+    """
+    位图索引：每个取值一个位集合（bytearray，第 i 位表示第 i 个记录位置）
+    
+    适合取值种类少的列：内存占用与取值数×记录数/8 成正比，不随每条记录增加对象；
+    多个等值 / $in 条件查询时转换为整数做按位与、或运算，统计时直接计算置位数。
+    出现次数很少的取值（位置列表比位集合小）改存为有序位置列表，取值种类多的列
+    内存占用不会按 取值数×记录数 增长。
+    """
+    
+    kind = 'bitmap'
+    
+    def __init__(self, column: str):
+        self.column = column
+        self.columns = [column]
+        self.entries = {}  # 值 -> bytearray，或稀疏取值的有序位置列表
+        self.counts = {}   # 值 -> 置位数
+    
+    def empty(self) -> '_BitmapIndex':
+        """创建同一列上的空索引"""
+        return _BitmapIndex(self.column)
+    
+    def build(self, records: List[Dict[str, Any]]) -> None:
+        """根据全部记录重建索引"""
+        groups = {}
+        for i, record in enumerate(records):
+            if record is not None and self.column in record:
+                groups.setdefault(record[self.column], []).append(i)
+        self._load_groups(groups)
+    
+    @staticmethod
+    def _is_sparse(count: int, last_position: int) -> bool:
+        """位置列表（每个位置约 _BITMAP_SPARSE_BYTES 字节）是否比位集合小"""
+        return count * _BITMAP_SPARSE_BYTES < last_position // 8 + 1
+    
+    @staticmethod
+    def _to_bitmap(positions: List[int]) -> bytearray:
+        """由有序位置列表生成位集合"""
+        bitmap = bytearray(positions[-1] // 8 + 1)
+        for position in positions:
+            bitmap[position >> 3] |= 1 << (position & 7)
+        return bitmap
+    
+    def _load_groups(self, groups: Dict[Any, List[int]]) -> None:
+        """由 值 -> 位置列表 生成各取值的位集合（稀疏取值保留位置列表）"""
+        self.entries, self.counts = {}, {}
+        for value, positions in groups.items():
+            if self._is_sparse(len(positions), positions[-1]):
+                self.entries[value] = list(positions)
+            else:
+                self.entries[value] = self._to_bitmap(positions)
+            self.counts[value] = len(positions)
+    
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        """加入一条记录"""
+        if self.column not in record:
+            return
+        value = record[self.column]
+        bitmap = self.entries.get(value)
+        if bitmap is None:
+            bitmap = self.entries[value] = [] if self._is_sparse(1, position) else bytearray()
+        if isinstance(bitmap, list):
+            i = bisect.bisect_left(bitmap, position)
+            if i < len(bitmap) and bitmap[i] == position:
+                return
+            bitmap.insert(i, position)
+            self.counts[value] = len(bitmap)
+            if not self._is_sparse(len(bitmap), bitmap[-1]):
+                self.entries[value] = self._to_bitmap(bitmap)
+            return
+        byte = position >> 3
+        if byte >= len(bitmap):
+            bitmap.extend(bytes(byte + 1 - len(bitmap)))
+        if not bitmap[byte] & (1 << (position & 7)):
+            bitmap[byte] |= 1 << (position & 7)
+            self.counts[value] = self.counts.get(value, 0) + 1
+    
+    def remove(self, record: Dict[str, Any], position: int) -> None:
+        """移除一条记录（record 为记录修改前的内容）"""
+        if self.column not in record:
+            return
+        value = record[self.column]
+        bitmap = self.entries.get(value)
+        if isinstance(bitmap, list):
+            i = bisect.bisect_left(bitmap, position)
+            if i == len(bitmap) or bitmap[i] != position:
+                return
+            del bitmap[i]
+        else:
+            byte = position >> 3
+            if bitmap is None or byte >= len(bitmap) or not bitmap[byte] & (1 << (position & 7)):
+                return
+            bitmap[byte] &= ~(1 << (position & 7)) & 0xFF
+        self.counts[value] -= 1
+        if not self.counts[value]:
+            del self.entries[value]
+            del self.counts[value]
+    
+    def shift(self, removed: List[int]) -> None:
+        """删除记录后调整其余记录的位置"""
+        self._load_groups({value: _shift_positions(self.positions(value), removed)
+                           for value in self.entries})
+    
+    def clear(self) -> None:
+        """清空索引"""
+        self.entries, self.counts = {}, {}
+    
+    def bits(self, value: Any) -> Optional[int]:
+        """取值对应的位图（整数形式），值不可哈希时返回None"""
+        try:
+            bitmap = self.entries.get(value)
+        except TypeError:
+            return None
+        if isinstance(bitmap, list):
+            bitmap = self._to_bitmap(bitmap)
+        return int.from_bytes(bitmap, 'little') if bitmap else 0
+    
+    def positions(self, value: Any) -> List[int]:
+        """取值对应的记录位置列表"""
+        return self.lookup(value) or []
+    
+    def lookup(self, value: Any) -> Optional[List[int]]:
+        """等值查询，值不可哈希时返回None"""
+        try:
+            bitmap = self.entries.get(value)
+        except TypeError:
+            return None
+        if isinstance(bitmap, list):
+            return list(bitmap)
+        return _bits_to_positions(int.from_bytes(bitmap, 'little')) if bitmap else []
+    
+    def range(self, low: Any = None, low_inclusive: bool = True,
+              high: Any = None, high_inclusive: bool = True) -> Optional[List[int]]:
+        """位图索引不支持范围查询"""
+        return None
+    
+    def __eq__(self, other: Any) -> bool:
+        return (type(self) is type(other) and self.columns == other.columns
+                and {value: self.positions(value) for value in self.entries}
+                == {value: other.positions(value) for value in other.entries})
+    
+    def to_json(self) -> Dict[str, Any]:
+        """序列化为快照中保存的格式（[值, 位置列表] 对）"""
+        return {
+            'kind': self.kind,
+            'entries': [[value, self.positions(value)] for value in self.entries]
+        }
+
+def _is_cjk(char: str) -> bool:
+    """是否为中日韩文字（这类文本按二元组切分）"""
+    return ('\u4e00' <= char <= '\u9fff' or '\u3400' <= char <= '\u4dbf'
+            or '\u3040' <= char <= '\u30ff' or '\uac00' <= char <= '\ud7af')
+
+def _ngrams(text: str) -> set:
+    """
+    将（已转为小写的）文本切分为 n 元组：含中日韩文字的位置取二元组，其余取三元组
+    
+    每个 n 元组只由窗口内的字符决定，因此子串的 n 元组一定都出现在原文本中。
+    """
+    grams = set()
+    for i in range(len(text) - 1):
+        pair = text[i:i + 2]
+        if _is_cjk(pair[0]) or _is_cjk(pair[1]):
+            grams.add(pair)
+        triple = text[i:i + 3]
+        if len(triple) == 3 and not any(_is_cjk(char) for char in triple):
+            grams.add(triple)
+    return grams
+
+class _NgramIndex:
+    """
+    N 元组索引：n 元组 -> 包含它的记录位置列表（有序），用于 $like 子串匹配预筛选
+    
+    查询串的所有 n 元组的位置列表求交集得到候选记录，再逐条做精确匹配；
+    与全表扫描的语义一致，不含该列的记录总是候选记录（记录在 missing 中）。
+    """
+    
+    kind = 'ngram'
+    
+    def __init__(self, column: str):
+        self.column = column
+        self.columns = [column]
+        self.postings = {}  # n 元组 -> 记录位置列表
+        self.missing = []   # 不含该列的记录位置
+    
+    def empty(self) -> '_NgramIndex':
+        """创建同一列上的空索引"""
+        return _NgramIndex(self.column)
+    
+    def _grams(self, record: Dict[str, Any]) -> set:
+        return _ngrams(str(record[self.column]).lower())
+    
+    def build(self, records: List[Dict[str, Any]]) -> None:
+        """根据全部记录重建索引"""
+        self.postings, self.missing = {}, []
+        for i, record in enumerate(records):
+            if record is None:
+                continue
+            if self.column not in record:
+                self.missing.append(i)
+                continue
+            for gram in self._grams(record):
+                self.postings.setdefault(gram, []).append(i)
+    
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        """加入一条记录"""
+        if self.column not in record:
+            bisect.insort(self.missing, position)
+            return
+        for gram in self._grams(record):
+            bisect.insort(self.postings.setdefault(gram, []), position)
+    
+    def remove(self, record: Dict[str, Any], position: int) -> None:
+        """移除一条记录（record 为记录修改前的内容）"""
+        if self.column not in record:
+            _remove_sorted(self.missing, position)
+            return
+        for gram in self._grams(record):
+            positions = self.postings.get(gram)
+            if positions is not None:
+                _remove_sorted(positions, position)
+                if not positions:
+                    del self.postings[gram]
+    
+    def shift(self, removed: List[int]) -> None:
+        """删除记录后调整其余记录的位置"""
+        self.postings = {gram: _shift_positions(positions, removed)
+                         for gram, positions in self.postings.items()}
+        self.missing = _shift_positions(self.missing, removed)
+    
+    def clear(self) -> None:
+        """清空索引"""
+        self.postings, self.missing = {}, []
+    
+    def search(self, pattern: Any) -> Optional[List[int]]:
+        """$like 条件的候选记录位置；查询串太短切不出 n 元组时返回None"""
+        if not isinstance(pattern, str):
+            return None
+        grams = _ngrams(pattern.lower())
+        if not grams:
+            return None
+        lists = sorted((self.postings.get(gram, []) for gram in grams), key=len)
+        result = lists[0]
+        for positions in lists[1:]:
+            if not result:
+                break
+            members = set(positions)
+            result = [position for position in result if position in members]
+        return sorted(result + self.missing) if self.missing else list(result)
+    
+    def lookup(self, value: Any) -> Optional[List[int]]:
+        """N 元组索引不回答等值查询"""
+        return None
+    
+    def range(self, low: Any = None, low_inclusive: bool = True,
+              high: Any = None, high_inclusive: bool = True) -> Optional[List[int]]:
+        """N 元组索引不支持范围查询"""
+        return None
+    
+    def __eq__(self, other: Any) -> bool:
+        return (type(self) is type(other) and self.columns == other.columns
+                and self.postings == other.postings and self.missing == other.missing)
+    
+    def to_json(self) -> Dict[str, Any]:
+        """只保存索引类型，加载时按记录重建（n 元组表比原文本大得多）"""
+        return {'kind': self.kind}
+
+_CJK_CHARS = '\u3400-\u4dbf\u4e00-\u9fff\u3040-\u30ff\uac00-\ud7af'
+_CJK_OR_WORD = re.compile(f'[{_CJK_CHARS}]+|[^\\W{_CJK_CHARS}]+')
+
+def _tokenize_whitespace(text: str) -> List[str]:
+    """按空白切分并转为小写"""
+    return text.lower().split()
+
+def _tokenize_cjk_bigram(text: str) -> List[str]:
+    """中日韩文字按相邻二元组切分（单字单独成词），其他文字按单词切分"""
+    tokens = []
+    for run in _CJK_OR_WORD.findall(text.lower()):
+        if _is_cjk(run[0]) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+_TOKENIZERS = {'whitespace': _tokenize_whitespace, 'cjk_bigram': _tokenize_cjk_bigram}
+
+def register_tokenizer(name: str, tokenizer: Callable[[str], List[str]]) -> None:
+    """
+    注册全文索引分词器
+    
+    使用自定义分词器的索引只在快照中保存分词器名称，打开数据库前需先注册同名分词器。
+    
+    Args:
+        name: 分词器名称
+        tokenizer: 接收文本、返回词项列表的函数
+    """
+    _TOKENIZERS[name] = tokenizer
+
+class _FulltextIndex:
+    """
+    全文倒排索引：词项 -> {记录位置: 词频}，用于 $text 关键词查询和 BM25 相关度排序
+    
+    含任一查询词项的记录即为匹配；$text 条件只能由全文索引求值。
+    """
+    
+    kind = 'fulltext'
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self, column: str, tokenizer: str = 'cjk_bigram'):
+        if tokenizer not in _TOKENIZERS:
+            raise ADBError(f"未注册的分词器: {tokenizer}")
+        self.column = column
+        self.columns = [column]
+        self.tokenizer = tokenizer
+        self.postings = {}  # 词项 -> {记录位置: 词频}
+        self.lengths = {}   # 记录位置 -> 词项数
+        self.total_length = 0
+    
+    def empty(self) -> '_FulltextIndex':
+        """创建同一列上的空索引"""
+        return _FulltextIndex(self.column, self.tokenizer)
+    
+    def tokenize(self, text: Any) -> List[str]:
+        """用索引的分词器切分文本"""
+        return _TOKENIZERS[self.tokenizer](str(text))
+    
+    def build(self, records: List[Dict[str, Any]]) -> None:
+        """根据全部记录重建索引"""
+        self.clear()
+        for i, record in enumerate(records):
+            if record is not None:
+                self.add(record, i)
+    
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        """加入一条记录"""
+        if record.get(self.column) is None:
+            return
+        terms = self.tokenize(record[self.column])
+        for term, frequency in Counter(terms).items():
+            self.postings.setdefault(term, {})[position] = frequency
+        self.lengths[position] = len(terms)
+        self.total_length += len(terms)
+    
+    def remove(self, record: Dict[str, Any], position: int) -> None:
+        """移除一条记录（record 为记录修改前的内容）"""
+        if record.get(self.column) is None or position not in self.lengths:
+            return
+        for term in set(self.tokenize(record[self.column])):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(position, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(position)
+    
+    def shift(self, removed: List[int]) -> None:
+        """删除记录后调整其余记录的位置"""
+        def moved(position):
+            return position - bisect.bisect_left(removed, position)
+        self.postings = {term: {moved(position): frequency for position, frequency in postings.items()}
+                         for term, postings in self.postings.items()}
+        self.lengths = {moved(position): length for position, length in self.lengths.items()}
+    
+    def clear(self) -> None:
+        """清空索引"""
+        self.postings, self.lengths, self.total_length = {}, {}, 0
+    
+    def search(self, query: Any) -> Optional[List[int]]:
+        """含任一查询词项的记录位置；查询不是字符串时返回None"""
+        if not isinstance(query, str):
+            return None
+        matched = set()
+        for term in set(self.tokenize(query)):
+            matched.update(self.postings.get(term, ()))
+        return sorted(matched)
+    
+    def scores(self, query: str, positions: List[int]) -> Dict[int, float]:
+        """计算候选记录对查询的 BM25 相关度"""
+        candidates = set(positions)
+        scores = dict.fromkeys(positions, 0.0)
+        documents = len(self.lengths)
+        average = self.total_length / documents if documents else 0.0
+        for term in set(self.tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings.items():
+                if position in candidates:
+                    norm = 1 - self.B + self.B * self.lengths[position] / average
+                    scores[position] += idf * frequency * (self.K1 + 1) / (frequency + self.K1 * norm)
+        return scores
+    
+    def lookup(self, value: Any) -> Optional[List[int]]:
+        """全文索引不回答等值查询"""
+        return None
+    
+    def range(self, low: Any = None, low_inclusive: bool = True,
+              high: Any = None, high_inclusive: bool = True) -> Optional[List[int]]:
+        """全文索引不支持范围查询"""
+        return None
+    
+    def __eq__(self, other: Any) -> bool:
+        return (type(self) is type(other) and self.columns == other.columns
+                and self.tokenizer == other.tokenizer
+                and self.postings == other.postings and self.lengths == other.lengths)
+    
+    def to_json(self) -> Dict[str, Any]:
+        """只保存索引类型和分词器名称，加载时按记录重建"""
+        return {'kind': self.kind, 'tokenizer': self.tokenizer}
+
+_MISSING = object()
+
+def _key_lower(value: Any) -> Any:
+    return value.lower() if isinstance(value, str) else value
+
+def _key_date(value: Any) -> Any:
+    return str(value)[:10]  # ISO 格式时间截取到日期
+
+# 表达式索引与表达式条件使用的键函数：参数为（可用点号表示嵌套路径的）列的值
+_KEY_FUNCTIONS = {'lower': _key_lower, 'date': _key_date, 'path': lambda value: value}
+
+def register_key_function(name: str, func: Callable[[Any], Any]) -> None:
+    """
+    注册表达式键函数，注册后可使用 name(列名) 形式的索引名和查询条件
+    
+    使用自定义键函数的表达式索引只在快照中保存表达式，打开数据库前需先注册同名函数。
+    
+    Args:
+        name: 函数名
+        func: 接收列值、返回键的函数
+    """
+    _KEY_FUNCTIONS[name] = func
+    _parse_expression.cache_clear()
+    _predicate_factory.cache_clear()
+
+@lru_cache(maxsize=1024)
+def _parse_expression(key: str) -> Optional[tuple]:
+    """解析 函数名(列路径) 形式的表达式，返回 (函数名, 路径各级)；不是已注册函数的表达式时返回None"""
+    match = re.fullmatch(r'(\w+)\(([^()]+)\)', key)
+    if match is None or match.group(1) not in _KEY_FUNCTIONS:
+        return None
+    return match.group(1), tuple(match.group(2).strip().split('.'))
+
+def _expression_value(record: Dict[str, Any], expression: tuple) -> Any:
+    """计算记录的表达式值，路径不存在时返回 _MISSING"""
+    name, path = expression
+    value = record
+    for part in path:
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return _KEY_FUNCTIONS[name](value)
+
+def _match_condition(record: Dict[str, Any], condition: Dict[str, Any]) -> bool:
+    """检查记录是否匹配条件"""
+    for key, value in condition.items():
+        if key not in record:
+            expression = _parse_expression(key) if '(' in key else None
+            if expression is not None:
+                # 表达式条件（如 lower(email)）按记录的派生值判断
+                derived = _expression_value(record, expression)
+                if derived is _MISSING:
+                    # 与缺少该列一样：不满足等值和 $in 条件，范围和 $like 条件不做限制
+                    if not isinstance(value, dict) or '$in' in value:
+                        return False
+                elif not _match_condition({key: derived}, {key: value}):
+                    return False
+                continue
+        if isinstance(value, dict):
+            # 支持范围查询
+            if '$gt' in value and key in record and record[key] <= value['$gt']:
+                return False
+            if '$lt' in value and key in record and record[key] >= value['$lt']:
+                return False
+            if '$gte' in value and key in record and record[key] < value['$gte']:
+                return False
+            if '$lte' in value and key in record and record[key] > value['$lte']:
+                return False
+            if '$like' in value and key in record:
+                if value['$like'].lower() not in str(record[key]).lower():
+                    return False
+            if '$in' in value and (key not in record or record[key] not in value['$in']):
+                return False
+            # $text 条件由全文索引求值，候选记录已经满足
+        else:
+            if key not in record or record[key] != value:
+                return False
+    return True
+
+_PREDICATE_OPERATORS = ('$gt', '$lt', '$gte', '$lte', '$like', '$in')  # 按 _match_condition 的检查顺序
+_PREDICATE_CHECKS = {'$gt': 'v <= {}', '$lt': 'v >= {}', '$gte': 'v < {}', '$lte': 'v > {}',
+                     '$like': '{} not in str(v).lower()'}
+
+def _condition_shape(condition: Dict[str, Any]) -> Optional[tuple]:
+    """
+    条件的结构：每列的 (列名, 操作符元组)，等值条件的操作符为None；不含具体取值。
+    列名不是字符串、$like 的值不是字符串时返回None（不编译，逐条解释执行）。
+    """
+    shape = []
+    for key, value in condition.items():
+        if not isinstance(key, str):
+            return None
+        if isinstance(value, dict):
+            if '$like' in value and not isinstance(value['$like'], str):
+                return None
+            shape.append((key, tuple(op for op in _PREDICATE_OPERATORS if op in value)))
+        else:
+            shape.append((key, None))
+    return tuple(shape)
+
+@lru_cache(maxsize=_PREDICATE_CACHE_SIZE)
+def _predicate_factory(shape: tuple) -> Callable[..., Callable[[Dict[str, Any]], bool]]:
+    """
+    把一种条件结构编译为谓词工厂：工厂接收条件中的取值，返回检查单条记录的函数
+    
+    生成的代码与 _match_condition 的判断逐项一致，但列名、操作符和检查顺序都已展开，
+    逐条记录时不再解析条件字典；$like 的查询串预先转为小写，$in 的取值预先转为集合。
+    """
+    params, lines = [], []
+    
+    def checks(column_ops: Optional[tuple], names: List[str], indent: str) -> None:
+        for op, name in zip(('$eq',) if column_ops is None else column_ops, names):
+            if op == '$in':
+                # 先按集合查找，记录值不可哈希时退回按原取值逐个比较
+                lines.extend([f'{indent}try:', f'{indent}    if v not in {name}: return False',
+                              f'{indent}except TypeError:', f'{indent}    if v not in {name}_raw: return False'])
+            elif op == '$eq':
+                lines.append(f'{indent}if v != {name}: return False')
+            else:
+                lines.append(f'{indent}if {_PREDICATE_CHECKS[op].format(name)}: return False')
+    
+    def absent(column_ops: Optional[tuple], indent: str) -> None:
+        # 缺少该列的记录不满足等值和 $in 条件，范围和 $like 条件不做限制
+        lines.append(f'{indent}return False' if column_ops is None or '$in' in column_ops else f'{indent}pass')
+    
+    namespace = {'_expression_value': _expression_value, '_MISSING': _MISSING}
+    for i, (key, column_ops) in enumerate(shape):
+        names = []
+        for op in ('$eq',) if column_ops is None else column_ops:
+            names.append(f'p{len(params)}')
+            params.extend([names[-1], names[-1] + '_raw'] if op == '$in' else [names[-1]])
+        if column_ops == ():
+            continue  # 只有 $text 等不在此求值的操作符
+        lines.extend([f'if {key!r} in record:', f'    v = record[{key!r}]'])
+        checks(column_ops, names, ' ' * 4)
+        expression = _parse_expression(key) if '(' in key else None
+        if expression is None:
+            lines.append('else:')
+            absent(column_ops, ' ' * 4)
+        else:
+            # 表达式条件（如 lower(email)）按记录的派生值判断
+            namespace[f'e{i}'] = expression
+            lines.extend(['else:', f'    v = _expression_value(record, e{i})', '    if v is not _MISSING:'])
+            checks(column_ops, names, ' ' * 8)
+            lines.append('    else:')
+            absent(column_ops, ' ' * 8)
+    source = '\n'.join([f'def factory({", ".join(params)}):', '    def predicate(record):']
+                       + ['        ' + line for line in lines] + ['        return True', '    return predicate'])
+    exec(compile(source, '<adb-predicate>', 'exec'), namespace)
+    return namespace['factory']
+
+def _compile_condition(condition: Dict[str, Any]) -> Callable[[Dict[str, Any]], bool]:
+    """
+    把条件编译为检查单条记录的函数（与 _match_condition 结果一致）
+    
+    同一结构的条件共用按结构缓存的谓词工厂（最近最少使用淘汰），只有取值不同。
+    """
+    shape = _condition_shape(condition)
+    if shape is None:
+        return lambda record: _match_condition(record, condition)
+    values = []
+    for value in condition.values():
+        if not isinstance(value, dict):
+            values.append(value)
+            continue
+        for op in _PREDICATE_OPERATORS:
+            if op not in value:
+                continue
+            if op == '$like':
+                values.append(value[op].lower())
+            elif op == '$in':
+                items = value[op]
+                members = items
+                if isinstance(items, (list, tuple, set, frozenset)):
+                    try:
+                        members = frozenset(items)
+                    except TypeError:
+                        pass  # 含不可哈希的取值时按列表逐个比较
+                values.extend([members, items])
+            else:
+                values.append(value[op])
+    return _predicate_factory(shape)(*values)
+
+def _implies(condition: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """查询条件是否包含部分索引的全部 where 条件（同一列上完全相同的条件）"""
+    return not where or all(key in condition and condition[key] == value for key, value in where.items())
+
+class _DerivedIndex:
+    """
+    部分索引与表达式索引
+    
+    只收录满足 where 条件的记录；索引名是表达式（如 lower(email)）时，内部索引看到的是
+    只含表达式值的记录视图。记录位置与原记录一致，其余查询接口直接交给内部索引。
+    """
+    
+    def __init__(self, inner: Any, where: Optional[Dict[str, Any]] = None):
+        self.inner = inner
+        self.where = where or None
+        self.kind = inner.kind
+        self.column = inner.column
+        self.columns = inner.columns
+        self.expression = _parse_expression(inner.column) if len(inner.columns) == 1 else None
+        # 索引依赖的记录列：这些列被修改时需要维护索引
+        sources = [self.expression[1][0]] if self.expression else list(inner.columns)
+        self.sources = sources + [column for column in (where or {}) if column not in sources]
+    
+    def __getattr__(self, name: str) -> Any:
+        if name == 'inner':
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+    
+    def _view(self, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """内部索引看到的记录，不满足 where 条件时返回None"""
+        if self.where and not _match_condition(record, self.where):
+            return None
+        if self.expression is None:
+            return record
+        value = _expression_value(record, self.expression)
+        return {} if value is _MISSING else {self.column: value}
+    
+    def empty(self) -> '_DerivedIndex':
+        """创建定义相同的空索引"""
+        return _DerivedIndex(self.inner.empty(), self.where)
+    
+    def build(self, records: List[Dict[str, Any]]) -> None:
+        """根据全部记录重建索引"""
+        self.inner.build([None if record is None else self._view(record) for record in records])
+    
+    def add(self, record: Dict[str, Any], position: int) -> None:
+        """加入一条记录"""
+        view = self._view(record)
+        if view is not None:
+            self.inner.add(view, position)
+    
+    def remove(self, record: Dict[str, Any], position: int) -> None:
+        """移除一条记录（record 为记录修改前的内容）"""
+        view = self._view(record)
+        if view is not None:
+            self.inner.remove(view, position)
+    
+    def shift(self, removed: List[int]) -> None:
+        """删除记录后调整其余记录的位置"""
+        self.inner.shift(removed)
+    
+    def clear(self) -> None:
+        """清空索引"""
+        self.inner.clear()
+    
+    def __eq__(self, other: Any) -> bool:
+        return type(self) is type(other) and self.where == other.where and self.inner == other.inner
+    
+    def to_json(self) -> Dict[str, Any]:
+        """内部索引的格式，部分索引另外保存 where 条件和索引的列（索引名不是列名）"""
+        data = self.inner.to_json()
+        if self.where:
+            data['where'] = self.where
+            if len(self.columns) == 1:
+                data['column'] = self.column
+        return data
+
+def _predicate_shape(condition: Dict[str, Any]) -> tuple:
+    """查询条件的形状：按列名排序的 (列, 操作类型) 对，不含具体取值"""
+    shape = []
+    for column, value in condition.items():
+        if not isinstance(value, dict):
+            op = 'eq'
+        elif '$text' in value:
+            op = 'text'
+        elif '$like' in value:
+            op = 'like'
+        elif '$in' in value:
+            op = 'in'
+        elif any(key in value for key in _RANGE_OPERATORS):
+            op = 'range'
+        else:
+            op = 'other'
+        shape.append((column, op))
+    return tuple(sorted(shape))
+
+def _estimate_index_bytes(rows: int, distinct: int) -> int:
+    """粗略估计索引占用的内存：每条记录位置约36字节，每个键约150字节"""
+    return rows * 36 + distinct * 150
+
+def _column_statistics(values: List[Any], row_count: int) -> Dict[str, Any]:
+    """
+    一列的统计信息
+    
+    values 为含该列的记录中的取值，row_count 为表的记录数。直方图是等深的：
+    相邻边界之间的可排序取值数量大致相同；最常见值只收录出现超过一次的值。
+    """
+    present = len(values)
+    nulls = sum(value is None for value in values)
+    counter = Counter()
+    unhashable = 0
+    for value in values:
+        try:
+            counter[value] += 1
+        except TypeError:
+            unhashable += 1
+    keys = sorted(key for key in map(_order_key, values) if key is not None)
+    buckets = min(_HISTOGRAM_BUCKETS, len(keys) - 1)
+    step = max(present // _STATS_SAMPLE_SIZE, 1)
+    return {
+        'row_count': row_count,
+        'distinct': len(counter) + unhashable,
+        'null_fraction': nulls / row_count,
+        'missing_fraction': (row_count - present) / row_count,
+        'orderable_fraction': len(keys) / row_count,
+        'mcv': [[value, count / row_count] for value, count in counter.most_common(_MCV_SIZE)
+                if count > 1 and value is not None],
+        'histogram': [keys[i * (len(keys) - 1) // buckets][1] for i in range(buckets + 1)] if buckets > 0 else [],
+        'sample': [str(value) for value in values[::step][:_STATS_SAMPLE_SIZE] if value is not None]
+    }
+
+def _histogram_fraction(histogram: List[Any], key: tuple) -> float:
+    """等深直方图中排序键小于 key 的取值所占比例（桶内数字按线性插值）"""
+    bounds = [_order_key(value) for value in histogram]
+    if len(bounds) < 2:
+        return 0.5
+    i = bisect.bisect_left(bounds, key)
+    if i == 0:
+        return 0.0
+    if i == len(bounds):
+        return 1.0
+    low, high = bounds[i - 1], bounds[i]
+    within = 0.5
+    if len(key) == 2 and low[0] == high[0] == key[0] == 0 and high[1] != low[1]:
+        within = (key[1] - low[1]) / (high[1] - low[1])
+    return (i - 1 + within) / (len(bounds) - 1)
+
+def _estimate_selectivity(stats: Optional[Dict[str, Any]], value: Any) -> float:
+    """估计一列上的条件的选择率（满足条件的记录比例），没有统计信息时使用默认值"""
+    if not isinstance(value, dict):
+        if stats is None:
+            return _DEFAULT_SELECTIVITY['eq']
+        if value is None:
+            return stats['null_fraction']
+        for common, frequency in stats['mcv']:
+            if type(common) is type(value) and common == value:
+                return frequency
+        rest = (1 - stats['missing_fraction'] - stats['null_fraction']
+                - sum(frequency for _, frequency in stats['mcv']))
+        return max(rest, 0.0) / max(stats['distinct'] - len(stats['mcv']), 1)
+    
+    selectivity = 1.0
+    if '$in' in value:
+        items = value['$in'] if isinstance(value['$in'], (list, tuple, set)) else []
+        selectivity *= min(sum(_estimate_selectivity(stats, item) for item in items), 1.0)
+    if any(op in value for op in _RANGE_OPERATORS):
+        low = value.get('$gt', value.get('$gte'))
+        high = value.get('$lt', value.get('$lte'))
+        low_key = _order_key(low) if low is not None else None
+        high_key = _order_key(high) if high is not None else None
+        if stats is None or not stats['histogram'] or (low_key or high_key) is None:
+            selectivity *= _DEFAULT_SELECTIVITY['range']
+        else:
+            # 与有序索引一致，只有一侧边界时限定在同类型的取值范围内
+            rank = (low_key or high_key)[0]
+            fraction = (_histogram_fraction(stats['histogram'], high_key or (rank + 1,))
+                        - _histogram_fraction(stats['histogram'], low_key or (rank,)))
+            # 缺少该列的记录同样满足范围条件
+            selectivity *= max(fraction, 0.0) * stats['orderable_fraction'] + stats['missing_fraction']
+    if '$like' in value:
+        if stats is None or not stats['sample'] or not isinstance(value['$like'], str):
+            selectivity *= _DEFAULT_SELECTIVITY['like']
+        else:
+            pattern = value['$like'].lower()
+            matched = sum(pattern in sample.lower() for sample in stats['sample']) / len(stats['sample'])
+            selectivity *= matched * (1 - stats['missing_fraction']) + stats['missing_fraction']
+    if '$text' in value:
+        selectivity *= _DEFAULT_SELECTIVITY['text']
+    return selectivity
+
+def _index_sources(index: Any) -> List[str]:
+    """索引依赖的记录列（部分索引和表达式索引包括 where 条件的列和表达式引用的列）"""
+    return getattr(index, 'sources', index.columns)
+
+def _index_name(column: Union[str, List[str]], where: Optional[Dict[str, Any]] = None) -> str:
+    """
+    索引名：单列索引为列名，复合索引为逗号连接的列名；
+    部分索引在后面加上 where 条件的规范JSON，与同一列上的完整索引或其他部分索引区分
+    """
+    name = column if isinstance(column, str) else ','.join(column)
+    if where:
+        name += ' WHERE ' + json.dumps(where, sort_keys=True, ensure_ascii=False,
+                                       separators=(',', ':'), default=str)
+    return name
+
+_INDEX_KINDS = {'hash': _HashIndex, 'sorted': _SortedIndex, 'bitmap': _BitmapIndex, 'ngram': _NgramIndex,
+                'fulltext': _FulltextIndex}
+
+def _encode_indexes(table_indexes: Dict[str, Any]) -> Dict[str, Any]:
+    """将表的索引对象转换为可写入快照的格式"""
+    return {column: index.to_json() for column, index in table_indexes.items()}
+
+def _decode_indexes(raw: Dict[str, Any], records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """从快照内容还原表的索引对象"""
+    table_indexes = {}
+    for name, data in raw.items():
+        column = data.get('column', name)  # 部分索引的索引名包含 where 条件，列名单独保存
+        rebuild = False
+        if data.get('kind') == 'composite':
+            index = _CompositeIndex(data['columns'], {tuple(key): positions
+                                                       for key, positions in data['entries']})
+        elif data.get('kind') == 'hash':
+            index = _HashIndex(column, {key: positions for key, positions in data['entries']})
+        elif data.get('kind') == 'ngram':
+            index = _NgramIndex(column)
+            rebuild = True
+        elif data.get('kind') == 'fulltext':
+            index = _FulltextIndex(column, data.get('tokenizer', 'cjk_bigram'))
+            rebuild = True
+        elif data.get('kind') == 'bitmap':
+            index = _BitmapIndex(column)
+            index._load_groups({value: positions for value, positions in data['entries']})
+        elif data.get('kind') == 'sorted':
+            index = _SortedIndex(column)
+            index.keys = [_order_key(value) for value, _ in data['entries']]
+            index.positions = [positions for _, positions in data['entries']]
+            index.missing = data.get('missing', [])
+        else:
+            # 旧版格式 {值: 位置列表} 的键在JSON中被转成了字符串，按记录重建一次，
+            # 下次保存时即写为新格式
+            index = _HashIndex(column)
+            rebuild = True
+        if 'kind' in data and (data.get('where') or len(index.columns) == 1 and _parse_expression(column)):
+            index = _DerivedIndex(index, data.get('where'))
+        if rebuild:
+            index.build(records)
+        table_indexes[name] = index
+    return table_indexes
+
+_CURSOR_BATCH_SIZE = 1000  # 游标每批取出的记录数
+
+class ADBCursor:
+    """
+    查询游标：按批惰性取出匹配的记录
+    
+    创建时在实例锁内对表的记录列表做快照（只复制记录的引用），之后的检查、投影和取出
+    都在快照上进行，不再持锁。写操作以新字典替换记录（写时复制），因此游标看到的
+    始终是创建时的数据，不受之后的插入、更新和删除影响。
+    """
+    
+    def __init__(self, records: List[Optional[Dict[str, Any]]], positions: Any,
+                 match: Optional[Callable[[Dict[str, Any]], bool]],
+                 columns: Optional[List[str]] = None, batch_size: int = _CURSOR_BATCH_SIZE):
+        self._records = records      # 记录列表的快照
+        self._positions = iter(positions)
+        self._match = match          # 需要逐条检查的条件（候选记录已精确匹配时为None）
+        self.columns = list(columns) if columns else None
+        self.batch_size = batch_size
+        self.rownumber = 0           # 已取出的记录数
+        self._buffer = []
+    
+    def _project(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        if self.columns is None:
+            return record
+        return {column: record[column] for column in self.columns if column in record}
+    
+    def _fill(self, size: int) -> None:
+        """从快照中继续检查记录，直到缓冲区有 size 条或没有更多记录"""
+        records, match, buffer = self._records, self._match, self._buffer
+        for i in self._positions:
+            record = records[i]
+            if record is None or (match is not None and not match(record)):
+                continue
+            buffer.append(self._project(record))
+            if len(buffer) >= size:
+                break
+    
+    def fetchmany(self, size: Optional[int] = None) -> List[Dict[str, Any]]:
+        """取出最多 size 条（默认 batch_size 条）记录，没有更多记录时返回空列表"""
+        size = size or self.batch_size
+        if len(self._buffer) < size:
+            self._fill(size)
+        batch, self._buffer = self._buffer[:size], self._buffer[size:]
+        self.rownumber += len(batch)
+        return batch
+    
+    def fetchone(self) -> Optional[Dict[str, Any]]:
+        """取出下一条记录，没有更多记录时返回None"""
+        batch = self.fetchmany(1)
+        return batch[0] if batch else None
+    
+    def fetchall(self) -> List[Dict[str, Any]]:
+        """取出剩余的全部记录"""
+        result = []
+        for batch in iter(self.fetchmany, []):
+            result.extend(batch)
+        return result
+    
+    def __iter__(self):
+        while True:
+            batch = self.fetchmany()
+            if not batch:
+                return
+            yield from batch
+    
+    def close(self) -> None:
+        """释放快照"""
+        self._records, self._positions, self._buffer = [], iter(()), []
+    
+    def __enter__(self) -> 'ADBCursor':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
 class ADB:
     """
     简单的基于API的数据库管理系统
@@ -79,13 +1605,33 @@ class ADB:
     - 备份恢复：数据安全保障
     """
     
-    def __init__(self, db_path: str = None, enable_logging: bool = None):
+    def __init__(self, db_path: str = None, enable_logging: bool = None,
+                 journal_mode: str = None, storage_layout: str = None,
+                 durability: str = None, lazy_load: bool = None,
+                 snapshot_cache: bool = None, snapshot_format: str = None, auto_index: bool = None):
         """
         初始化ADB实例
         
         Args:
             db_path: 数据库文件路径（可选，从配置读取）
             enable_logging: 是否启用日志记录（可选，从配置读取）
+            journal_mode: 日志模式 'snapshot' 或 'wal'（可选，从配置读取）
+            storage_layout: 存储布局 'file' 或 'directory'（可选，从配置读取；
+                            已存在的数据库按实际布局打开）
+            durability: 持久化级别（可选，从配置读取）
+                        sync: 每次写操作返回前落盘（默认）
+                        group: 写操作等待下一次合并刷盘（多个并发写共享一次刷盘）
+                        async: 写操作立即返回，后台线程按间隔或脏数据量合并刷盘；
+                               进程崩溃时会丢失最近至多 flush_interval 秒的变更
+            lazy_load: 打开时只读取表的元数据，表数据在首次访问时加载
+                       （可选，从配置读取；需要目录布局或压缩快照格式，
+                       单文件JSON格式下会记录警告并读取全部数据）
+            snapshot_cache: 保存时在数据文件旁写入二进制快照缓存，加载时优先读取
+                            （可选，从配置读取）
+            snapshot_format: 快照格式 'json' 或 'compressed'（可选，从配置读取；
+                             读取时自动识别格式）
+            auto_index: 根据记录的查询负载自动在线创建索引，索引总大小不超过
+                        auto_index_memory（可选，从配置读取）
         """
         # 使用配置系统
         if CONFIG_AVAILABLE:
@@ -93,126 +1639,928 @@ class ADB:
             self.db_path = Path(db_path or config.get('database.path', "adb_data.json"))
             enable_logging = enable_logging if enable_logging is not None else config.get('logging.level') != 'CRITICAL'
             self.max_records = config.get('database.max_records_per_table', 100000)
+            journal_mode = journal_mode or config.get('database.journal_mode', 'snapshot')
+            storage_layout = storage_layout or config.get('database.storage_layout', 'file')
+            durability = durability or config.get('database.durability', 'sync')
+            lazy_load = lazy_load if lazy_load is not None else config.get('database.lazy_load', False)
+            if snapshot_cache is None:
+                snapshot_cache = config.get('database.snapshot_cache', False)
+            snapshot_format = snapshot_format or config.get('database.snapshot_format', 'json')
+            self.compression = config.get('database.compression', 'zlib')
+            self.compression_level = config.get('database.compression_level', 6)
+            self.flush_interval = config.get('database.flush_interval', 1.0)
+            self.flush_bytes = config.get('database.flush_bytes', 1048576)
+            self.wal_fsync = config.get('database.wal_fsync', 'always')
+            self.wal_fsync_interval = config.get('database.wal_fsync_interval', 1.0)
+            self.wal_checkpoint_size = config.get('database.wal_checkpoint_size', 4194304)
+            if auto_index is None:
+                auto_index = config.get('performance.auto_index', False)
+            self.auto_index_memory = config.get('performance.auto_index_memory', 67108864)
+            self.query_stats_size = config.get('performance.query_stats_size', 1000)
         else:
             self.db_path = Path(db_path or "adb_data.json")
             enable_logging = enable_logging if enable_logging is not None else False
             self.max_records = 100000
+            journal_mode = journal_mode or 'snapshot'
+            storage_layout = storage_layout or 'file'
+            durability = durability or 'sync'
+            lazy_load = bool(lazy_load)
+            snapshot_cache = bool(snapshot_cache)
+            snapshot_format = snapshot_format or 'json'
+            self.compression = 'zlib'
+            self.compression_level = 6
+            self.flush_interval = 1.0
+            self.flush_bytes = 1048576
+            self.wal_fsync = 'always'
+            self.wal_fsync_interval = 1.0
+            self.wal_checkpoint_size = 4194304
+            auto_index = bool(auto_index)
+            self.auto_index_memory = 67108864
+            self.query_stats_size = 1000
+        
+        if journal_mode not in ('snapshot', 'wal'):
+            raise ADBError(f"不支持的日志模式: {journal_mode}")
+        if storage_layout not in ('file', 'directory'):
+            raise ADBError(f"不支持的存储布局: {storage_layout}")
+        if durability not in ('sync', 'group', 'async'):
+            raise ADBError(f"不支持的持久化级别: {durability}")
+        if snapshot_format not in ('json', 'compressed'):
+            raise ADBError(f"不支持的快照格式: {snapshot_format}")
+        self.journal_mode = journal_mode
+        self.durability = durability
+        self.lazy_load = lazy_load
+        self.snapshot_cache = snapshot_cache
+        self.snapshot_format = snapshot_format
+        self.auto_index = auto_index
+        
+        # 已存在的数据库以实际布局为准
+        if self.db_path.is_dir():
+            storage_layout = 'directory'
+        elif self.db_path.is_file():
+            storage_layout = 'file'
+        self._set_storage_path(self.db_path, storage_layout)
         
         self.data = {}              # 存储所有表数据
         self.indexes = {}           # 存储索引信息
         self.schemas = {}           # 存储表结构定义
         self._transaction_active = False     # 事务状态
         self._transaction_backup = None      # 事务备份数据
-        self._last_save_time = 0    # 最后保存时间
-        self._save_interval = 1     # 保存间隔（秒）
+        self._lock = threading.RLock()                  # 写操作与刷盘互斥
+        self._flush_cond = threading.Condition(self._lock)
+        self._flush_thread = None   # 后台刷盘线程（group/async）
+        self._index_builds = {}     # 表名 -> {索引名: 在线构建状态}
+        self._closed = False
+        self._pending_wal = []      # 待写入的WAL记录（已编码）
+        self._pending_gen = 0       # 已提交的变更批次号
+        self._flush_attempt_gen = 0 # 最近一次刷盘覆盖到的批次号
+        self._flush_ok = True       # 最近一次刷盘是否成功
+        self._dirty_bytes = 0       # 未落盘变更的估算大小
+        self._wal_seq = 0           # 最后一条WAL记录的序号
+        self._wal_file = None       # WAL文件句柄（追加模式）
+        self._wal_size = 0          # 当前WAL文件大小（字节）
+        self._wal_buffer = []       # 事务内暂存的WAL记录
+        self._transaction_bytes = 0 # 事务内变更的估算大小
+        self._last_fsync_time = 0   # 最后一次fsync时间
+        self._replaying = False     # 是否正在重放WAL
+        self._table_files = {}      # 各表在磁盘上的位置信息（目录布局的数据文件或压缩快照的数据块）
+        self._next_table_id = 1     # 目录布局下下一个表文件编号
+        self._dirty_tables = set()  # 自上次保存以来有变更的表
+        self._row_seq = {}          # 各表下一个分配的 _id（单调递增，删除后不复用）
+        self._id_map = {}           # 各表 _id -> 记录位置
+        self._duplicate_ids = set() # 存在重复 _id 的表（旧版本写入），_id 条件退回扫描
+        self._tombstones = {}       # 各表中已删除记录留下的空位数量
+        self._query_stats = {}      # 各表按条件形状统计的查询负载（最多 query_stats_size 种形状）
+        self._stats_lock = threading.Lock()
+        self._query_stats_dirty = False  # 查询负载统计自上次保存以来是否有变化
+        self._table_stats = {}      # 各表 analyze_table 收集的列统计信息（代价估算使用）
+        self._queries_since_advice = {}  # 自动索引模式下各表自上次评估以来的查询次数
+        self._advisor_threads = {}  # 各表正在运行的后台索引评估线程
+        self._auto_index_bytes = 0  # 自动创建的索引的估计总大小
+        self._auto_index_sizes = {} # 各表自动创建的索引名 -> 估计大小（删除索引时归还预算）
+        
+        # 配置日志
+        if enable_logging and CONFIG_AVAILABLE:
+            self._setup_logging()
+        elif enable_logging:
+            logging.basicConfig(level=logging.INFO)
+        
+        self.logger = logging.getLogger(__name__)
+        if storage_layout == 'directory' and self.db_path.is_file():
+            self.logger.warning("检测到单文件数据库，可使用 migrate_storage('directory') 迁移到目录布局")
+        self.load_database()
+        if self.lazy_load and self.storage_layout == 'file':
+            # 已存在的文件按实际格式判断，新建的数据库按配置的快照格式判断
+            lazy = (isinstance(self.data, _LazyTables) if self.db_path.exists()
+                    else self.snapshot_format == 'compressed')
+            if not lazy:
+                self.logger.warning("单文件JSON格式不支持延迟加载，已读取全部数据；"
+                                    "延迟加载需要目录布局或压缩快照格式")
+        self._load_query_stats()
+        _open_databases.add(self)
+    
+    def _set_storage_path(self, db_path: Path, storage_layout: str) -> None:
+        """设置数据库路径、存储布局及对应的WAL路径"""
+        self.db_path = Path(db_path)
+        self.storage_layout = storage_layout
+        if storage_layout == 'directory':
+            self.wal_path = self.db_path / 'journal.wal'
+        else:
+            self.wal_path = self.db_path.with_name(self.db_path.name + '.wal')
+    
+    def _setup_logging(self):
+        """设置详细的日志配置"""
+        if not CONFIG_AVAILABLE:
+            return
+            
+        log_level = getattr(logging, config.get('logging.level', 'INFO'))
+        log_format = config.get('logging.format')
+        log_file = config.get('logging.file')
+        
+        # 创建日志目录
+        if log_file:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        
+        logging.basicConfig(
+            level=log_level,
+            format=log_format,
+            handlers=[
+                logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(),
+                logging.StreamHandler()
+            ]
+        )
+    
+    def _validate_table_name(self, table_name: str) -> None:
+        """验证表名有效性"""
+        if not table_name or not isinstance(table_name, str):
+            raise ValidationError("表名必须是非空字符串")
+        if len(table_name) > 64:
+            raise ValidationError("表名长度不能超过64个字符")
+        if not table_name.replace('_', '').replace('-', '').isalnum():
+            raise ValidationError("表名只能包含字母、数字、下划线和连字符")
+    
+    def _check_table_exists(self, table_name: str) -> None:
+        """检查表是否存在"""
+        if table_name not in self.data:
+            raise TableNotFoundError(f"表 '{table_name}' 不存在")
+    
+    def _is_loaded(self, table_name: str) -> bool:
+        """表数据是否已读入内存（延迟加载模式下可能尚未读取）"""
+        return not isinstance(self.data, _LazyTables) or self.data.is_loaded(table_name)
+    
+    def _check_record_limit(self, table_name: str) -> None:
+        """检查记录数量限制"""
+        if self._row_count(table_name) >= self.max_records:
+            raise ADBError(f"表 '{table_name}' 已达到最大记录数限制 ({self.max_records})")
+    
+    @_synchronized
+    def load_database(self) -> None:
+        """加载数据库文件（WAL模式下重放检查点之后的日志）"""
+        snapshot_seq = 0
+        self._table_files = {}
+        self._dirty_tables = set()
+        self._row_seq, self._id_map, self._tombstones = {}, {}, {}
+        self._duplicate_ids = set()
+        manifest_path = self.db_path / 'manifest.json'
+        if self.storage_layout == 'directory' and manifest_path.exists():
+            try:
+                snapshot_seq = self._load_directory(manifest_path)
+                self.logger.info(f"数据库加载成功: {len(self.data)} 个表")
+            except (ValueError, IOError, ADBError) as e:
+                self.logger.error(f"数据库加载失败: {e}")
+                self.data = {}
+                self.schemas = {}
+                self.indexes = {}
+        elif self.storage_layout == 'file' and self.db_path.exists():
+            try:
+                content = _read_snapshot_cache(self.db_path) if self.snapshot_cache else None
+                if content is None and _is_block_file(self.db_path):
+                    snapshot_seq = self._load_block_file()
+                elif content is None:
+                    content = self._read_data_file(self.db_path)
+                # 兼容旧格式和新格式
+                if content is None:
+                    pass
+                elif isinstance(content, dict) and 'tables' in content:
+                    self.data = content.get('tables', {})
+                    self._row_seq = dict(content.get('row_seqs', {}))
+                    self.schemas = {name: _decode_schema(schema)
+                                    for name, schema in content.get('schemas', {}).items()}
+                    self.indexes = {name: _decode_indexes(table_indexes, self.data.get(name, []))
+                                    for name, table_indexes in content.get('indexes', {}).items()}
+                    snapshot_seq = content.get('wal_seq', 0)
+                else:
+                    self.data = content
+                    self.schemas = {}
+                    self.indexes = {}
+                if not isinstance(self.data, _LazyTables):
+                    for table_name in self.data:
+                        self._index_rows(table_name)
+                self.logger.info(f"数据库加载成功: {len(self.data)} 个表")
+            except (ValueError, IOError, ADBError) as e:
+                self.logger.error(f"数据库加载失败: {e}")
+                self.data = {}
+                self.schemas = {}
+                self.indexes = {}
+        else:
+            self.data = {}
+            self.schemas = {}
+            self.indexes = {}
+        
+        self._wal_seq = snapshot_seq
+        self._replay_wal(snapshot_seq)
+        
+        # 内存已与磁盘一致，丢弃重新加载前未落盘的变更
+        self._pending_wal = []
+        self._mark_flushed(True)
+    
+    def _load_directory(self, manifest_path: Path) -> int:
+        """按清单文件加载目录布局的数据库，返回快照对应的WAL序号"""
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        
+        self.data = _LazyTables(self._load_table)
+        self.indexes = _LazyTables(self._load_table)
+        self.schemas = {}
+        self._next_table_id = manifest.get('next_table_id', 1)
+        for table_name, entry in manifest.get('tables', {}).items():
+            if entry.get('schema'):
+                self.schemas[table_name] = _decode_schema(entry['schema'])
+            self._table_files[table_name] = {
+                'id': entry['id'], 'gen': entry['gen'], 'file': entry['file'],
+                'record_count': entry.get('record_count', 0),
+                'indexes': entry.get('indexes', [])
+            }
+            self._row_seq[table_name] = entry.get('row_seq', 1)
+            dict.__setitem__(self.data, table_name, _NOT_LOADED)
+            dict.__setitem__(self.indexes, table_name, _NOT_LOADED)
+            if not self.lazy_load:
+                self._load_table(table_name)
+        
+        return manifest.get('wal_seq', 0)
+    
+    def _load_block_file(self) -> int:
+        """按头部加载单文件压缩快照（各表数据块可延迟解压），返回快照对应的WAL序号"""
+        with open(self.db_path, 'rb') as f:
+            header = _read_block_header(f)
+        
+        meta = header['meta']
+        self.data = _LazyTables(self._load_table)
+        self.indexes = _LazyTables(self._load_table)
+        self.schemas = {name: _decode_schema(schema)
+                        for name, schema in meta.get('schemas', {}).items()}
+        self._row_seq = dict(meta.get('row_seqs', {}))
+        for block in header['blocks']:
+            self._table_files[block['name']] = dict(block, data_start=header['data_start'])
+            dict.__setitem__(self.data, block['name'], _NOT_LOADED)
+            dict.__setitem__(self.indexes, block['name'], _NOT_LOADED)
+            if not self.lazy_load:
+                self._load_table(block['name'])
+        return meta.get('wal_seq', 0)
+    
+    def _load_table(self, table_name: str) -> None:
+        """读取单个表的数据（延迟加载模式下首次访问时调用）"""
+        with self._lock:
+            if self._is_loaded(table_name):
+                return
+            entry = self._table_files[table_name]
+            if 'file' in entry:
+                content = self._read_data_file(self.db_path / entry['file'])
+            else:
+                # 单文件压缩快照中的数据块
+                with open(self.db_path, 'rb') as f:
+                    data = _read_raw_block(f, entry['data_start'], entry)
+                content = _decompress_block(data, entry['codec'])
+            records = content.get('records', [])
+            dict.__setitem__(self.data, table_name, records)
+            dict.__setitem__(self.indexes, table_name,
+                             _decode_indexes(content.get('indexes', {}), records))
+            self._index_rows(table_name)
+            self.logger.debug(f"加载表: {table_name}")
+    
+    def _index_rows(self, table_name: str) -> None:
+        """根据表数据重建 _id -> 位置映射和空位计数（加载或整表替换后调用）"""
+        id_map = {}
+        tombstones = 0
+        duplicates = 0
+        next_id = self._row_seq.get(table_name, 1)
+        for i, record in enumerate(self.data[table_name]):
+            if record is None:
+                tombstones += 1
+            elif '_id' in record:
+                duplicates += record['_id'] in id_map
+                id_map[record['_id']] = i
+                if isinstance(record['_id'], int) and record['_id'] >= next_id:
+                    next_id = record['_id'] + 1
+        if duplicates:
+            # 映射只能记录其中一条，按 _id 更新、删除时改为扫描，仍作用于所有同 _id 的记录
+            self.logger.warning(f"表 {table_name} 中有 {duplicates} 条记录的 _id 重复，_id 条件将使用全表扫描")
+            self._duplicate_ids.add(table_name)
+        else:
+            self._duplicate_ids.discard(table_name)
+        self._id_map[table_name] = id_map
+        self._tombstones[table_name] = tombstones
+        self._row_seq[table_name] = next_id
+    
+    def _row_count(self, table_name: str) -> int:
+        """表中的有效记录数（不含已删除记录的空位）"""
+        return len(self.data[table_name]) - self._tombstones.get(table_name, 0)
+    
+    def _live_records(self, table_name: str) -> List[Dict[str, Any]]:
+        """表中的有效记录（没有空位时直接返回原列表）"""
+        records = self.data[table_name]
+        if not self._tombstones.get(table_name):
+            return records
+        return [record for record in records if record is not None]
+    
+    def _read_data_file(self, path: Path) -> Any:
+        """读取数据文件（自动识别JSON或压缩格式），存在有效的二进制快照缓存时优先使用"""
+        if self.snapshot_cache:
+            content = _read_snapshot_cache(path)
+            if content is not None:
+                return content
+        if _is_block_file(path):
+            # 目录布局的表文件只有一个数据块
+            with open(path, 'rb') as f:
+                header = _read_block_header(f)
+                block = header['blocks'][0]
+                return _decompress_block(_read_raw_block(f, header['data_start'], block), block['codec'])
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _write_cache(self, path: Path, content: Any) -> None:
+        """为刚写入的数据文件生成二进制快照缓存（失败不影响保存）"""
+        if not self.snapshot_cache:
+            return
+        try:
+            _write_snapshot_cache(path, content)
+        except (OSError, pickle.PicklingError, TypeError) as e:
+            self.logger.warning(f"写入快照缓存失败: {e}")
+    
+    @_synchronized
+    def save_database(self) -> bool:
+        """立即保存完整快照（WAL模式下即为检查点），包含所有未落盘的变更"""
+        if self.journal_mode == 'wal':
+            return self.checkpoint()
+        
+        ok = self._write_snapshot()
+        self._mark_flushed(ok)
+        return ok
+    
+    def _write_snapshot(self) -> bool:
+        """将完整快照原子写入数据库文件"""
+        if self.storage_layout == 'directory':
+            return self._write_directory()
+        
+        if self.snapshot_format == 'compressed':
+            return self._write_block_snapshot()
+        
+        try:
+            # 确保目录存在
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            # 新格式保存，包含元数据
+            content = {
+                'version': '1.0',
+                'created_at': datetime.now().isoformat(),
+                'wal_seq': self._wal_seq,
+                'tables': self.data,
+                'schemas': {name: _encode_schema(schema) for name, schema in self.schemas.items()},
+                'indexes': {name: _encode_indexes(table_indexes)
+                            for name, table_indexes in self.indexes.items()},
+                'row_seqs': dict(self._row_seq)
+            }
+            
+            # 原子写入
+            temp_path = self.db_path.with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(content, f, ensure_ascii=False, indent=2)
+            
+            temp_path.replace(self.db_path)
+            self._write_cache(self.db_path, content)
+            self._table_files = {}
+            self._dirty_tables.clear()
+            return True
+        except IOError as e:
+            self.logger.error(f"数据库保存失败: {e}")
+            return False
+    
+    def _write_block_snapshot(self) -> bool:
+        """
+        单文件布局按压缩格式原子写入完整快照
+        
+        每个表压缩为一个带CRC32的数据块；尚未加载的表直接复制原数据块，无需解压。
+        """
+        try:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            blocks = []
+            source = None
+            try:
+                for table_name in self.data:
+                    if self._is_loaded(table_name):
+                        records = self.data[table_name]
+                        table_indexes = self.indexes.get(table_name, {})
+                        blocks.append({
+                            'name': table_name, 'codec': self.compression,
+                            'record_count': self._row_count(table_name),
+                            'indexes': list(table_indexes.keys()),
+                            'data': _compress_block({'records': records,
+                                                     'indexes': _encode_indexes(table_indexes)},
+                                                    self.compression, self.compression_level)
+                        })
+                    else:
+                        entry = self._table_files[table_name]
+                        if source is None:
+                            source = open(self.db_path, 'rb')
+                        blocks.append({
+                            'name': table_name, 'codec': entry['codec'],
+                            'record_count': entry['record_count'], 'indexes': list(entry['indexes']),
+                            'data': _read_raw_block(source, entry['data_start'], entry)
+                        })
+            finally:
+                if source is not None:
+                    source.close()
+            
+            meta = {
+                'version': '1.0',
+                'created_at': datetime.now().isoformat(),
+                'wal_seq': self._wal_seq,
+                'schemas': {name: _encode_schema(schema) for name, schema in self.schemas.items()},
+                'row_seqs': dict(self._row_seq)
+            }
+            temp_path = self.db_path.with_suffix('.tmp')
+            header = _write_block_file(temp_path, meta, blocks)
+            temp_path.replace(self.db_path)
+            
+            self._table_files = {block['name']: dict(block, data_start=header['data_start'])
+                                 for block in header['blocks']}
+            if all(self._is_loaded(name) for name in self.data):
+                self._write_cache(self.db_path, {
+                    'version': meta['version'], 'wal_seq': self._wal_seq,
+                    'tables': self.data, 'schemas': meta['schemas'], 'row_seqs': meta['row_seqs'],
+                    'indexes': {name: _encode_indexes(table_indexes)
+                                for name, table_indexes in self.indexes.items()}
+                })
+            self._dirty_tables.clear()
+            return True
+        except (IOError, ADBError) as e:
+            self.logger.error(f"数据库保存失败: {e}")
+            return False
+    
+    def _write_directory(self) -> bool:
+        """
+        目录布局保存：只重写有变更的表，最后原子替换清单文件
+        
+        变更的表写入新一代的数据文件，清单替换成功后才删除旧文件，
+        因此任何时刻崩溃，清单引用的都是一组完整一致的文件。
+        """
+        try:
+            tables_dir = self.db_path / 'tables'
+            tables_dir.mkdir(parents=True, exist_ok=True)
+            
+            manifest_tables = {}
+            table_files = {}
+            obsolete = []
+            for table_name in self.data:
+                entry = self._table_files.get(table_name)
+                if entry is None or table_name in self._dirty_tables:
+                    records = self.data[table_name]
+                    table_indexes = self.indexes.get(table_name, {})
+                    if entry is None:
+                        entry = {'id': self._next_table_id, 'gen': 0}
+                        self._next_table_id += 1
+                    else:
+                        obsolete.append(entry['file'])
+                    gen = entry['gen'] + 1
+                    suffix = 'adbz' if self.snapshot_format == 'compressed' else 'json'
+                    entry = {
+                        'id': entry['id'], 'gen': gen, 'file': f"tables/{entry['id']}-{gen}.{suffix}",
+                        'record_count': self._row_count(table_name),
+                        'indexes': list(table_indexes.keys())
+                    }
+                    
+                    content = {'records': records, 'indexes': _encode_indexes(table_indexes)}
+                    table_path = self.db_path / entry['file']
+                    if self.snapshot_format == 'compressed':
+                        _write_block_file(table_path, {}, [{
+                            'name': table_name, 'codec': self.compression,
+                            'data': _compress_block(content, self.compression, self.compression_level)
+                        }])
+                    else:
+                        with open(table_path, 'w', encoding='utf-8') as f:
+                            json.dump(content, f, ensure_ascii=False, indent=2)
+                    self._write_cache(table_path, content)
+                
+                table_files[table_name] = entry
+                manifest_tables[table_name] = dict(
+                    entry,
+                    row_seq=self._row_seq.get(table_name, 1),
+                    schema=_encode_schema(self.schemas[table_name]) if table_name in self.schemas else None
+                )
+            
+            # 已删除的表
+            obsolete.extend(entry['file'] for name, entry in self._table_files.items()
+                            if name not in self.data)
+            
+            manifest = {
+                'version': '1.0',
+                'layout': 'directory',
+                'created_at': datetime.now().isoformat(),
+                'wal_seq': self._wal_seq,
+                'next_table_id': self._next_table_id,
+                'tables': manifest_tables
+            }
+            temp_path = self.db_path / 'manifest.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            temp_path.replace(self.db_path / 'manifest.json')
+            
+            self._table_files = table_files
+            self._dirty_tables.clear()
+            for file_name in obsolete:
+                for file_path in (self.db_path / file_name, _cache_path(self.db_path / file_name)):
+                    if file_path.exists():
+                        file_path.unlink()
+            return True
+        except (IOError, ADBError) as e:
+            self.logger.error(f"数据库保存失败: {e}")
+            return False
+    
+    def _mark_dirty(self, op: str, table_name: str, new_name: Optional[str] = None) -> None:
+        """记录自上次保存以来有变更的表（重命名和删除只需修改清单）"""
+        if op == 'rename_table':
+            if table_name in self._dirty_tables:
+                self._dirty_tables.discard(table_name)
+                self._dirty_tables.add(new_name)
+            if table_name in self._table_files:
+                self._table_files[new_name] = self._table_files.pop(table_name)
+        elif op == 'drop_table':
+            self._dirty_tables.discard(table_name)
+        elif op != 'set_schema':
+            self._dirty_tables.add(table_name)
+    
+    def migrate_storage(self, storage_layout: str, target_path: Optional[str] = None) -> bool:
+        """
+        迁移数据库到另一种存储布局
+        
+        原数据库文件保留不动，迁移完成后当前实例使用新路径。
+        
+        Args:
+            storage_layout: 目标布局 'file' 或 'directory'
+            target_path: 目标路径，默认与当前文件同名（目录去掉扩展名，文件加 .json）
+            
+        Returns:
+            bool: 迁移成功返回True
+        """
+        if storage_layout not in ('file', 'directory'):
+            raise ADBError(f"不支持的存储布局: {storage_layout}")
+        if storage_layout == self.storage_layout:
+            return False
+        
+        if target_path is None:
+            if storage_layout == 'directory':
+                target_path = self.db_path.with_suffix('')
+            else:
+                target_path = self.db_path.with_suffix('.json')
+        target_path = Path(target_path)
+        if target_path.exists():
+            raise ADBError(f"迁移目标已存在: {target_path}")
+        
+        # 刷盘线程退出前需要获取锁，必须在持有锁之前关闭
+        self.close()
+        with self._lock:
+            try:
+                # 迁移需要写出全部表数据
+                for table_name in self.data:
+                    self.data[table_name]
+                
+                old_path, old_layout, old_wal = self.db_path, self.storage_layout, self.wal_path
+                self._set_storage_path(target_path, storage_layout)
+                self._table_files = {}
+                self._dirty_tables = set(self.data.keys())
+                if not self._write_snapshot():
+                    self._set_storage_path(old_path, old_layout)
+                    return False
+                
+                # 新快照已包含全部数据，旧WAL不再需要
+                if old_wal.exists():
+                    old_wal.unlink()
+                self.logger.info(f"数据库已迁移到 {storage_layout} 布局: {target_path}")
+                return True
+            finally:
+                self._reopen()
+    
+    def checkpoint(self) -> bool:
+        """
+        检查点：写入完整快照并清空WAL
+        
+        快照记录已包含的最后一条日志序号，即使清空WAL前崩溃，
+        重新加载时也只会重放序号更大的记录。
+        
+        Returns:
+            bool: 成功返回True
+        """
+        with self._lock:
+            return self._checkpoint()
+    
+    def _checkpoint(self) -> bool:
+        """执行检查点（调用方持有锁）"""
+        if not self._write_snapshot():
+            return False
+        
+        # 快照已包含尚未写入WAL的记录
+        self._pending_wal = []
+        self._mark_flushed(True)
+        
+        if self.journal_mode == 'wal':
+            try:
+                if self._wal_file is not None:
+                    self._wal_file.close()
+                    self._wal_file = None
+                if self.wal_path.exists():
+                    self.wal_path.unlink()
+                self._wal_size = 0
+            except OSError as e:
+                self.logger.error(f"清空WAL失败: {e}")
+                return False
+        return True
+    
+    def flush(self) -> bool:
+        """
+        立即写入所有未落盘的变更（group/async模式下使用）
+        
+        Returns:
+            bool: 成功返回True
+        """
+        with self._lock:
+            if self._flush_attempt_gen >= self._pending_gen and self._flush_ok:
+                return True
+            return self._flush_pending()
+    
+    def close(self) -> None:
+        """关闭数据库：停止后台刷盘和索引评估线程，写入剩余变更并释放WAL文件句柄"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._flush_cond.notify_all()
+        # 索引评估线程创建索引前需要获取锁并检查 _closed，必须在锁外等待
+        with self._stats_lock:
+            advisors = list(self._advisor_threads.values())
+        for thread in advisors:
+            if thread is not threading.current_thread():
+                thread.join()
         
-        # 配置日志
-        if enable_logging and CONFIG_AVAILABLE:
-            self._setup_logging()
-        elif enable_logging:
-            logging.basicConfig(level=logging.INFO)
+        with self._lock:
+            builds = [build for table_builds in self._index_builds.values() for build in table_builds.values()]
+            for build in builds:
+                if build['status'] == 'building':
+                    # 构建完成前索引没有写入日志，重新打开后不存在，需要重新创建
+                    self.logger.warning(f"关闭数据库时取消了表 {build['table']} 的索引 {build['name']} 的在线构建，"
+                                        f"索引未创建")
+                self._cancel_index_build(build)
         
-        self.logger = logging.getLogger(__name__)
-        self.load_database()
+        # 刷盘线程和索引构建线程需要获取锁才能退出，必须在锁外等待
+        if self._flush_thread is not None and self._flush_thread is not threading.current_thread():
+            self._flush_thread.join()
+        self._flush_thread = None
+        for build in builds:
+            if build['thread'] is not threading.current_thread():
+                build['thread'].join()
+        
+        with self._lock:
+            if self._flush_attempt_gen < self._pending_gen or not self._flush_ok:
+                self._flush_pending()
+            if self._wal_file is not None:
+                self._wal_file.close()
+                self._wal_file = None
+            self._save_query_stats()
+        _open_databases.discard(self)
     
-    def _setup_logging(self):
-        """设置详细的日志配置"""
-        if not CONFIG_AVAILABLE:
-            return
-            
-        log_level = getattr(logging, config.get('logging.level', 'INFO'))
-        log_format = config.get('logging.format')
-        log_file = config.get('logging.file')
+    def _reopen(self) -> None:
+        """close() 之后继续使用当前实例：恢复后台刷盘并在进程退出时自动写入"""
+        self._closed = False
+        _open_databases.add(self)
+    
+    def _log_operation(self, op: str, table_name: str, **payload) -> bool:
+        """
+        持久化一次变更
         
-        # 创建日志目录
-        if log_file:
-            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        snapshot模式保存快照；wal模式仅追加一条紧凑的日志记录，
+        写入开销与变更大小成正比。事务内的变更在提交时统一持久化。
+        """
+        self._mark_dirty(op, table_name, payload.get('new_name'))
+        if self._replaying:
+            return True
         
-        logging.basicConfig(
-            level=log_level,
-            format=log_format,
-            handlers=[
-                logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(),
-                logging.StreamHandler()
-            ]
-        )
+        if self.journal_mode == 'wal':
+            self._wal_seq += 1
+            entry = {'seq': self._wal_seq, 'op': op, 'table': table_name}
+            entry.update(payload)
+            lines = [self._encode_wal_entry(entry)]
+            size = len(lines[0])
+        else:
+            lines = []
+            size = len(json.dumps(payload, ensure_ascii=False, default=str))
+        
+        if self._transaction_active:
+            self._wal_buffer.extend(lines)
+            self._transaction_bytes += size
+            return True
+        return self._persist(lines, size)
     
-    def _validate_table_name(self, table_name: str) -> None:
-        """验证表名有效性"""
-        if not table_name or not isinstance(table_name, str):
-            raise ValidationError("表名必须是非空字符串")
-        if len(table_name) > 64:
-            raise ValidationError("表名长度不能超过64个字符")
-        if not table_name.replace('_', '').replace('-', '').isalnum():
-            raise ValidationError("表名只能包含字母、数字、下划线和连字符")
+    @staticmethod
+    def _encode_wal_entry(entry: Dict[str, Any]) -> bytes:
+        """将WAL记录编码为一行紧凑的JSON"""
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
     
-    def _check_table_exists(self, table_name: str) -> None:
-        """检查表是否存在"""
-        if table_name not in self.data:
-            raise TableNotFoundError(f"表 '{table_name}' 不存在")
+    def _persist(self, lines: List[bytes], size: int) -> bool:
+        """按持久化级别写入一批变更（调用方持有锁或处于单线程环境）"""
+        with self._lock:
+            if self.durability == 'sync' or self._closed:
+                self._pending_wal.extend(lines)
+                self._pending_gen += 1
+                return self._flush_pending()
+            
+            self._pending_wal.extend(lines)
+            self._dirty_bytes += size
+            self._pending_gen += 1
+            my_gen = self._pending_gen
+            self._start_flush_thread()
+            
+            if self.durability == 'group':
+                # 唤醒刷盘线程，与其他并发写操作共享同一次刷盘
+                self._flush_cond.notify_all()
+                while self._flush_attempt_gen < my_gen and not self._closed:
+                    self._flush_cond.wait()
+                if self._flush_attempt_gen < my_gen:
+                    return self._flush_pending()
+                return self._flush_ok
+            
+            if self._dirty_bytes >= self.flush_bytes:
+                self._flush_cond.notify_all()
+            return True
     
-    def _check_record_limit(self, table_name: str) -> None:
-        """检查记录数量限制"""
-        if len(self.data[table_name]) >= self.max_records:
-            raise ADBError(f"表 '{table_name}' 已达到最大记录数限制 ({self.max_records})")
+    def _start_flush_thread(self) -> None:
+        """按需启动后台刷盘线程（线程只持有实例的弱引用，实例不再被引用时随之退出）"""
+        if self._flush_thread is None:
+            self._flush_thread = threading.Thread(target=ADB._flush_loop, args=(weakref.ref(self),),
+                                                  name='adb-flush', daemon=True)
+            self._flush_thread.start()
     
-    def load_database(self) -> None:
-        """加载数据库文件"""
-        if self.db_path.exists():
-            try:
-                with open(self.db_path, 'r', encoding='utf-8') as f:
-                    content = json.load(f)
-                    # 兼容旧格式和新格式
-                    if isinstance(content, dict) and 'tables' in content:
-                        self.data = content.get('tables', {})
-                        self.schemas = content.get('schemas', {})
-                        self.indexes = content.get('indexes', {})
-                    else:
-                        self.data = content
-                        self.schemas = {}
-                        self.indexes = {}
-                self.logger.info(f"数据库加载成功: {len(self.data)} 个表")
-            except (json.JSONDecodeError, IOError) as e:
-                self.logger.error(f"数据库加载失败: {e}")
-                self.data = {}
-                self.schemas = {}
-                self.indexes = {}
+    @staticmethod
+    def _flush_loop(ref: 'weakref.ref') -> None:
+        """
+        后台刷盘线程：每个时间间隔内的变更合并为一次写入，脏数据过多或有等待者时提前写入
+        
+        等待期间不持有实例，实例被回收或关闭后退出；数据库所在目录已被删除时停止刷盘，
+        不重新创建目录（未落盘的变更保留，可由 flush() 或 close() 写入）。
+        """
+        db = ref()
+        if db is None:
+            return
+        cond = db._flush_cond
+        with cond:
+            while not db._closed:
+                if (db._flush_attempt_gen >= db._pending_gen or
+                        (db.durability == 'async' and db._dirty_bytes < db.flush_bytes)):
+                    # 等满一个时间间隔，合并期间的所有变更；有等待者时提前唤醒
+                    interval = db.flush_interval
+                    del db
+                    cond.wait(timeout=interval)
+                    db = ref()
+                    if db is None or db._closed:
+                        return
+                if db._flush_attempt_gen < db._pending_gen:
+                    if db._storage_missing():
+                        db.logger.warning(f"数据库目录已不存在，停止后台刷盘: {db.db_path}")
+                        db._flush_thread = None
+                        return
+                    db._flush_pending()
+    
+    def _storage_missing(self) -> bool:
+        """数据库文件（目录布局为数据库目录）所在的目录是否已不存在"""
+        return not self.db_path.parent.exists()
+    
+    def _flush_pending(self) -> bool:
+        """将待写入的变更落盘（调用方持有锁）"""
+        if self.journal_mode == 'wal':
+            lines, self._pending_wal = self._pending_wal, []
+            ok = self._append_wal(lines)
+            if not ok:
+                self._pending_wal[:0] = lines
         else:
-            self.data = {}
-            self.schemas = {}
-            self.indexes = {}
+            ok = self._write_snapshot()
+        self._mark_flushed(ok)
+        return ok
     
-    def save_database(self) -> bool:
-        """保存数据库到文件（带频率限制）"""
-        current_time = time.time()
-        if current_time - self._last_save_time < self._save_interval and not self._transaction_active:
-            return True  # 跳过过于频繁的保存
-        
+    def _mark_flushed(self, ok: bool) -> None:
+        """记录刷盘结果并唤醒等待者（调用方持有锁）"""
+        self._flush_attempt_gen = self._pending_gen
+        self._flush_ok = ok
+        if ok:
+            self._dirty_bytes = 0
+        self._flush_cond.notify_all()
+    
+    def _append_wal(self, lines: List[bytes]) -> bool:
+        """追加WAL记录，按fsync策略刷盘，超过阈值时执行检查点"""
+        if not lines:
+            return True
         try:
-            # 确保目录存在
-            self.db_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # 新格式保存，包含元数据
-            content = {
-                'version': '1.0',
-                'created_at': datetime.now().isoformat(),
-                'tables': self.data,
-                'schemas': self.schemas,
-                'indexes': self.indexes
-            }
+            if self._wal_file is None:
+                self.wal_path.parent.mkdir(parents=True, exist_ok=True)
+                self._wal_file = open(self.wal_path, 'ab')
+                self._wal_size = self._wal_file.tell()
             
-            # 原子写入
-            temp_path = self.db_path.with_suffix('.tmp')
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                json.dump(content, f, ensure_ascii=False, indent=2)
+            data = b''.join(lines)
+            self._wal_file.write(data)
+            self._wal_file.flush()
+            self._wal_size += len(data)
             
-            temp_path.replace(self.db_path)
-            self._last_save_time = current_time
-            return True
-        except IOError as e:
-            self.logger.error(f"数据库保存失败: {e}")
+            now = time.time()
+            if (self.wal_fsync == 'always' or
+                    (self.wal_fsync == 'interval' and now - self._last_fsync_time >= self.wal_fsync_interval)):
+                os.fsync(self._wal_file.fileno())
+                self._last_fsync_time = now
+        except (IOError, OSError) as e:
+            self.logger.error(f"写入WAL失败: {e}")
             return False
+        
+        if self._wal_size >= self.wal_checkpoint_size:
+            return self._checkpoint()
+        return True
+    
+    def _replay_wal(self, after_seq: int) -> None:
+        """重放WAL中序号大于after_seq的记录，截断末尾的残缺记录"""
+        self._wal_size = 0
+        if not self.wal_path.exists():
+            return
+        
+        replayed = 0
+        valid_size = 0
+        self._replaying = True
+        try:
+            with open(self.wal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        self.logger.warning(f"WAL末尾存在残缺记录，已忽略: {self.wal_path}")
+                        break
+                    valid_size += len(line)
+                    if entry['seq'] <= after_seq:
+                        continue
+                    try:
+                        self._apply_wal_entry(entry)
+                        replayed += 1
+                    except Exception as e:
+                        self.logger.error(f"重放WAL记录 {entry['seq']} 失败: {e}")
+                    self._wal_seq = max(self._wal_seq, entry['seq'])
+        finally:
+            self._replaying = False
+        
+        if valid_size < self.wal_path.stat().st_size:
+            with open(self.wal_path, 'r+b') as f:
+                f.truncate(valid_size)
+        self._wal_size = valid_size
+        if replayed:
+            self.logger.info(f"已重放 {replayed} 条WAL记录")
+    
+    def _apply_wal_entry(self, entry: Dict[str, Any]) -> None:
+        """将一条WAL记录应用到内存数据"""
+        op, table_name = entry['op'], entry['table']
+        if op in ('insert', 'update', 'delete'):
+            self._mark_dirty(op, table_name)
+        
+        if op == 'insert':
+            self._append_record(table_name, entry['record'])
+        elif op == 'update':
+            self._apply_update(table_name, entry['positions'], entry['values'], entry['updated_at'])
+        elif op == 'delete':
+            self._apply_delete(table_name, entry['positions'])
+        elif op == 'create_table':
+            schema = entry.get('schema')
+            self.create_table(table_name, _decode_schema(schema) if schema else None)
+        elif op == 'alter_table':
+            kwargs = dict(entry['kwargs'])
+            if kwargs.get('column_def'):
+                kwargs['column_def'] = _decode_schema({'_': kwargs['column_def']})['_']
+            self.alter_table(table_name, entry['action'], **kwargs)
+        elif op == 'rename_table':
+            self.rename_table(table_name, entry['new_name'])
+        elif op == 'set_schema':
+            self.set_schema(table_name, _decode_schema(entry['schema']))
+        elif op == 'create_index':
+            self.create_index(table_name, entry['column'], entry.get('kind', 'hash'), entry.get('tokenizer'),
+                              entry.get('where'))
+        elif op == 'drop_index':
+            self.drop_index(table_name, entry['column'])
+        elif op in ('drop_table', 'truncate_table', 'optimize_table'):
+            getattr(self, op)(table_name)
+        else:
+            raise ADBError(f"未知的WAL操作: {op}")
     
+    @_synchronized
     def create_table(self, table_name: str, schema: Optional[Dict[str, Any]] = None) -> bool:
         """
         创建表
@@ -232,23 +2580,15 @@ class ADB:
             
         self.data[table_name] = []
         self.indexes[table_name] = {}
+        self._row_seq[table_name] = 1
+        self._id_map[table_name] = {}
+        self._tombstones[table_name] = 0
         if schema:
             self.schemas[table_name] = schema
             
         self.logger.info(f"创建表: {table_name}")
-        return self.save_database()
-    
-    def drop_table(self, table_name: str) -> bool:
-        """删除表"""
-        self._check_table_exists(table_name)
-        
-        del self.data[table_name]
-        # 清理相关索引和结构
-        self.indexes.pop(table_name, None)
-        self.schemas.pop(table_name, None)
-        
-        self.logger.info(f"删除表: {table_name}")
-        return self.save_database()
+        return self._log_operation('create_table', table_name,
+                                   schema=_encode_schema(schema) if schema else None)
     
     def _validate_record(self, table_name: str, record: Dict[str, Any]) -> bool:
         """验证记录是否符合表结构"""
@@ -273,6 +2613,7 @@ class ADB:
         
         return True
     
+    @_synchronized
     def insert(self, table_name: str, record: Dict[str, Any]) -> bool:
         """
         插入记录到表中
@@ -296,92 +2637,806 @@ class ADB:
         record_copy = record.copy()  # 避免修改原始数据
         self._validate_record(table_name, record_copy)
         
-        # 添加时间戳和ID
+        # 添加时间戳和ID（ID取自表的单调序列，删除后不会复用）
         record_copy['_created_at'] = datetime.now().isoformat()
-        record_copy['_id'] = len(self.data[table_name]) + 1
+        record_copy['_id'] = self._row_seq.get(table_name, 1)
+        
+        self._append_record(table_name, record_copy)
+        return self._log_operation('insert', table_name, record=record_copy)
+    
+    def _append_record(self, table_name: str, record: Dict[str, Any]) -> None:
+        """将记录追加到表末尾，并更新索引、_id 映射和ID序列"""
+        records = self.data[table_name]
+        position = len(records)
+        self._update_indexes_for_insert(table_name, record, position)
+        records.append(record)
+        self._capture_index_build(table_name, 'add', record, position)
+        if '_id' in record:
+            self._id_map.setdefault(table_name, {})[record['_id']] = position
+            if isinstance(record['_id'], int) and record['_id'] >= self._row_seq.get(table_name, 1):
+                self._row_seq[table_name] = record['_id'] + 1
+    
+    def _forget_rows(self, table_name: str) -> None:
+        """删除表时清理 _id 映射、空位计数和ID序列，并取消表上的在线索引构建"""
+        self._row_seq.pop(table_name, None)
+        self._id_map.pop(table_name, None)
+        self._duplicate_ids.discard(table_name)
+        self._tombstones.pop(table_name, None)
+        if self._query_stats.pop(table_name, None) is not None:
+            self._query_stats_dirty = True
+        self._table_stats.pop(table_name, None)
+        for name in list(self._auto_index_sizes.get(table_name, {})):
+            self._release_auto_index(table_name, name)
+        for build in self._index_builds.pop(table_name, {}).values():
+            self._cancel_index_build(build)
+    
+    def _update_indexes_for_insert(self, table_name: str, record: Dict[str, Any], record_index: int) -> None:
+        """为插入操作更新索引"""
+        if table_name in self.indexes:
+            for index in self.indexes[table_name].values():
+                index.add(record, record_index)
+    
+    def select(self, table_name: str, condition: Optional[Dict[str, Any]] = None, 
+               limit: Optional[int] = None, offset: int = 0,
+               order_by: Optional[Union[str, List[Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        增强的查询功能
+        
+        支持的查询条件：
+        - 精确匹配：{'name': '张三'}
+        - 范围查询：{'age': {'$gt': 18, '$lt': 60}}
+        - 模糊匹配：{'name': {'$like': '张'}}
+        - 全文检索：{'description': {'$text': '无线 耳机'}}（需要全文索引，结果按相关度排序）
+        - 分页查询：limit和offset参数
+        - 排序：order_by=[('price', 'desc'), ('_id', 'asc')]
+        
+        Args:
+            table_name: 表名
+            condition: 查询条件
+            limit: 限制返回记录数
+            offset: 跳过记录数（用于分页）
+            order_by: 排序列，列名或 (列名, 'asc'/'desc') 的列表；值相同的记录保持插入顺序，
+                      缺失、null 和不可排序的值排在最前（降序时最后）
+            
+        Returns:
+            List[Dict]: 匹配的记录列表
+        """
+        if table_name not in self.data:
+            return []
+        
+        records = self.data[table_name]
+        if order_by is not None:
+            return self._select_ordered(table_name, condition, limit, offset, _parse_order_by(order_by))
+        
+        if condition is None:
+            if self._tombstones.get(table_name):
+                live = (record for record in records if record is not None)
+                return list(islice(live, offset, offset + limit if limit else None))
+            result = records[offset:offset + limit if limit else None]
+            return result
+        
+        stop = offset + limit if limit else None
+        if self._text_columns(condition):
+            # 按相关度排序需要全部匹配记录
+            positions = self._matching_positions(table_name, condition)
+            positions = self._rank_text(table_name, condition, positions, stop)
+        else:
+            # 找到 offset + limit 条匹配记录即停止，跳过的 offset 条只保留位置
+            positions = self._matching_positions(table_name, condition, limit=stop)
+        return [records[i] for i in positions[offset:stop]]
+    
+    def select_page(self, table_name: str, condition: Optional[Dict[str, Any]] = None,
+                    limit: Optional[int] = None, offset: int = 0,
+                    order_by: Optional[Union[str, List[Any]]] = None, *,
+                    cursor: Optional[str] = None) -> Dict[str, Any]:
+        """
+        游标（键集）分页查询
+        
+        返回的 next_cursor 编码了本页最后一条记录的排序键和 _id；下一页传入该游标，
+        从这条记录之后继续：没有 order_by 时通过 _id 映射直接定位（记录已删除时按 _id 二分查找），
+        首个排序列有有序索引时二分查找到对应的键，因此逐页读完整个表的总代价是线性的。
+        表不存在时与 select 一样返回空页。
+        
+        Args:
+            table_name: 表名
+            condition: 查询条件（各页应相同）
+            limit: 每页记录数，None 表示取出剩余全部记录
+            offset: 在游标之后再跳过的记录数
+            order_by: 排序列（与 select 相同，各页应相同）
+            cursor: 上一页返回的 next_cursor，None 表示第一页（只能按关键字传入）
+            
+        Returns:
+            Dict: records（本页记录）、has_more（是否还有下一页）和 next_cursor（没有下一页时为None）
+        """
+        if limit is not None and limit <= 0:
+            raise ValidationError("limit 必须大于0")
+        if condition and self._text_columns(condition):
+            raise ValidationError("$text 查询按相关度排序，不支持游标分页")
+        if table_name not in self.data:
+            return {'records': [], 'has_more': False, 'next_cursor': None}
+        order = _parse_order_by(order_by) if order_by is not None else None
+        records = self.data[table_name]
+        after = self._decode_page_cursor(table_name, cursor, order) if cursor else None
+        stop = offset + limit + 1 if limit else None  # 多取一条判断是否还有下一页
+        
+        if order is None:
+            positions = self._matching_positions(table_name, condition or {}, limit=stop,
+                                                 start=after[1] + 1 if after else 0)
+        else:
+            positions = self._ordered_positions(table_name, condition, order, stop, after)
+        positions = positions[offset:]
+        has_more = limit is not None and len(positions) > limit
+        positions = positions[:limit]
+        return {
+            'records': [records[i] for i in positions],
+            'has_more': has_more,
+            'next_cursor': self._encode_page_cursor(records[positions[-1]], positions[-1], order) if has_more else None
+        }
+    
+    @staticmethod
+    def _encode_page_cursor(record: Dict[str, Any], position: int, order: Optional[List[tuple]]) -> str:
+        """把记录的排序列取值、_id 和位置编码为不透明的游标字符串"""
+        state = {'i': record.get('_id'), 'p': position}
+        if order is not None:
+            # 不可排序的值与 null 的排序键相同，游标中记为 null
+            state['o'] = [[column, 'desc' if descending else 'asc'] for column, descending in order]
+            state['k'] = [record.get(column) if _order_key(record.get(column)) is not None else None
+                          for column, _ in order]
+        raw = json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+    
+    def _decode_page_cursor(self, table_name: str, cursor: str, order: Optional[List[tuple]]) -> tuple:
+        """
+        解码游标，返回 (排序键, 位置)，位置之后的记录排在游标之后；没有 order_by 时排序键为None
+        
+        游标记录的 _id 仍在表中时以它当前的位置为准；已删除时不能使用游标中的位置
+        （表整理后位置会前移），改为按 _id 定位到第一条 _id 更大的记录之前。
+        _id 不可比较或表中有重复 _id 时才退回游标中的位置。
+        """
+        try:
+            state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            position = int(state['p'])
+        except (ValueError, TypeError, KeyError, UnicodeError):
+            raise ValidationError("无效的分页游标")
+        signature = [[column, 'desc' if descending else 'asc'] for column, descending in order] if order else None
+        if state.get('o') != signature:
+            raise ValidationError("分页游标与 order_by 不一致")
+        try:
+            if table_name not in self._duplicate_ids:
+                id_map = self._id_map.get(table_name, {})
+                record_id = state.get('i')
+                position = id_map[record_id] if record_id in id_map else \
+                    self._position_after_id(table_name, record_id) - 1
+        except TypeError:
+            pass  # _id 不可哈希或不可比较时使用游标中的位置
+        if order is None:
+            return None, position
+        if len(state.get('k', ())) != len(order):
+            raise ValidationError("无效的分页游标")
+        key = _record_sort_key(order)(dict(zip((column for column, _ in order), state['k'])))
+        return key, position
+    
+    def _position_after_id(self, table_name: str, record_id: Any) -> int:
+        """
+        二分查找第一条 _id 大于 record_id 的记录位置（_id 按插入顺序分配，随位置单调递增）
+        
+        空位向后跳到下一条记录再比较；_id 不可比较时抛出 TypeError。
+        """
+        records = self.data[table_name]
+        low, high = 0, len(records)
+        while low < high:
+            mid = (low + high) // 2
+            probe = mid
+            while probe < high and records[probe] is None:
+                probe += 1
+            if probe == high or records[probe].get('_id') > record_id:
+                high = mid
+            else:
+                low = probe + 1
+        return low
+    
+    def iter_select(self, table_name: str, condition: Optional[Dict[str, Any]] = None,
+                    batch_size: int = _CURSOR_BATCH_SIZE, columns: Optional[List[str]] = None) -> ADBCursor:
+        """
+        以游标方式查询，按批惰性取出匹配的记录
+        
+        游标在创建时对表做快照，之后的写操作不影响其结果；除 $text 查询需要先排序外，
+        记录在取出时才逐批检查，内存占用与结果集大小无关。
+        
+        Args:
+            table_name: 表名
+            condition: 查询条件
+            batch_size: 每批取出的记录数（fetchmany 的默认数量）
+            columns: 只返回这些列（投影），None 表示返回整条记录
+            
+        Returns:
+            ADBCursor: 支持迭代、fetchone、fetchmany 和 fetchall 的游标
+        """
+        self._check_table_exists(table_name)
+        if batch_size <= 0:
+            raise ValidationError("batch_size 必须大于0")
+        with self._lock:
+            records = list(self.data[table_name])
+            if not condition:
+                return ADBCursor(records, range(len(records)), None, columns, batch_size)
+            if self._text_columns(condition):
+                positions = self._matching_positions(table_name, condition)
+                positions = self._rank_text(table_name, condition, positions, None)
+                return ADBCursor(records, positions, None, columns, batch_size)
+            plan = self._plan_index_scan(table_name, condition)
+            if plan is None:
+                positions = range(len(records))
+            else:
+                # 复制候选位置，之后索引的变化不影响游标
+                positions = list(self._plan_positions(plan))
+        match = None if plan and plan['exact'] else _compile_condition(condition)
+        return ADBCursor(records, positions, match, columns, batch_size)
+    
+    def _select_ordered(self, table_name: str, condition: Optional[Dict[str, Any]], limit: Optional[int],
+                        offset: int, order: List[tuple]) -> List[Dict[str, Any]]:
+        """按 order_by 排序的查询，执行方式由 _plan_order 选择"""
+        records = self.data[table_name]
+        stop = offset + limit if limit else None
+        positions = self._ordered_positions(table_name, condition, order, stop)
+        return [records[i] for i in positions[offset:stop]]
+    
+    def _ordered_positions(self, table_name: str, condition: Optional[Dict[str, Any]], order: List[tuple],
+                           stop: Optional[int], after: Optional[tuple] = None) -> List[int]:
+        """
+        按 order_by 排好序的前 stop 条匹配记录位置
+        
+        记录按 (排序键, 位置) 全序排列；after 为 (排序键, 位置) 时只返回排在它之后的记录（游标分页）。
+        """
+        records = self.data[table_name]
+        sort_plan = self._plan_order(table_name, condition, order, stop)
+        if sort_plan['strategy'] == 'index_order':
+            return self._index_ordered_positions(table_name, condition, order, stop, after)
+        if condition:
+            positions = self._matching_positions(table_name, condition, sort_plan.get('plan'))
+        else:
+            positions = [i for i, record in enumerate(records) if record is not None]
+        key = _record_sort_key(order)
+        if after is not None:
+            positions = [i for i in positions if after < (key(records[i]), i)]
+        if sort_plan['strategy'] == 'top_k_heap':
+            # nsmallest 与 sorted(...)[:stop] 结果一致，值相同时保持记录顺序
+            return heapq.nsmallest(stop, positions, key=lambda i: key(records[i]))
+        return sorted(positions, key=lambda i: key(records[i]))
+    
+    def _plan_order(self, table_name: str, condition: Optional[Dict[str, Any]], order: List[tuple],
+                    stop: Optional[int]) -> Dict[str, Any]:
+        """
+        选择排序方式
+        
+        - index_order：首个排序列有有序索引且指定了 limit 时，按索引顺序逐组检查条件，
+          凑够 offset + limit 条即停止；条件有选择性很强的索引时，按估算检查的记录数与堆排序比较
+        - top_k_heap：指定了 limit 时用大小为 offset + limit 的堆选出前几条
+        - sort：没有 limit 时一次稳定排序
+        """
+        plan = self._plan_index_scan(table_name, condition) if condition else None
+        if stop is None:
+            return {'strategy': 'sort', 'plan': plan}
+        index = self._order_index(table_name, order[0][0])
+        if index is not None and not (condition and self._text_columns(condition)):
+            rows = self._row_count(table_name)
+            # 匹配记录均匀分布时，按索引顺序凑够 stop 条大约要检查 stop * rows / 匹配数 条记录
+            if plan is None or stop * rows / max(plan['count'], 1) < plan['count']:
+                return {'strategy': 'index_order', 'index': order[0][0]}
+        return {'strategy': 'top_k_heap', 'plan': plan}
+    
+    def _order_index(self, table_name: str, column: str) -> Optional['_SortedIndex']:
+        """
+        可以按顺序遍历的列上的有序索引
+        
+        部分索引、表达式索引不适用；列值为 null 或不可排序的记录不在索引中，
+        存在这样的记录时也不适用（它们的位置需要全表扫描才能得到）。
+        """
+        index = self.indexes.get(table_name, {}).get(column)
+        if type(index) is not _SortedIndex:
+            return None
+        keyed = sum(map(len, index.positions))
+        return index if keyed + len(index.missing) == self._row_count(table_name) else None
+    
+    def _index_ordered_positions(self, table_name: str, condition: Optional[Dict[str, Any]],
+                                 order: List[tuple], stop: int, after: Optional[tuple] = None) -> List[int]:
+        """
+        按有序索引的顺序取出满足条件的前 stop 条记录位置（同一键内按其余排序列排序）
+        
+        指定 after 时二分查找到其首列键所在的组，从那里开始读取。
+        """
+        records = self.data[table_name]
+        index = self._order_index(table_name, order[0][0])
+        match = _compile_condition(condition or {})
+        rest = _record_sort_key(order[1:]) if len(order) > 1 else None
+        # 缺少该列的记录排在最前（降序时最后）
+        groups = [index.missing] + index.positions
+        group_keys = [(-1,)] + index.keys
+        descending = order[0][1]
+        start, leading = 0, None
+        if after is not None:
+            # 从首列键不早于 after 的第一组开始（降序时组的顺序相反）
+            leading = after[0][0].key if descending else after[0][0]
+            if descending:
+                start = len(group_keys) - bisect.bisect_right(group_keys, leading)
+            else:
+                start = bisect.bisect_left(group_keys, leading)
+        if descending:
+            groups.reverse()
+            group_keys.reverse()
+        key = _record_sort_key(order) if after is not None else None
+        result = []
+        for group, group_key in zip(groups[start:], group_keys[start:]):
+            matched = [i for i in group if match(records[i])]
+            if group_key == leading:
+                # 与 after 首列键相同的组中只保留排在它之后的记录
+                matched = [i for i in matched if after < (key(records[i]), i)]
+            if rest is not None and len(matched) > 1:
+                matched.sort(key=lambda i: rest(records[i]))
+            result.extend(matched)
+            if len(result) >= stop:
+                break
+        return result[:stop]
+    
+    def _rank_text(self, table_name: str, condition: Dict[str, Any], positions: List[int],
+                   top: Optional[int]) -> List[int]:
+        """按 BM25 相关度从高到低排列匹配记录；指定 top 时用堆只保留前 top 条"""
+        scores = dict.fromkeys(positions, 0.0)
+        for column in self._text_columns(condition):
+            index = self._text_index(table_name, column, condition)
+            for position, score in index.scores(condition[column]['$text'], positions).items():
+                scores[position] += score
+        
+        def rank(position):
+            return scores[position], -position  # 相关度相同时保持记录顺序
+        if top is not None:
+            return heapq.nlargest(top, positions, key=rank)
+        return sorted(positions, key=rank, reverse=True)
+    
+    def _plan_index_scan(self, table_name: str, condition: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        为查询条件选择索引（基于代价）
+        
+        - _id 的等值和 $in 条件直接查主键映射
+        - 复合索引的所有列都是等值条件时使用复合索引
+        - 单列索引可用于等值和 $in 条件，有序索引还可用于范围条件（$gt/$gte/$lt/$lte）
+        - 每个可用索引先给出候选记录数：能从索引直接得到的（哈希桶长度、位图计数、
+          有序索引的区间长度）用实际值，否则按 analyze_table 的统计信息估算
+        - 按候选记录数从少到多逐个考虑加入求交集，只有能降低总代价时才加入；
+          总代价为取出候选位置的代价加上逐条检查候选记录的代价（索引精确回答时无需检查），
+          比全表扫描（逐条检查每个记录槽位）还高时不使用索引
+        
+        Returns:
+            Optional[Dict]: 执行策略、所用索引、各索引的扫描信息、候选记录位置及估算代价；
+            不使用索引时返回None
+        """
+        if not condition:
+            return None
         
-        # 更新索引
-        self._update_indexes_for_insert(table_name, record_copy, len(self.data[table_name]))
+        records = self.data[table_name]  # 延迟加载模式下确保表已加载
+        text_columns = self._text_columns(condition)
+        for column in text_columns:
+            if self._text_index(table_name, column, condition) is None:
+                raise ADBError(f"列 {column} 没有可用的全文索引，不能使用 $text 查询")
+        if '_id' in condition and not text_columns:
+            primary = self._plan_primary_key(table_name, condition['_id'])
+            if primary is not None:
+                value = condition['_id']
+                primary['exact'] = len(condition) == 1 and (not isinstance(value, dict) or len(value) == 1)
+                primary['cost'] = primary['count'] * _INDEX_ROW_COST
+                primary['full_scan_cost'] = len(records) * _SCAN_ROW_COST
+                return primary
+        if table_name not in self.indexes:
+            return None
+        
+        scans = self._index_scans(self.indexes[table_name], condition, self._table_stats.get(table_name))
+        if not scans:
+            return None
+        
+        # 列数最多的复合索引优先，其余条件只使用未被其覆盖的单列索引
+        composite = max((scan for scan in scans if scan['kind'] == 'composite'),
+                        key=lambda scan: (len(scan['columns']), -scan['count']), default=None)
+        if composite is not None:
+            covered = set(composite['columns'])
+            scans = [composite] + [scan for scan in scans if scan['kind'] != 'composite'
+                                   and scan['columns'][0] not in covered]
+        
+        # 位图索引的结果先按位与合并为一个候选集合，不展开为位置列表
+        candidates = [{'scans': [scan], 'count': scan['count'], 'source': scan}
+                      for scan in scans if 'bitmap' not in scan]
+        bitmap_scans = [scan for scan in scans if 'bitmap' in scan]
+        if bitmap_scans:
+            bits = bitmap_scans[0]['bitmap']
+            for scan in bitmap_scans[1:]:
+                bits &= scan['bitmap']
+            candidates.append({'scans': bitmap_scans, 'count': _popcount(bits), 'bitmap': bits})
+        candidates.sort(key=lambda candidate: candidate['count'])
+        
+        # $text 条件只能由全文索引求值，必须使用；其余索引只在降低总代价时加入
+        full_cost = len(records) * _SCAN_ROW_COST
+        chosen = [candidate for candidate in candidates
+                  if any(scan['type'] == 'text' for scan in candidate['scans'])]
+        best = self._plan_cost(chosen, condition, len(records)) if chosen else full_cost
+        for candidate in candidates:
+            if any(candidate is member for member in chosen):
+                continue
+            cost = self._plan_cost(chosen + [candidate], condition, len(records))
+            if cost < best:
+                chosen, best = chosen + [candidate], cost
+        if not chosen:
+            return None
+        chosen.sort(key=lambda candidate: candidate['count'])
+        
+        result = self._candidate_positions(chosen[0])
+        used = list(chosen[0]['scans'])
+        for candidate in chosen[1:]:
+            members = set(self._plan_positions(self._candidate_positions(candidate)))
+            positions = [position for position in self._plan_positions(result) if position in members]
+            result = {'count': len(positions), 'positions': positions}
+            used.extend(candidate['scans'])
+        
+        if len(used) > 1:
+            strategy = 'intersection'
+        else:
+            strategy = 'composite' if used[0]['kind'] == 'composite' else 'single'
+        plan = {
+            'strategy': strategy,
+            'indexes': [scan['index'] for scan in used],
+            'scans': [{key: value for key, value in scan.items() if key not in ('positions', 'bitmap', 'fetch')}
+                      for scan in used],
+            'count': result['count'],
+            # 条件中的每一列都由索引精确回答时，候选记录无需再逐条检查
+            'exact': self._scans_exact(used, condition),
+            'cost': best,
+            'full_scan_cost': full_cost
+        }
+        if 'bitmap' in result:
+            plan['bitmap'] = result['bitmap']
+        else:
+            plan['positions'] = result['positions']
+        return plan
+    
+    def _plan_cost(self, candidates: List[Dict[str, Any]], condition: Dict[str, Any], rows: int) -> float:
+        """
+        使用这些候选集合求交集的估算代价
+        
+        交集大小按各条件相互独立估算：rows * (count1 / rows) * (count2 / rows) ...
+        """
+        fetch = sum(candidate['count'] for candidate in candidates) * _INDEX_ROW_COST
+        scans = [scan for candidate in candidates for scan in candidate['scans']]
+        if self._scans_exact(scans, condition):
+            return fetch
+        estimate = min(candidate['count'] for candidate in candidates)
+        if len(candidates) > 1 and rows:
+            estimate = rows
+            for candidate in candidates:
+                estimate *= candidate['count'] / rows
+        return fetch + estimate * _SCAN_ROW_COST
+    
+    @staticmethod
+    def _scans_exact(scans: List[Dict[str, Any]], condition: Dict[str, Any]) -> bool:
+        """这些索引扫描是否精确回答了条件中的每一列"""
+        covered = {column for scan in scans for column in scan['columns'] + list(scan.get('where', ()))}
+        return all(scan['exact'] for scan in scans) and set(condition) <= covered
+    
+    @staticmethod
+    def _candidate_positions(candidate: Dict[str, Any]) -> Dict[str, Any]:
+        """取出候选集合的记录位置（延迟查找的索引此时才执行），返回带实际记录数的结果"""
+        if 'bitmap' in candidate:
+            return candidate
+        scan = candidate['source']
+        if 'positions' not in scan:
+            scan['positions'] = scan.pop('fetch')()
+            scan['count'] = len(scan['positions'])
+        return {'count': len(scan['positions']), 'positions': scan['positions']}
+    
+    @staticmethod
+    def _text_columns(condition: Dict[str, Any]) -> List[str]:
+        """条件中使用 $text 的列"""
+        return [column for column, value in condition.items() if isinstance(value, dict) and '$text' in value]
+    
+    def _text_index(self, table_name: str, column: str, condition: Dict[str, Any]) -> Optional['_FulltextIndex']:
+        """列上可用于该查询的全文索引：优先完整索引，其次 where 条件被查询条件包含的部分索引"""
+        table_indexes = self.indexes.get(table_name, {})
+        candidates = [table_indexes.get(column)] + [index for name, index in table_indexes.items() if name != column]
+        for index in candidates:
+            if (getattr(index, 'kind', None) == 'fulltext' and index.column == column
+                    and _implies(condition, getattr(index, 'where', None))):
+                return index
+        return None
+    
+    @staticmethod
+    def _plan_positions(plan: Dict[str, Any]) -> List[int]:
+        """执行计划的候选记录位置（位图结果在需要时才展开）"""
+        if 'positions' not in plan:
+            plan['positions'] = _bits_to_positions(plan['bitmap'])
+        return plan['positions']
+    
+    @staticmethod
+    def _index_scans(table_indexes: Dict[str, Any], condition: Dict[str, Any],
+                     statistics: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        列出条件可以使用的每个索引及其候选记录数
+        
+        能直接从索引得到的候选位置立即取出；$in、范围和 $like 的候选位置需要合并排序，
+        只先给出候选记录数（有序索引的区间长度、N 元组索引最短的位置列表等），
+        由 fetch 在规划选中该索引后再取出。
+        """
+        scans = []
+        for name, index in table_indexes.items():
+            where = getattr(index, 'where', None)
+            if not _implies(condition, where):
+                continue  # 部分索引只在查询条件包含其全部 where 条件时可用
+            fetch = count = None
+            key = index.columns[0]  # 单列索引在条件中对应的列名（部分索引的索引名还包含 where 条件）
+            if index.kind == 'composite':
+                # 复合索引只能回答所有列都是等值条件的查询
+                if not all(column in condition and not isinstance(condition[column], dict)
+                           for column in index.columns):
+                    continue
+                positions = index.lookup(tuple(condition[column] for column in index.columns))
+                scan = {'type': 'eq', 'exact': True}
+            elif index.kind == 'bitmap':
+                if key not in condition:
+                    continue
+                bits = ADB._bitmap_scan(index, condition[key])
+                if bits is not None:
+                    scans.append({
+                        'type': 'in' if isinstance(condition[key], dict) else 'eq',
+                        'exact': not isinstance(condition[key], dict) or len(condition[key]) == 1,
+                        'index': name, 'kind': index.kind, 'columns': list(index.columns),
+                        'bitmap': bits, 'count': _popcount(bits)
+                    })
+                    if where:
+                        scans[-1]['where'] = where
+                continue
+            elif index.kind == 'fulltext':
+                if not (isinstance(condition.get(key), dict) and '$text' in condition[key]):
+                    continue
+                positions = index.search(condition[key]['$text'])
+                if positions is None:
+                    raise ADBError("$text 查询内容必须是字符串")
+                scan = {'type': 'text', 'exact': len(condition[key]) == 1}
+            elif index.kind == 'ngram':
+                if not (isinstance(condition.get(key), dict) and '$like' in condition[key]):
+                    continue
+                pattern = condition[key]['$like']
+                grams = _ngrams(pattern.lower()) if isinstance(pattern, str) else None
+                if not grams:
+                    continue
+                # 候选数不超过最短的 n 元组位置列表；有统计信息时再按样本估计
+                count = min(len(index.postings.get(gram, ())) for gram in grams) + len(index.missing)
+                if statistics and key in statistics:
+                    rows = statistics[key]['row_count']
+                    count = min(count, math.ceil(rows * _estimate_selectivity(statistics[key], {'$like': pattern})))
+                positions, fetch = None, (lambda index=index, pattern=pattern: index.search(pattern))
+                scan = {'type': 'like', 'exact': False}
+            else:
+                if key not in condition:
+                    continue
+                value = condition[key]
+                if isinstance(value, dict) and '$in' in value:
+                    if not isinstance(value['$in'], (list, tuple, set)):
+                        continue
+                    try:
+                        buckets = [index.lookup(item) for item in value['$in']]
+                    except TypeError:
+                        continue
+                    if any(bucket is None for bucket in buckets):
+                        continue
+                    count = sum(map(len, buckets))
+                    positions, fetch = None, (lambda index=index, items=value['$in']:
+                                              ADB._lookup_many(index.lookup, items))
+                    scan = {'type': 'in', 'exact': len(value) == 1}
+                elif isinstance(value, dict):
+                    if not any(op in value for op in _RANGE_OPERATORS):
+                        continue
+                    low_op = '$gt' if '$gt' in value else ('$gte' if '$gte' in value else None)
+                    high_op = '$lt' if '$lt' in value else ('$lte' if '$lte' in value else None)
+                    bounds = {
+                        'low': value[low_op] if low_op else None, 'low_inclusive': low_op == '$gte',
+                        'high': value[high_op] if high_op else None, 'high_inclusive': high_op == '$lte'
+                    }
+                    range_count = getattr(index, 'range_count', None)  # 只有有序索引能回答范围条件
+                    count = range_count(**bounds) if range_count else None
+                    if count is None:
+                        continue
+                    positions, fetch = None, (lambda index=index, bounds=bounds: index.range(**bounds))
+                    scan = {'type': 'range', 'range': bounds, 'exact': False}
+                else:
+                    positions = index.lookup(value)
+                    scan = {'type': 'eq', 'exact': True}
+            
+            if fetch is not None:
+                scan.update(index=name, kind=index.kind, columns=list(index.columns),
+                            fetch=fetch, count=count)
+            elif positions is not None:
+                scan.update(index=name, kind=index.kind, columns=list(index.columns),
+                            positions=positions, count=len(positions))
+            else:
+                continue
+            if where:
+                scan['where'] = where
+            scans.append(scan)
+        return scans
+    
+    @staticmethod
+    def _bitmap_scan(index: '_BitmapIndex', value: Any) -> Optional[int]:
+        """位图索引回答等值或 $in 条件（各取值的位图按位或），不能回答时返回None"""
+        if not isinstance(value, dict):
+            return index.bits(value)
+        if '$in' not in value or not isinstance(value['$in'], (list, tuple, set)):
+            return None
+        result = 0
+        for item in value['$in']:
+            bits = index.bits(item)
+            if bits is None:
+                return None
+            result |= bits
+        return result
+    
+    def _plan_primary_key(self, table_name: str, value: Any) -> Optional[Dict[str, Any]]:
+        """_id 的等值或 $in 条件通过主键映射直接定位记录，其他条件返回None"""
+        id_map = self._id_map.get(table_name)
+        if id_map is None or table_name in self._duplicate_ids:
+            return None
         
-        self.data[table_name].append(record_copy)
-        return self.save_database()
+        if isinstance(value, dict):
+            if '$in' not in value:
+                return None
+            positions = self._lookup_many(lambda v: [id_map[v]] if v in id_map else [], value['$in'])
+            plan_type = 'in'
+        else:
+            try:
+                positions = [id_map[value]] if value in id_map else []
+            except TypeError:
+                return None
+            plan_type = 'eq'
+        if positions is None:
+            return None
+        return {
+            'strategy': 'primary_key',
+            'indexes': ['_id'],
+            'scans': [{'index': '_id', 'kind': 'primary', 'type': plan_type, 'columns': ['_id']}],
+            'count': len(positions),
+            'exact': False,
+            'positions': positions
+        }
     
-    def _update_indexes_for_insert(self, table_name: str, record: Dict[str, Any], record_index: int) -> None:
-        """为插入操作更新索引"""
-        if table_name in self.indexes:
-            for column, index in self.indexes[table_name].items():
-                if column in record:
-                    value = record[column]
-                    if value not in index:
-                        index[value] = []
-                    index[value].append(record_index)
+    @staticmethod
+    def _lookup_many(lookup: Callable[[Any], Optional[List[int]]], values: Any) -> Optional[List[int]]:
+        """对 $in 的每个值分别查找，合并为有序、去重的位置列表；任一值无法查找时返回None"""
+        if not isinstance(values, (list, tuple, set)):
+            return None
+        result = set()
+        for value in values:
+            try:
+                positions = lookup(value)
+            except TypeError:
+                return None
+            if positions is None:
+                return None
+            result.update(positions)
+        return sorted(result)
     
-    def select(self, table_name: str, condition: Optional[Dict[str, Any]] = None, 
-               limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+    def get_many(self, table_name: str, ids: List[Any]) -> List[Dict[str, Any]]:
         """
-        增强的查询功能
-        
-        支持的查询条件：
-        - 精确匹配：{'name': '张三'}
-        - 范围查询：{'age': {'$gt': 18, '$lt': 60}}
-        - 模糊匹配：{'name': {'$like': '张'}}
-        - 分页查询：limit和offset参数
+        按 _id 批量获取记录（通过主键映射，每个ID常数时间）
         
         Args:
             table_name: 表名
-            condition: 查询条件
-            limit: 限制返回记录数
-            offset: 跳过记录数（用于分页）
+            ids: 记录ID列表
             
         Returns:
-            List[Dict]: 匹配的记录列表
+            List[Dict]: 按 ids 顺序排列的记录，不存在的ID被跳过
         """
-        if table_name not in self.data:
-            return []
-        
+        self._check_table_exists(table_name)
         records = self.data[table_name]
+        id_map = self._id_map.get(table_name, {})
+        result = []
+        for record_id in ids:
+            position = id_map.get(record_id)
+            if position is not None and records[position] is not None:
+                result.append(records[position])
+        return result
+    
+    def _matching_positions(self, table_name: str, condition: Dict[str, Any],
+                            plan: Optional[Dict[str, Any]] = None, limit: Optional[int] = None,
+                            start: int = 0) -> List[int]:
+        """
+        返回满足条件的记录位置；有可用索引时只检查索引给出的候选记录
         
-        if condition is None:
-            result = records[offset:offset + limit if limit else None]
+        指定 limit 时找到 limit 条匹配记录即停止检查（按记录位置顺序的前 limit 条）；
+        指定 start 时只返回位置不小于 start 的记录（游标分页从上一页之后继续）。
+        """
+        started = time.perf_counter()
+        records = self.data[table_name]
+        if plan is None:
+            plan = self._plan_index_scan(table_name, condition)
+        if plan and plan['exact']:
+            # 索引精确回答了所有条件，候选记录就是结果（复制一份，调用方的修改会更新索引）
+            positions = self._plan_positions(plan)
+            first = bisect.bisect_left(positions, start) if start else 0
+            result = positions[first:] if limit is None else positions[first:first + limit]
+            self._record_query(table_name, condition, plan, 0, len(result), started)
             return result
+        candidates = self._plan_positions(plan) if plan else range(len(records))
+        if start:
+            candidates = candidates[bisect.bisect_left(candidates, start):]
+        match = _compile_condition(condition)
+        if limit is not None:
+            matches = (i for i in candidates if i < len(records) and records[i] is not None and match(records[i]))
+            result = list(islice(matches, limit))
+            # 提前停止时只检查到最后一条匹配记录为止
+            scanned = bisect.bisect_right(candidates, result[-1]) if len(result) == limit > 0 else len(candidates)
+        else:
+            if plan or start:
+                result = [i for i in candidates if i < len(records) and records[i] is not None and match(records[i])]
+            else:
+                result = [i for i, record in enumerate(records) if record is not None and match(record)]
+            scanned = len(candidates)
+        self._record_query(table_name, condition, plan, scanned, len(result), started)
+        return result
+    
+    def _record_query(self, table_name: str, condition: Dict[str, Any], plan: Optional[Dict[str, Any]],
+                      scanned: int, matched: int, started: float) -> None:
+        """按条件形状累计查询次数、检查的记录数、匹配的记录数和耗时"""
+        shape = _predicate_shape(condition)
+        with self._stats_lock:
+            table_stats = self._query_stats.setdefault(table_name, OrderedDict())
+            entry = table_stats.get(shape)
+            if entry is None:
+                entry = table_stats[shape] = {'calls': 0, 'full_scans': 0, 'rows_scanned': 0,
+                                              'rows_matched': 0, 'seconds': 0.0}
+                if len(table_stats) > self.query_stats_size:
+                    table_stats.popitem(last=False)  # 淘汰最久未出现的形状
+            else:
+                table_stats.move_to_end(shape)
+            entry['calls'] += 1
+            entry['full_scans'] += plan is None
+            entry['rows_scanned'] += scanned
+            entry['rows_matched'] += matched
+            entry['seconds'] += time.perf_counter() - started
+            self._query_stats_dirty = True
+            
+            due = False
+            if self.auto_index:
+                count = self._queries_since_advice.get(table_name, 0) + 1
+                due = count >= _AUTO_INDEX_INTERVAL
+                self._queries_since_advice[table_name] = 0 if due else count
+        if due:
+            self._start_advisor(table_name)
+    
+    def _start_advisor(self, table_name: str) -> None:
+        """
+        在后台线程中评估表的索引建议并在线创建索引
         
-        # 尝试使用索引优化查询
-        if len(condition) == 1 and table_name in self.indexes:
-            key, value = next(iter(condition.items()))
-            if key in self.indexes[table_name] and not isinstance(value, dict):
-                # 使用索引查询
-                indexes = self.indexes[table_name][key].get(value, [])
-                result = [records[i] for i in indexes if i < len(records)]
-                return result[offset:offset + limit if limit else None]
-        
-        # 普通查询
-        result = []
-        for record in records:
-            if self._match_condition(record, condition):
-                result.append(record)
-        
-        return result[offset:offset + limit if limit else None]
+        评估需要扫描列的不重复取值，不能放在查询线程中（update/delete 此时持有实例锁）；
+        同一张表同时只有一个评估线程。
+        """
+        with self._stats_lock:
+            thread = self._advisor_threads.get(table_name)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(target=self._run_advisor, args=(table_name,),
+                                      name=f'adb-advisor-{table_name}', daemon=True)
+            self._advisor_threads[table_name] = thread
+        thread.start()
+    
+    def _run_advisor(self, table_name: str) -> None:
+        """后台索引评估线程"""
+        try:
+            if not self._closed and table_name in self.data:
+                self._advise_and_create(table_name, online=True)
+        except Exception as e:
+            self.logger.warning(f"自动创建表 {table_name} 的索引失败: {e}")
+        finally:
+            with self._stats_lock:
+                if self._advisor_threads.get(table_name) is threading.current_thread():
+                    del self._advisor_threads[table_name]
     
     def _match_condition(self, record: Dict[str, Any], condition: Dict[str, Any]) -> bool:
         """检查记录是否匹配条件"""
-        for key, value in condition.items():
-            if isinstance(value, dict):
-                # 支持范围查询
-                if '$gt' in value and key in record and record[key] <= value['$gt']:
-                    return False
-                if '$lt' in value and key in record and record[key] >= value['$lt']:
-                    return False
-                if '$gte' in value and key in record and record[key] < value['$gte']:
-                    return False
-                if '$lte' in value and key in record and record[key] > value['$lte']:
-                    return False
-                if '$like' in value and key in record:
-                    if value['$like'].lower() not in str(record[key]).lower():
-                        return False
-            else:
-                if key not in record or record[key] != value:
-                    return False
-        return True
+        return _match_condition(record, condition)
     
     @contextmanager
     def transaction(self):
@@ -397,19 +3452,44 @@ class ADB:
         if self._transaction_active:
             raise ADBError("已有活跃事务")
         
+        # 事务期间持有实例锁，其他线程的写操作等待提交或回滚
+        self._lock.acquire()
         self._transaction_active = True
-        self._transaction_backup = json.dumps(self.data)
+        # 只需备份已加载的表：未加载的表在事务中被修改前会先从磁盘读取
+        unloaded = [name for name in self.data if not self._is_loaded(name)]
+        self._transaction_backup = json.dumps({name: self.data[name] for name in self.data
+                                               if self._is_loaded(name)})
         
         try:
             yield
-            self.save_database()
+            # 提交：事务内的变更一次性持久化
+            lines, self._wal_buffer = self._wal_buffer, []
+            self._transaction_active = False
+            self._persist(lines, self._transaction_bytes)
         except Exception:
             # 回滚
-            self.data = json.loads(self._transaction_backup)
+            backup = json.loads(self._transaction_backup)
+            for name in list(self.data):
+                if name not in backup and name not in unloaded:
+                    dict.pop(self.data, name)
+                    dict.pop(self.indexes, name, None)
+            for name, records in backup.items():
+                dict.__setitem__(self.data, name, records)
+                self._index_rows(name)
+                self._rebuild_indexes(name)
+            for name in unloaded:
+                # 事务中未落盘，重新从数据文件读取即可
+                dict.__setitem__(self.data, name, _NOT_LOADED)
+                dict.__setitem__(self.indexes, name, _NOT_LOADED)
+                self._dirty_tables.discard(name)
+            self._dirty_tables.update(backup.keys())
             raise
         finally:
             self._transaction_active = False
             self._transaction_backup = None
+            self._wal_buffer = []
+            self._transaction_bytes = 0
+            self._lock.release()
     
     def backup(self, backup_path: Optional[str] = None) -> bool:
         """
@@ -425,8 +3505,17 @@ class ADB:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = f"{self.db_path}.backup_{timestamp}"
         
+        # 先写入未落盘的变更；WAL模式下再做检查点，保证备份文件包含全部数据
+        if not self.flush():
+            return False
+        if self.journal_mode == 'wal' and not self.checkpoint():
+            return False
+        
         try:
-            shutil.copy2(self.db_path, backup_path)
+            if self.storage_layout == 'directory':
+                shutil.copytree(self.db_path, backup_path)
+            else:
+                shutil.copy2(self.db_path, backup_path)
             self.logger.info(f"数据库已备份到: {backup_path}")
             return True
         except Exception as e:
@@ -435,8 +3524,27 @@ class ADB:
     
     def restore(self, backup_path: str) -> bool:
         """从备份恢复数据库"""
+        # 刷盘线程退出前需要获取锁，必须在持有锁之前关闭
+        self.close()
+        with self._lock:
+            try:
+                return self._restore_files(backup_path)
+            finally:
+                self._reopen()
+    
+    def _restore_files(self, backup_path: str) -> bool:
+        """用备份替换数据文件并重新加载（调用方已关闭数据库并持有锁）"""
         try:
-            shutil.copy2(backup_path, self.db_path)
+            if self.storage_layout == 'directory':
+                # 目录备份自带与清单一致的WAL
+                shutil.rmtree(self.db_path)
+                shutil.copytree(backup_path, self.db_path)
+            else:
+                shutil.copy2(backup_path, self.db_path)
+                # 备份之后的WAL记录和快照缓存不再适用
+                for path in (self.wal_path, _cache_path(self.db_path)):
+                    if path.exists():
+                        path.unlink()
             self.load_database()
             self.logger.info(f"已从备份恢复: {backup_path}")
             return True
@@ -465,7 +3573,16 @@ class ADB:
         if table_name not in self.data:
             return []
         
-        records = self.data[table_name]
+        grouped = self._bitmap_group(table_name, pipeline)
+        if grouped is not None:
+            return grouped
+        
+        # 开头的 $match 通过 select 执行，可以使用索引
+        if pipeline and '$match' in pipeline[0]:
+            records = self.select(table_name, pipeline[0]['$match'])
+            pipeline = pipeline[1:]
+        else:
+            records = self._live_records(table_name)
         
         for stage in pipeline:
             if '$group' in stage:
@@ -483,11 +3600,44 @@ class ADB:
             
             elif '$match' in stage:
                 # 过滤
-                condition = stage['$match']
-                records = [r for r in records if self._match_condition(r, condition)]
+                match = _compile_condition(stage['$match'])
+                records = [r for r in records if match(r)]
         
         return records
     
+    def _bitmap_group(self, table_name: str, pipeline: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """
+        [$match,] $group 管道中，分组列有位图索引且过滤条件完全由位图索引回答时，
+        各分组的数量由位图按位与后统计置位数得到，不读取记录；不适用时返回None
+        """
+        stages = list(pipeline)
+        condition = stages.pop(0)['$match'] if stages and '$match' in stages[0] else None
+        if len(stages) != 1 or '$group' not in stages[0]:
+            return None
+        
+        index = self.indexes[table_name].get(stages[0]['$group']['_id'])
+        if not isinstance(index, _BitmapIndex):
+            return None
+        if condition:
+            plan = self._plan_index_scan(table_name, condition)
+            if not (plan and plan['exact'] and 'bitmap' in plan):
+                return None
+            selected, total = plan['bitmap'], plan['count']
+        else:
+            selected, total = None, self._row_count(table_name)
+        
+        groups = []
+        for value in index.entries:
+            bits = index.bits(value)
+            if selected is not None:
+                bits &= selected
+            if bits:
+                # 按各组第一条记录的位置排序，与逐条分组的结果顺序一致
+                groups.append(((bits & -bits).bit_length(), value, _popcount(bits)))
+        if sum(count for _, _, count in groups) != total:
+            return None  # 部分记录缺少分组列，交由逐条分组处理
+        return [{'_id': value, 'count': count} for _, value, count in sorted(groups, key=lambda group: group[0])]
+    
     def get_table_info(self, table_name: str) -> Dict[str, Any]:
         """
         获取表的元数据信息
@@ -508,14 +3658,29 @@ class ADB:
         if table_name not in self.data:
             return {}
         
+        if not self._is_loaded(table_name):
+            # 未加载的表使用清单中的元数据，不触发加载
+            entry = self._table_files[table_name]
+            return {
+                'name': table_name,
+                'record_count': entry['record_count'],
+                'schema': self.schemas.get(table_name, {}),
+                'indexes': list(entry['indexes']),
+                'size_bytes': ((self.db_path / entry['file']).stat().st_size
+                               if 'file' in entry else entry['length']),
+                'loaded': False
+            }
+        
         return {
             'name': table_name,
-            'record_count': len(self.data[table_name]),
+            'record_count': self._row_count(table_name),
             'schema': self.schemas.get(table_name, {}),
             'indexes': list(self.indexes.get(table_name, {}).keys()),
-            'size_bytes': len(json.dumps(self.data[table_name]).encode('utf-8'))
+            'size_bytes': len(json.dumps(self.data[table_name]).encode('utf-8')),
+            'loaded': True
         }
     
+    @_synchronized
     def drop_table(self, table_name: str) -> bool:
         """删除表"""
         if table_name not in self.data:
@@ -526,8 +3691,10 @@ class ADB:
             del self.indexes[table_name]
         if table_name in self.schemas:
             del self.schemas[table_name]
-        return self.save_database()
+        self._forget_rows(table_name)
+        return self._log_operation('drop_table', table_name)
     
+    @_synchronized
     def update(self, table_name: str, condition: Dict[str, Any], new_values: Dict[str, Any]) -> int:
         """更新记录"""
         self._check_table_exists(table_name)
@@ -535,27 +3702,51 @@ class ADB:
         if not condition:
             raise ValidationError("更新操作必须提供条件")
         
-        updated_count = 0
-        for record in self.data[table_name]:
-            if self._match_condition(record, condition):
-                # 验证更新数据
-                temp_record = record.copy()
-                temp_record.update(new_values)
-                self._validate_record(table_name, temp_record)
-                
-                # 执行更新
-                record.update(new_values)
-                record['_updated_at'] = datetime.now().isoformat()
-                updated_count += 1
+        positions = self._matching_positions(table_name, condition)
+        for i in positions:
+            # 验证更新数据（全部通过后再执行，避免部分更新）
+            temp_record = self.data[table_name][i].copy()
+            temp_record.update(new_values)
+            self._validate_record(table_name, temp_record)
         
+        updated_count = len(positions)
         if updated_count > 0:
-            # 重建相关索引
-            self._rebuild_indexes(table_name)
-            self.save_database()
+            updated_at = datetime.now().isoformat()
+            self._apply_update(table_name, positions, new_values, updated_at)
+            self._log_operation('update', table_name, positions=positions,
+                                values=new_values, updated_at=updated_at)
             self.logger.info(f"更新表 {table_name}: {updated_count} 条记录")
         
         return updated_count
     
+    def _apply_update(self, table_name: str, positions: List[int],
+                      new_values: Dict[str, Any], updated_at: str) -> None:
+        """
+        对指定位置的记录执行更新
+        
+        更新后的记录是新的字典（写时复制），游标快照中的旧记录不受影响。
+        """
+        records = self.data[table_name]
+        # 只维护被修改列上的索引：先按旧值移除，更新后按新值加入
+        changed = [index for index in self.indexes.get(table_name, {}).values()
+                   if any(column in new_values or column == '_updated_at' for column in _index_sources(index))]
+        id_map = self._id_map.setdefault(table_name, {})
+        for i in positions:
+            for index in changed:
+                index.remove(records[i], i)
+            if '_id' in new_values and id_map.get(records[i].get('_id')) == i:
+                del id_map[records[i]['_id']]
+            self._capture_index_build(table_name, 'remove', records[i], i)
+            records[i] = {**records[i], **new_values, '_updated_at': updated_at}
+            self._capture_index_build(table_name, 'add', records[i], i)
+            for index in changed:
+                index.add(records[i], i)
+            if '_id' in new_values:
+                if id_map.get(records[i]['_id'], i) != i:
+                    self._duplicate_ids.add(table_name)
+                id_map[records[i]['_id']] = i
+    
+    @_synchronized
     def delete(self, table_name: str, condition: Dict[str, Any]) -> int:
         """删除记录"""
         self._check_table_exists(table_name)
@@ -563,24 +3754,59 @@ class ADB:
         if not condition:
             raise ValidationError("删除操作必须提供条件")
         
-        original_count = len(self.data[table_name])
-        
-        # 保留不匹配条件的记录
-        self.data[table_name] = [
-            record for record in self.data[table_name]
-            if not self._match_condition(record, condition)
-        ]
+        positions = self._matching_positions(table_name, condition)
         
-        deleted_count = original_count - len(self.data[table_name])
+        deleted_count = len(positions)
         
         if deleted_count > 0:
-            # 重建索引
-            self._rebuild_indexes(table_name)
-            self.save_database()
+            self._apply_delete(table_name, positions)
+            self._log_operation('delete', table_name, positions=positions)
             self.logger.info(f"从表 {table_name} 删除 {deleted_count} 条记录")
         
         return deleted_count
     
+    def _apply_delete(self, table_name: str, positions: List[int]) -> None:
+        """
+        删除指定位置的记录
+        
+        被删除的记录原位留下空位(None)，其余记录的位置不变，索引只需移除对应条目；
+        空位超过一半时再整理整个表。
+        """
+        records = self.data[table_name]
+        table_indexes = self.indexes.get(table_name, {})
+        id_map = self._id_map.setdefault(table_name, {})
+        for i in positions:
+            record = records[i]
+            if record is None:
+                continue
+            for index in table_indexes.values():
+                index.remove(record, i)
+            if id_map.get(record.get('_id')) == i:
+                del id_map[record['_id']]
+            self._capture_index_build(table_name, 'remove', record, i)
+            records[i] = None
+            self._tombstones[table_name] = self._tombstones.get(table_name, 0) + 1
+        
+        if self._tombstones.get(table_name, 0) * 2 > len(records):
+            self._compact_table(table_name)
+    
+    def _compact_table(self, table_name: str) -> None:
+        """移除表中的空位，并相应前移索引和 _id 映射中的记录位置"""
+        records = self.data[table_name]
+        removed = [i for i, record in enumerate(records) if record is None]
+        if not removed:
+            return
+        
+        self.data[table_name] = [record for record in records if record is not None]
+        for index in self.indexes.get(table_name, {}).values():
+            index.shift(removed)
+        for build in self._index_builds.get(table_name, {}).values():
+            if build['status'] == 'building':
+                # 快照和旁路日志中之前的位置是整理前的，应用日志时在这里整体前移
+                build['side_log'].append(('shift', removed, None))
+                build['records'] = self.data[table_name]
+        self._index_rows(table_name)
+    
     def list_tables(self) -> List[str]:
         """列出所有表名"""
         return list(self.data.keys())
@@ -591,31 +3817,123 @@ class ADB:
             return 0
         
         if condition is None:
-            return len(self.data[table_name])
+            return self._row_count(table_name)
+        
+        # 条件统计：条件完全由索引回答时直接使用索引给出的数量（位图为置位数），不读取记录
+        started = time.perf_counter()
+        plan = self._plan_index_scan(table_name, condition)
+        if plan and plan['exact']:
+            self._record_query(table_name, condition, plan, 0, plan['count'], started)
+            return plan['count']
+        return len(self._matching_positions(table_name, condition, plan))
+    
+    def distinct(self, table_name: str, column: str, condition: Optional[Dict[str, Any]] = None) -> List[Any]:
+        """
+        列出列的不重复取值（不含缺少该列的记录）
+        
+        没有条件且列上有哈希、有序或位图索引时直接读取索引的键；条件由位图索引精确回答、
+        且列上有位图索引时按位与判断各取值是否出现；其他情况在匹配的记录上遍历一次。
+        
+        Args:
+            table_name: 表名
+            column: 列名
+            condition: 查询条件
+            
+        Returns:
+            List: 不重复的取值（有序索引按值排序，其他情况按索引或记录中的出现顺序）
+        """
+        self._check_table_exists(table_name)
+        records = self.data[table_name]
+        index = self.indexes.get(table_name, {}).get(column)
+        
+        if not condition and index is not None:
+            values = self._index_values(table_name, index)
+            if values is not None:
+                return values
         
-        # 条件统计
-        count = 0
-        for record in self.data[table_name]:
-            if self._match_condition(record, condition):
-                count += 1
-        return count
+        if condition:
+            plan = self._plan_index_scan(table_name, condition)
+            if isinstance(index, _BitmapIndex) and plan and plan['exact'] and 'bitmap' in plan:
+                return [value for value in index.entries if index.bits(value) & plan['bitmap']]
+            rows = (records[i] for i in self._matching_positions(table_name, condition, plan))
+        else:
+            rows = (record for record in records if record is not None)
+        
+        values, seen = [], set()
+        for record in rows:
+            if column not in record:
+                continue
+            value = record[column]
+            try:
+                if value in seen:
+                    continue
+                seen.add(value)
+            except TypeError:
+                # 列表、字典等不可哈希的取值逐个比较
+                if value in values:
+                    continue
+            values.append(value)
+        return values
+    
+    def _index_values(self, table_name: str, index: Any) -> Optional[List[Any]]:
+        """索引中的全部不重复取值；索引不能给出完整取值时返回None"""
+        if isinstance(index, (_BitmapIndex, _HashIndex)) and index.kind != 'composite':
+            return list(index.entries)
+        if isinstance(index, _SortedIndex):
+            # 有序索引不收录无法排序的取值，只有全部记录都在索引中时才能直接使用
+            indexed = sum(len(positions) for positions in index.positions) + len(index.missing)
+            if indexed == self._row_count(table_name):
+                return [key[1] for key in index.keys]
+        return None
     
     def _rebuild_indexes(self, table_name: str) -> None:
         """重建表的所有索引"""
         if table_name not in self.indexes:
             return
         
-        for column in list(self.indexes[table_name].keys()):
-            self.create_index(table_name, column)
+        records = self.data[table_name]
+        for index in self.indexes[table_name].values():
+            index.build(records)
+        self._restart_index_builds(table_name)
+    
+    def check_indexes(self, table_name: str) -> Dict[str, bool]:
+        """
+        校验表的索引与全表扫描的结果是否一致
+        
+        Args:
+            table_name: 表名
+            
+        Returns:
+            Dict[str, bool]: 每个索引列是否一致
+        """
+        self._check_table_exists(table_name)
+        result = {}
+        records = self.data[table_name]
+        for column, index in self.indexes.get(table_name, {}).items():
+            expected = index.empty()
+            expected.build(records)
+            result[column] = expected == index
+        return result
     
-    def drop_index(self, table_name: str, column: str) -> bool:
-        """删除索引"""
+    @_synchronized
+    def drop_index(self, table_name: str, column: Union[str, List[str]],
+                   where: Optional[Dict[str, Any]] = None) -> bool:
+        """删除索引（复合索引可传入列名列表或索引名；部分索引传入列名和 where 条件，或完整的索引名）"""
+        column = _index_name(column, where)
+        self._release_auto_index(table_name, column)
+        build = self._index_builds.get(table_name, {}).pop(column, None)
+        if build is not None:
+            # 构建中或构建失败的索引尚未记录到日志，直接丢弃
+            self._cancel_index_build(build)
+            return True
         if (table_name not in self.indexes or 
             column not in self.indexes[table_name]):
             return False
         
-        del self.indexes[table_name][column]
-        return True
+        # 写时复制：不持锁的查询可能正在遍历旧的索引字典
+        self.indexes[table_name] = {name: index for name, index in self.indexes[table_name].items()
+                                    if name != column}
+        return self._log_operation('drop_index', table_name, column=column)
     
     def execute_sql_like(self, query: str) -> Any:
         """
@@ -635,6 +3953,7 @@ class ADB:
         else:
             raise ADBError(f"不支持的查询语句: {query}")
 
+    @_synchronized
     def alter_table(self, table_name: str, action: str, **kwargs) -> bool:
         """
         修改表结构
@@ -658,10 +3977,16 @@ class ADB:
             if table_name in self.schemas:
                 self.schemas[table_name][column_name] = column_def
             
-            # 为现有记录添加默认值
-            for record in self.data[table_name]:
-                if column_name not in record:
-                    record[column_name] = default_value
+            # 为现有记录添加默认值（写时复制）
+            records = self.data[table_name]
+            for i, record in enumerate(records):
+                if record is not None and column_name not in record:
+                    records[i] = {**record, column_name: default_value}
+            
+            for index in self.indexes.get(table_name, {}).values():
+                if column_name in _index_sources(index):
+                    index.build(self.data[table_name])
+            self._restart_index_builds(table_name)
                     
         elif action == 'drop_column':
             column_name = kwargs.get('column_name')
@@ -669,17 +3994,31 @@ class ADB:
             if table_name in self.schemas and column_name in self.schemas[table_name]:
                 del self.schemas[table_name][column_name]
             
-            # 从所有记录中删除该列
-            for record in self.data[table_name]:
-                if column_name in record:
-                    del record[column_name]
+            # 从所有记录中删除该列（写时复制）
+            records = self.data[table_name]
+            for i, record in enumerate(records):
+                if record is not None and column_name in record:
+                    records[i] = {key: value for key, value in record.items() if key != column_name}
             
-            # 删除相关索引
-            if table_name in self.indexes and column_name in self.indexes[table_name]:
-                del self.indexes[table_name][column_name]
-                
-        return self.save_database()
+            # 删除相关索引（包括含有该列的复合索引，写时复制）
+            if table_name in self.indexes:
+                table_indexes = self.indexes[table_name]
+                for name in [name for name, index in table_indexes.items() if column_name in _index_sources(index)]:
+                    self._release_auto_index(table_name, name)
+                self.indexes[table_name] = {name: index for name, index in table_indexes.items()
+                                            if column_name not in _index_sources(index)}
+            table_builds = self._index_builds.get(table_name, {})
+            for name in [name for name, build in table_builds.items()
+                         if column_name in _index_sources(build['index'])]:
+                self._release_auto_index(table_name, name)
+                self._cancel_index_build(table_builds.pop(name))
+        
+        log_kwargs = dict(kwargs)
+        if isinstance(log_kwargs.get('column_def'), dict):
+            log_kwargs['column_def'] = _encode_schema({'_': log_kwargs['column_def']})['_']
+        return self._log_operation('alter_table', table_name, action=action, kwargs=log_kwargs)
     
+    @_synchronized
     def rename_table(self, old_name: str, new_name: str) -> bool:
         """
         重命名表
@@ -694,22 +4033,34 @@ class ADB:
         if old_name not in self.data or new_name in self.data:
             return False
             
-        # 移动数据
-        self.data[new_name] = self.data[old_name]
-        del self.data[old_name]
+        # 移动数据（直接移动字典项，未加载的表无需读取）
+        dict.__setitem__(self.data, new_name, dict.pop(self.data, old_name))
         
         # 移动索引
         if old_name in self.indexes:
-            self.indexes[new_name] = self.indexes[old_name]
-            del self.indexes[old_name]
+            dict.__setitem__(self.indexes, new_name, dict.pop(self.indexes, old_name))
+        
+        # 移动 _id 映射、空位计数、ID序列、在线索引构建和统计信息
+        for table_map in (self._row_seq, self._id_map, self._tombstones, self._index_builds, self._query_stats,
+                          self._table_stats, self._auto_index_sizes):
+            if old_name in table_map:
+                table_map[new_name] = table_map.pop(old_name)
+        for build in self._index_builds.get(new_name, {}).values():
+            build['table'] = new_name
+        if old_name in self._duplicate_ids:
+            self._duplicate_ids.discard(old_name)
+            self._duplicate_ids.add(new_name)
+        if new_name in self._query_stats:
+            self._query_stats_dirty = True
             
         # 移动表结构
         if old_name in self.schemas:
             self.schemas[new_name] = self.schemas[old_name]
             del self.schemas[old_name]
             
-        return self.save_database()
+        return self._log_operation('rename_table', old_name, new_name=new_name)
     
+    @_synchronized
     def truncate_table(self, table_name: str) -> bool:
         """
         清空表数据（保留表结构）
@@ -724,13 +4075,15 @@ class ADB:
             return False
             
         self.data[table_name] = []
+        self._id_map[table_name] = {}
+        self._tombstones[table_name] = 0
         
         # 清空索引
         if table_name in self.indexes:
-            for column in self.indexes[table_name]:
-                self.indexes[table_name][column] = {}
+            for index in self.indexes[table_name].values():
+                index.clear()
                 
-        return self.save_database()
+        return self._log_operation('truncate_table', table_name)
     
     def get_schema(self, table_name: str) -> Optional[Dict[str, Any]]:
         """
@@ -744,6 +4097,7 @@ class ADB:
         """
         return self.schemas.get(table_name)
     
+    @_synchronized
     def set_schema(self, table_name: str, schema: Dict[str, Any]) -> bool:
         """
         设置表结构定义
@@ -759,12 +4113,16 @@ class ADB:
             return False
             
         self.schemas[table_name] = schema
-        return self.save_database()
+        return self._log_operation('set_schema', table_name, schema=_encode_schema(schema))
     
     def analyze_table(self, table_name: str) -> Dict[str, Any]:
         """
         分析表统计信息
         
+        除各列的类型、空值数和不同值数外，还为每列收集记录数、不同值数、空值比例、
+        等深直方图和最常见值（statistics），保存下来供查询规划估算条件的选择率。
+        统计信息不随写入更新，数据分布变化较大后应重新分析。
+        
         Args:
             table_name: 表名
             
@@ -774,7 +4132,7 @@ class ADB:
         if table_name not in self.data:
             return {}
             
-        records = self.data[table_name]
+        records = self._live_records(table_name)
         if not records:
             return {'record_count': 0}
             
@@ -803,9 +4161,16 @@ class ADB:
         # 转换unique_counts为数量
         for column in analysis['unique_counts']:
             analysis['unique_counts'][column] = len(analysis['unique_counts'][column])
+        
+        statistics = {column: _column_statistics([record[column] for record in records if column in record],
+                                                 len(records))
+                      for column in analysis['columns']}
+        self._table_stats[table_name] = statistics
+        analysis['statistics'] = statistics
             
         return analysis
     
+    @_synchronized
     def optimize_table(self, table_name: str) -> bool:
         """
         优化表（重建索引、整理数据）
@@ -819,22 +4184,31 @@ class ADB:
         if table_name not in self.data:
             return False
             
+        # 移除空位；记录的 _id 和 _id 序列保持不变，已删除的 _id 不会被复用
+        self._compact_table(table_name)
+        
         # 重建所有索引
         self._rebuild_indexes(table_name)
-        
-        # 重新整理记录ID
-        for i, record in enumerate(self.data[table_name]):
-            record['_id'] = i + 1
             
-        return self.save_database()
+        return self._log_operation('optimize_table', table_name)
     
-    def explain_query(self, table_name: str, condition: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def explain_query(self, table_name: str, condition: Optional[Dict[str, Any]] = None,
+                      order_by: Optional[Union[str, List[Any]]] = None, limit: Optional[int] = None,
+                      offset: int = 0) -> Dict[str, Any]:
         """
         查询执行计划分析
         
+        除选用的扫描方式外，plan 给出执行计划树：每个节点包括节点类型、估算的输出记录数
+        （estimated_rows）和累计代价（cost）。代价与 select 选择索引时使用的代价模型一致，
+        full_scan_cost 为全表扫描的代价，便于比较。指定 order_by 时 sort 给出排序方式
+        （index_order、top_k_heap 或 sort）。
+        
         Args:
             table_name: 表名
             condition: 查询条件
+            order_by: 排序列（与 select 相同）
+            limit: 限制返回记录数
+            offset: 跳过记录数
             
         Returns:
             Dict: 执行计划信息
@@ -842,6 +4216,7 @@ class ADB:
         plan = {
             'table': table_name,
             'scan_type': 'full_scan',
+            'strategy': 'full_scan',
             'estimated_rows': 0,
             'indexes_used': [],
             'condition': condition
@@ -850,22 +4225,85 @@ class ADB:
         if table_name not in self.data:
             return plan
             
-        plan['estimated_rows'] = len(self.data[table_name])
+        plan['estimated_rows'] = self._row_count(table_name)
+        full_cost = len(self.data[table_name]) * _SCAN_ROW_COST
+        plan['estimated_cost'] = plan['full_scan_cost'] = full_cost
+        plan['analyzed'] = table_name in self._table_stats
         
-        # 检查是否可以使用索引
-        if condition and table_name in self.indexes:
-            for key in condition.keys():
-                if key in self.indexes[table_name]:
-                    plan['scan_type'] = 'index_scan'
-                    plan['indexes_used'].append(key)
-                    
-                    # 估算索引扫描行数
-                    if not isinstance(condition[key], dict):
-                        index_values = self.indexes[table_name][key].get(condition[key], [])
-                        plan['estimated_rows'] = len(index_values)
+        # 检查是否可以使用索引（与select选择索引的逻辑一致）
+        index_plan = self._plan_index_scan(table_name, condition)
+        if index_plan:
+            first = index_plan['scans'][0]
+            if index_plan['strategy'] == 'primary_key':
+                plan['scan_type'] = 'primary_key_lookup'
+            elif all(scan['kind'] == 'bitmap' for scan in index_plan['scans']):
+                plan['scan_type'] = 'bitmap_scan'
+            elif index_plan['strategy'] == 'intersection':
+                plan['scan_type'] = 'index_intersection'
+            elif first['type'] == 'range':
+                plan['scan_type'] = 'index_range_scan'
+            else:
+                plan['scan_type'] = 'index_scan'
+            plan['strategy'] = index_plan['strategy']
+            plan['indexes_used'].extend(index_plan['indexes'])
+            plan['index_kind'] = first['kind']
+            plan['estimated_rows'] = index_plan['count']
+            plan['candidates'] = index_plan['count']  # 需要逐条检查条件的候选记录数
+            plan['estimated_cost'] = index_plan['cost']
+            for scan in index_plan['scans']:
+                if scan['type'] == 'range':
+                    plan['range'] = dict(scan['range'], column=scan['columns'][0])
+                    break
+        plan['plan'] = self._plan_tree(table_name, condition or {}, index_plan)
+        if order_by is not None:
+            order = _parse_order_by(order_by)
+            sort_plan = self._plan_order(table_name, condition, order, offset + limit if limit else None)
+            plan['sort'] = {'strategy': sort_plan['strategy'],
+                            'order_by': [[column, 'desc' if descending else 'asc'] for column, descending in order]}
+            if 'index' in sort_plan:
+                plan['sort']['index'] = sort_plan['index']
                     
         return plan
     
+    def _plan_tree(self, table_name: str, condition: Dict[str, Any],
+                   index_plan: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """执行计划树：索引扫描（多个时求交集）-> 条件过滤，不使用索引时为全表扫描"""
+        statistics = self._table_stats.get(table_name, {})
+        rows = self._row_count(table_name)
+        if not index_plan:
+            selectivity = 1.0
+            for column, value in condition.items():
+                selectivity *= _estimate_selectivity(statistics.get(column), value)
+            return {'node': 'full_scan', 'filter': list(condition), 'estimated_rows': round(rows * selectivity),
+                    'cost': len(self.data[table_name]) * _SCAN_ROW_COST}
+        
+        children = []
+        for scan in index_plan['scans']:
+            node = 'primary_key_lookup' if scan['kind'] == 'primary' else (
+                'index_range_scan' if scan['type'] == 'range' else f"{scan['kind']}_index_scan")
+            count = scan.get('count', index_plan['count'])  # 主键查找的扫描信息不单独记录数量
+            children.append({'node': node, 'index': scan['index'], 'type': scan['type'],
+                             'estimated_rows': count, 'cost': count * _INDEX_ROW_COST})
+        access = children[0] if len(children) == 1 else {
+            'node': 'intersection', 'children': children, 'estimated_rows': index_plan['count'],
+            'cost': sum(child['cost'] for child in children)
+        }
+        if index_plan['exact']:
+            return access
+        
+        # 索引没有精确回答的条件在候选记录上逐条检查
+        answered = {column for scan in index_plan['scans'] if scan['exact'] for column in scan['columns']}
+        residual = [column for column in condition if column not in answered]
+        selectivity = 1.0
+        for column in residual:
+            scan = next((scan for scan in index_plan['scans'] if column in scan['columns']), None)
+            if scan is None:
+                selectivity *= _estimate_selectivity(statistics.get(column), condition[column])
+        return {'node': 'filter', 'filter': residual, 'children': [access],
+                'estimated_rows': round(index_plan['count'] * min(selectivity, 1.0)),
+                'cost': index_plan['cost']}
+    
+    @_synchronized
     def vacuum(self) -> bool:
         """
         数据库维护操作（清理、压缩）
@@ -880,6 +4318,7 @@ class ADB:
                 
             # 保存并重新加载数据库文件以压缩
             self.save_database()
+            self._remove_unreferenced_files()
             self.load_database()
             
             self.logger.info("数据库维护完成")
@@ -888,6 +4327,30 @@ class ADB:
             self.logger.error(f"数据库维护失败: {e}")
             return False
     
+    def _remove_unreferenced_files(self) -> int:
+        """
+        删除目录布局下未被清单引用的数据文件及其缓存（保存中途崩溃留下的）
+        
+        打开数据库时不做清理：其他进程可能已写入新一代文件但尚未替换清单，
+        因此只在显式维护（vacuum）时调用。
+        """
+        if self.storage_layout != 'directory':
+            return 0
+        referenced = set()
+        for entry in self._table_files.values():
+            referenced.add(entry['file'])
+            referenced.add(entry['file'] + '.cache')
+        removed = 0
+        tables_dir = self.db_path / 'tables'
+        if tables_dir.exists():
+            for path in tables_dir.iterdir():
+                if f"tables/{path.name}" not in referenced:
+                    path.unlink()
+                    removed += 1
+        if removed:
+            self.logger.info(f"已清理 {removed} 个未引用的数据文件")
+        return removed
+    
     def get_database_info(self) -> Dict[str, Any]:
         """
         获取数据库整体信息
@@ -898,21 +4361,31 @@ class ADB:
         info = {
             'database_path': str(self.db_path),
             'table_count': len(self.data),
-            'total_records': sum(len(table_data) for table_data in self.data.values()),
-            'total_indexes': sum(len(table_indexes) for table_indexes in self.indexes.values()),
             'tables': {}
         }
         
         # 添加每个表的信息
         for table_name in self.data.keys():
             info['tables'][table_name] = self.get_table_info(table_name)
+        info['total_records'] = sum(t['record_count'] for t in info['tables'].values())
+        info['total_indexes'] = sum(len(t['indexes']) for t in info['tables'].values())
             
         # 文件大小
-        if os.path.exists(self.db_path):
+        if self.storage_layout == 'directory' and self.db_path.exists():
+            info['file_size_bytes'] = sum(path.stat().st_size for path in self.db_path.rglob('*')
+                                          if path.is_file())
+        elif os.path.exists(self.db_path):
             info['file_size_bytes'] = os.path.getsize(self.db_path)
+        info['storage_layout'] = self.storage_layout
+        info['journal_mode'] = self.journal_mode
+        if self.journal_mode == 'wal':
+            info['wal_size_bytes'] = self._wal_size
+        info['durability'] = self.durability
+        info['pending_bytes'] = self._dirty_bytes
             
         return info
     
+    @_synchronized
     def import_data(self, table_name: str, data: List[Dict[str, Any]], 
                    mode: str = 'insert') -> Dict[str, int]:
         """
@@ -965,7 +4438,7 @@ class ADB:
         return result
     
     def export_data(self, table_name: str, condition: Optional[Dict[str, Any]] = None,
-                   format: str = 'json') -> Union[str, List[Dict[str, Any]]]:
+                   format: str = 'json', limit: Optional[int] = None) -> Union[str, List[Dict[str, Any]]]:
         """
         导出表数据
         
@@ -973,61 +4446,460 @@ class ADB:
             table_name: 表名
             condition: 导出条件
             format: 导出格式 ('json', 'list')
+            limit: 最多导出的记录数（找到足够的记录即停止扫描）
             
         Returns:
             导出的数据
         """
-        records = self.select(table_name, condition)
+        records = self.select(table_name, condition, limit=limit)
         
         if format == 'json':
             return json.dumps(records, ensure_ascii=False, indent=2)
         else:
             return records
     
-    def create_index(self, table_name: str, column: str) -> bool:
+    def export_stream(self, table_name: str, fp: Any, condition: Optional[Dict[str, Any]] = None,
+                      format: str = 'json', batch_size: int = _CURSOR_BATCH_SIZE) -> int:
+        """
+        流式导出表数据到文件对象
+        
+        通过游标逐批取出并写出记录，内存占用与表的大小无关。'json' 格式的输出与
+        export_data 完全相同；'jsonl' 格式每行一条记录。
+        
+        Args:
+            table_name: 表名
+            fp: 可写入字符串的文件对象
+            condition: 导出条件
+            format: 导出格式 ('json', 'jsonl')
+            batch_size: 每批取出的记录数
+            
+        Returns:
+            int: 导出的记录数
+        """
+        cursor = self.iter_select(table_name, condition, batch_size)
+        for chunk in self._export_chunks(cursor, format):
+            fp.write(chunk)
+        return cursor.rownumber
+    
+    @staticmethod
+    def _export_chunks(cursor: ADBCursor, format: str):
+        """把游标中的记录按导出格式逐批序列化为字符串"""
+        if format not in ('json', 'jsonl'):
+            raise ValidationError(f"不支持的流式导出格式: {format}")
+        first = True
+        for batch in iter(cursor.fetchmany, []):
+            if format == 'jsonl':
+                yield ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in batch)
+                continue
+            # 与 json.dumps(records, indent=2) 的输出一致：每条记录缩进两格，逗号分隔
+            parts = ['  ' + json.dumps(record, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+                     for record in batch]
+            yield ('[\n' if first else ',\n') + ',\n'.join(parts)
+            first = False
+        if format == 'json':
+            yield '[]' if first else '\n]'
+    
+    @_synchronized
+    def create_index(self, table_name: str, column: Union[str, List[str]], kind: str = 'hash',
+                     tokenizer: Optional[str] = None, where: Optional[Dict[str, Any]] = None,
+                     online: bool = False) -> bool:
         """
         为表的指定列创建索引
         
         Args:
             table_name: 表名
-            column: 列名
+            column: 列名；传入多个列名的列表时创建复合索引（索引名为逗号连接的列名）；
+                    传入 lower(email)、date(_created_at)、path(address.city) 等表达式时创建表达式索引，
+                    查询条件中使用同一表达式作为键即可使用该索引
+            kind: 索引类型，'hash' 只支持等值查询；'sorted' 有序索引，
+                  还可用于 $gt/$gte/$lt/$lte 范围查询；'bitmap' 位图索引，
+                  适合取值种类少的列；'ngram' N 元组索引，用于 $like 子串匹配；
+                  'fulltext' 全文索引，用于 $text 关键词查询。复合索引只支持 'hash'
+            tokenizer: 全文索引的分词器（'cjk_bigram' 默认、'whitespace' 或 register_tokenizer 注册的名称）
+            where: 部分索引的条件，只收录满足条件的记录；查询条件包含完全相同的 where 条件时才使用该索引。
+                   部分索引名为列名加 where 条件（如 status WHERE {"archived":false}），
+                   可以与同一列上的完整索引或其他条件的部分索引并存
+            online: 在后台线程中构建索引，不阻塞读写；构建完成前查询不使用该索引，
+                    状态可通过 list_indexes(with_status=True) 查看，wait_for_index 等待完成
             
         Returns:
-            bool: 创建成功返回True
+            bool: 创建成功（在线构建时为开始构建）返回True，定义相同的索引已存在或正在构建时返回False
+        
+        Raises:
+            ADBError: 同名索引已存在但类型或分词器不同
         """
         self._check_table_exists(table_name)
+        if kind not in _INDEX_KINDS:
+            raise ADBError(f"不支持的索引类型: {kind}")
+        columns = [column] if isinstance(column, str) else list(column)
+        if not columns:
+            raise ValidationError("索引列不能为空")
+        if len(columns) > 1 and kind != 'hash':
+            raise ADBError("复合索引只支持 hash 类型")
+        if tokenizer is not None and kind != 'fulltext':
+            raise ADBError("只有全文索引可以指定分词器")
+        if where is not None and not isinstance(where, dict):
+            raise ValidationError("where 必须是条件字典")
+        if len(columns) > 1 and any(_parse_expression(column) for column in columns):
+            raise ADBError("复合索引不支持表达式列")
         
         if table_name not in self.indexes:
             self.indexes[table_name] = {}
         
-        if column in self.indexes[table_name]:
-            return False  # 索引已存在
+        name = _index_name(columns, where)
+        existing = self.indexes[table_name].get(name)
+        building = self._index_builds.get(table_name, {}).get(name)
+        if existing is None and building is not None and building['status'] == 'building':
+            existing = building['index']
+        if existing is not None:
+            # 定义相同时视为已存在；同名但类型或分词器不同时报错，避免调用方误以为新定义已生效
+            if (existing.kind == ('composite' if len(columns) > 1 else kind)
+                    and tokenizer in (None, getattr(existing, 'tokenizer', None))):
+                return False
+            raise ADBError(f"表 {table_name} 已有定义不同的索引 {name}（{existing.kind}），请先删除")
         
         # 创建索引
-        index = {}
-        for i, record in enumerate(self.data[table_name]):
-            if column in record:
-                value = record[column]
-                if value not in index:
-                    index[value] = []
-                index[value].append(i)
-        
-        self.indexes[table_name][column] = index
-        self.logger.info(f"为表 {table_name} 的列 {column} 创建索引")
-        return True
+        if len(columns) > 1:
+            index = _CompositeIndex(columns)
+        elif tokenizer is not None:
+            index = _FulltextIndex(columns[0], tokenizer)
+        else:
+            index = _INDEX_KINDS[kind](columns[0])
+        if where or len(columns) == 1 and _parse_expression(columns[0]):
+            index = _DerivedIndex(index, where)
+        extra = {key: value for key, value in (('tokenizer', tokenizer), ('where', where)) if value}
+        entry = dict(column=columns if len(columns) > 1 else columns[0], kind=kind, **extra)
+        if online:
+            self._start_index_build(table_name, name, index, entry)
+            return True
+        
+        index.build(self.data[table_name])
+        return self._install_index(table_name, name, index, entry)
+    
+    def _install_index(self, table_name: str, name: str, index: Any, entry: Dict[str, Any]) -> bool:
+        """启用构建好的索引并记录到日志"""
+        # 写时复制：不持锁的查询可能正在遍历旧的索引字典
+        self.indexes[table_name] = {**self.indexes.get(table_name, {}), name: index}
+        self.logger.info(f"为表 {table_name} 的列 {name} 创建{index.kind}索引")
+        return self._log_operation('create_index', table_name, **entry)
+    
+    def _start_index_build(self, table_name: str, name: str, index: Any, entry: Dict[str, Any]) -> None:
+        """
+        开始在线构建索引（调用方持有锁）
+        
+        持锁时只复制一份 (位置, 记录) 快照（记录是写时复制的，快照不受之后的修改影响），
+        后台线程不持锁地按快照构建索引。快照之后的所有插入、更新、删除和表整理按顺序写入
+        旁路日志，构建完成后持锁应用日志并启用索引。完成前索引不在 self.indexes 中，
+        查询不会使用它。
+        """
+        build = {
+            'table': table_name, 'name': name, 'index': index, 'entry': entry,
+            'status': 'building', 'error': None, 'generation': 0,
+            'done': threading.Event()
+        }
+        self._take_build_snapshot(build)
+        build['thread'] = threading.Thread(target=self._run_index_build, args=(build,),
+                                           name=f'adb-index-{table_name}-{name}', daemon=True)
+        self._index_builds.setdefault(table_name, {})[name] = build
+        self.logger.info(f"开始在线构建表 {table_name} 的索引 {name}")
+        build['thread'].start()
+    
+    def _take_build_snapshot(self, build: Dict[str, Any]) -> None:
+        """复制表中记录的 (位置, 记录) 快照并清空旁路日志（调用方持有锁）"""
+        records = self.data[build['table']]
+        build['records'] = records
+        build['snapshot'] = [(i, record) for i, record in enumerate(records) if record is not None]
+        build['cursor'] = 0
+        build['side_log'] = []
+    
+    def _run_index_build(self, build: Dict[str, Any]) -> None:
+        """在线构建索引的后台线程"""
+        try:
+            while True:
+                with self._lock:
+                    if build['status'] != 'building':
+                        return
+                    if self.data[build['table']] is not build['records']:
+                        # 表被整体替换（回滚、重新加载、清空），从头构建
+                        self._reset_index_build(build)
+                    generation, index, snapshot = build['generation'], build['index'], build['snapshot']
+                
+                # 不持锁按快照分批加入索引，每批之间检查是否被取消或需要从头构建
+                for start in range(0, len(snapshot), _INDEX_BUILD_CHUNK):
+                    if build['status'] != 'building' or build['generation'] != generation:
+                        break
+                    for position, record in snapshot[start:start + _INDEX_BUILD_CHUNK]:
+                        index.add(record, position)
+                    build['cursor'] = min(start + _INDEX_BUILD_CHUNK, len(snapshot))
+                    time.sleep(0)
+                
+                with self._lock:
+                    if build['status'] != 'building':
+                        return
+                    if build['generation'] != generation or self.data[build['table']] is not build['records']:
+                        continue
+                    self._apply_build_log(build)
+                    build['status'] = 'ready'
+                    del self._index_builds[build['table']][build['name']]
+                    self._install_index(build['table'], build['name'], build['index'], build['entry'])
+                    return
+        except Exception as e:
+            build['status'] = 'failed'
+            build['error'] = str(e)
+            self.logger.error(f"在线构建表 {build['table']} 的索引 {build['name']} 失败: {e}")
+        finally:
+            build['done'].set()
+    
+    def _capture_index_build(self, table_name: str, action: str, record: Dict[str, Any], position: int) -> None:
+        """在线构建期间，快照之后的修改写入旁路日志（保存修改时的内容副本）"""
+        for build in self._index_builds.get(table_name, {}).values():
+            if build['status'] == 'building':
+                build['side_log'].append((action, dict(record), position))
+    
+    @staticmethod
+    def _apply_build_log(build: Dict[str, Any]) -> None:
+        """按顺序把旁路日志应用到构建好的索引（shift 为表整理时移除的位置）"""
+        index = build['index']
+        for action, argument, position in build['side_log']:
+            if action == 'shift':
+                index.shift(argument)
+            else:
+                getattr(index, action)(argument, position)
+        build['side_log'] = []
+    
+    def _reset_index_build(self, build: Dict[str, Any]) -> None:
+        """丢弃构建进度，换成新的空索引并重新复制快照（构建线程检查 generation 后从头构建）"""
+        build['index'] = build['index'].empty()
+        build['generation'] += 1
+        self._take_build_snapshot(build)
+    
+    def _restart_index_builds(self, table_name: str) -> None:
+        """记录被整体修改（回滚、重建索引、添加列）后，表上的在线构建从头开始"""
+        for build in self._index_builds.get(table_name, {}).values():
+            if build['status'] == 'building':
+                self._reset_index_build(build)
+    
+    @staticmethod
+    def _cancel_index_build(build: Dict[str, Any]) -> None:
+        """取消在线构建，后台线程在处理下一批前退出"""
+        if build['status'] == 'building':
+            build['status'] = 'cancelled'
+    
+    def wait_for_index(self, table_name: str, column: Union[str, List[str]],
+                       timeout: Optional[float] = None, where: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        等待在线构建的索引完成
+        
+        Args:
+            table_name: 表名
+            column: 列名、列名列表或索引名
+            timeout: 最长等待秒数，None 表示一直等待
+            where: 部分索引的条件（与 create_index 相同）
+            
+        Returns:
+            bool: 索引已可用返回True（构建失败、被取消或超时返回False）
+        """
+        name = _index_name(column, where)
+        build = self._index_builds.get(table_name, {}).get(name)
+        if build is not None:
+            build['done'].wait(timeout)
+        return name in self.indexes.get(table_name, {})
+    
+    def query_stats(self, table_name: str) -> List[Dict[str, Any]]:
+        """
+        表的查询负载统计
+        
+        Args:
+            table_name: 表名
+            
+        Returns:
+            List[Dict]: 每种条件形状的查询次数、全表扫描次数、检查/匹配的记录数和累计耗时，按耗时降序
+        """
+        self._check_table_exists(table_name)
+        with self._stats_lock:
+            stats = [dict(entry, shape=[list(item) for item in shape])
+                     for shape, entry in self._query_stats.get(table_name, {}).items()]
+        return sorted(stats, key=lambda entry: entry['seconds'], reverse=True)
+    
+    def advise_indexes(self, table_name: str, apply: bool = False) -> List[Dict[str, Any]]:
+        """
+        根据记录的查询负载推荐索引
+        
+        对检查的记录数明显多于匹配数的条件形状，为等值/$in 列推荐哈希索引、为范围列推荐有序索引、
+        为多个等值列推荐复合索引，按估计减少的记录检查次数排序。
+        
+        Args:
+            table_name: 表名
+            apply: 为True时按顺序创建推荐的索引，估计总大小不超过 auto_index_memory
+            
+        Returns:
+            List[Dict]: 推荐列表，包括索引名、列、类型、估计节省的记录检查次数、估计大小、
+                        受益的查询次数和条件形状；已创建的推荐带有 created=True
+        """
+        self._check_table_exists(table_name)
+        if apply:
+            return self._advise_and_create(table_name, online=False)
+        return self._recommend_indexes(table_name)
+    
+    def _recommend_indexes(self, table_name: str) -> List[Dict[str, Any]]:
+        """计算索引推荐（不修改数据库）"""
+        with self._lock:
+            rows = self._row_count(table_name)
+            existing = set(self.indexes.get(table_name, {})) | set(self._index_builds.get(table_name, {}))
+        with self._stats_lock:
+            workload = [(shape, dict(entry)) for shape, entry in self._query_stats.get(table_name, {}).items()]
+        
+        distinct_counts = {}
+        def distinct_count(column):
+            if column not in distinct_counts:
+                distinct_counts[column] = max(len(self.distinct(table_name, column)), 1)
+            return distinct_counts[column]
+        
+        selectivity = {'eq': None, 'in': None, 'range': 1 / 3}
+        recommendations = {}
+        for shape, entry in workload:
+            calls = entry['calls']
+            scanned, matched = entry['rows_scanned'] / calls, entry['rows_matched'] / calls
+            if scanned <= max(matched, 1) * 2:
+                continue  # 已经足够高效
+            
+            columns_in_shape = {column for column, _ in shape}
+            options = [('sorted' if op == 'range' else 'hash', [column])
+                       for column, op in shape if op in selectivity]
+            equal_columns = [column for column, op in shape if op == 'eq']
+            if len(equal_columns) > 1:
+                options.append(('hash', equal_columns))
+            
+            for kind, columns in options:
+                name = _index_name(columns if len(columns) > 1 else columns[0])
+                if name in existing:
+                    continue
+                if set(columns) == columns_in_shape:
+                    estimated = matched
+                else:
+                    fraction = 1.0
+                    for column in columns:
+                        op = dict(shape)[column]
+                        fraction *= selectivity[op] or 1 / distinct_count(column)
+                    estimated = max(matched, rows * fraction)
+                savings = calls * (scanned - estimated)
+                if savings <= 0:
+                    continue
+                
+                key = (kind, name)
+                if key not in recommendations:
+                    keys = rows if len(columns) > 1 else distinct_count(columns[0])
+                    recommendations[key] = {
+                        'name': name, 'columns': columns, 'kind': kind,
+                        'estimated_savings': 0, 'estimated_bytes': _estimate_index_bytes(rows, keys),
+                        'queries': 0, 'shapes': []
+                    }
+                recommendation = recommendations[key]
+                recommendation['estimated_savings'] += int(savings)
+                recommendation['queries'] += calls
+                recommendation['shapes'].append([list(item) for item in shape])
+        
+        return sorted(recommendations.values(), key=lambda item: item['estimated_savings'], reverse=True)
+    
+    def _advise_and_create(self, table_name: str, online: bool) -> List[Dict[str, Any]]:
+        """创建推荐的索引，直到达到 auto_index_memory 预算（评估在锁外进行，创建时持有锁）"""
+        recommendations = self._recommend_indexes(table_name)
+        created = set()
+        with self._lock:
+            for recommendation in recommendations:
+                if self._closed or table_name not in self.data:
+                    break
+                if recommendation['name'] in created:
+                    continue  # 同名索引只能创建一种类型
+                if self._auto_index_bytes + recommendation['estimated_bytes'] > self.auto_index_memory:
+                    continue
+                columns = recommendation['columns']
+                if self.create_index(table_name, columns if len(columns) > 1 else columns[0],
+                                     recommendation['kind'], online=online):
+                    self._auto_index_bytes += recommendation['estimated_bytes']
+                    self._auto_index_sizes.setdefault(table_name, {})[recommendation['name']] = \
+                        recommendation['estimated_bytes']
+                    recommendation['created'] = True
+                    created.add(recommendation['name'])
+                    self.logger.info(f"根据查询负载为表 {table_name} 创建索引 {recommendation['name']}")
+        return recommendations
+    
+    def _release_auto_index(self, table_name: str, name: str) -> None:
+        """自动创建的索引被删除时，从 auto_index_memory 预算中扣除其估计大小"""
+        sizes = self._auto_index_sizes.get(table_name)
+        if sizes and name in sizes:
+            self._auto_index_bytes -= sizes.pop(name)
+            if not sizes:
+                del self._auto_index_sizes[table_name]
+    
+    def _query_stats_path(self) -> Path:
+        """查询负载统计保存在数据库旁的文件中，供命令行等新进程给出索引建议"""
+        return Path(str(self.db_path) + '.workload.json')
+    
+    def _load_query_stats(self) -> None:
+        """读取上次关闭时保存的查询负载统计"""
+        path = self._query_stats_path()
+        if not path.is_file():
+            return
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            for table_name, entries in saved.items():
+                self._query_stats[table_name] = OrderedDict(
+                    (tuple(tuple(item) for item in entry.pop('shape')), entry) for entry in entries)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.warning(f"读取查询负载统计失败: {e}")
     
-    def list_indexes(self, table_name: str) -> List[str]:
+    def _save_query_stats(self) -> None:
+        """
+        保存查询负载统计（自上次保存以来没有变化时不写文件）
+        
+        与 auto_index 无关：advise_indexes 在新进程（如命令行）中依赖保存的统计给出建议，
+        auto_index 只控制是否自动创建索引。
+        """
+        if not self._query_stats_dirty:
+            return
+        with self._stats_lock:
+            self._query_stats_dirty = False
+            content = {table_name: [dict(entry, shape=[list(item) for item in shape])
+                                    for shape, entry in table_stats.items()]
+                       for table_name, table_stats in self._query_stats.items()}
+        try:
+            with open(self._query_stats_path(), 'w', encoding='utf-8') as f:
+                json.dump(content, f, ensure_ascii=False)
+        except OSError as e:
+            self._query_stats_dirty = True
+            self.logger.warning(f"保存查询负载统计失败: {e}")
+    
+    def list_indexes(self, table_name: str, with_status: bool = False) -> List[Any]:
         """
         列出表的所有索引
         
         Args:
             table_name: 表名
+            with_status: 为True时返回每个索引的名称、类型和状态（ready/building/failed），
+                         包括正在在线构建的索引及其进度
             
         Returns:
-            List[str]: 索引列表
+            List: 索引名列表；with_status 为True时为状态字典列表
         """
         self._check_table_exists(table_name)
-        return list(self.indexes.get(table_name, {}).keys())
+        if not with_status:
+            if not self._is_loaded(table_name):
+                return list(self._table_files[table_name]['indexes'])
+            return list(self.indexes.get(table_name, {}).keys())
+        
+        result = [{'name': name, 'kind': index.kind, 'status': 'ready'}
+                  for name, index in self.indexes.get(table_name, {}).items()]
+        with self._lock:
+            for name, build in self._index_builds.get(table_name, {}).items():
+                total = len(build['snapshot'])
+                status = {'name': name, 'kind': build['index'].kind, 'status': build['status'],
+                          'progress': round(build['cursor'] / total, 4) if total else 0.0}
+                if build['error']:
+                    status['error'] = build['error']
+                result.append(status)
+        return result
     
 class ADBAPIServer:
     """
@@ -1161,9 +5033,9 @@ class ADBAPIServer:
         @self.app.route('/api/tables/<table_name>', methods=['DELETE'])
         @self._require_api_key
         def drop_table(table_name):
-            success = self.db.drop_table(table_name)
-            return jsonify({'message': f'Table {table_name} dropped'}) if success else \
-                   jsonify({'error': f'Table {table_name} not found'}), 404
+            if self.db.drop_table(table_name):
+                return jsonify({'message': f'Table {table_name} dropped'})
+            return jsonify({'error': f'Table {table_name} not found'}), 404
         
         # 记录操作路由
         @self.app.route('/api/tables/<table_name>/records', methods=['POST'])
@@ -1196,6 +5068,19 @@ class ADBAPIServer:
         @self._require_api_key
         def select_records(table_name):
             try:
+                # 按ID批量获取: ?ids=1,2,3
+                ids_str = request.args.get('ids')
+                if ids_str is not None:
+                    try:
+                        ids = [int(record_id) for record_id in ids_str.split(',') if record_id.strip()]
+                    except ValueError:
+                        return jsonify({'error': 'ids must be comma-separated integers'}), 400
+                    
+                    def get_many():
+                        records = self.db.get_many(table_name, ids)
+                        return {'records': records, 'count': len(records)}
+                    return self._handle_api_call(get_many)
+                
                 condition = None
                 condition_str = request.args.get('condition')
                 if condition_str:
@@ -1203,20 +5088,42 @@ class ADBAPIServer:
                 
                 limit = request.args.get('limit', type=int)
                 offset = request.args.get('offset', type=int, default=0)
+                # 排序：order_by=price:desc,_id（省略方向时为升序）
+                order_by = request.args.get('order_by')
+                if order_by:
+                    order_by = [tuple(item.split(':', 1)) if ':' in item else item
+                                for item in order_by.split(',') if item.strip()]
                 
                 # 限制返回数量，防止内存溢出
                 if limit and limit > 10000:
                     return jsonify({'error': 'Limit cannot exceed 10000'}), 400
                 
-                records = self.db.select(table_name, condition, limit, offset)
-                total_count = self.db.count(table_name, condition)
+                # 游标分页：cursor 为上一页返回的 next_cursor；with_total=false 时不统计总数
+                cursor = request.args.get('cursor')
+                with_total = request.args.get('with_total', 'true').lower() not in ('false', '0', 'no')
                 
-                return jsonify({
-                    'records': records, 
-                    'count': len(records),
-                    'total_count': total_count,
-                    'has_more': offset + len(records) < total_count
-                })
+                text_query = bool(condition) and bool(self.db._text_columns(condition))
+                try:
+                    if text_query:
+                        # $text 结果按相关度排序，只支持 offset 分页
+                        page = {'records': self.db.select(table_name, condition, limit, offset,
+                                                          order_by=order_by or None), 'next_cursor': None}
+                    else:
+                        page = self.db.select_page(table_name, condition, limit, offset,
+                                                   order_by=order_by or None, cursor=cursor)
+                except ValidationError as e:
+                    return jsonify({'error': str(e)}), 400
+                
+                response = {
+                    'records': page['records'],
+                    'count': len(page['records']),
+                    'next_cursor': page['next_cursor']
+                }
+                if with_total or text_query:
+                    response['total_count'] = self.db.count(table_name, condition)
+                response['has_more'] = (offset + len(page['records']) < response['total_count'] if text_query
+                                        else page['has_more'])
+                return jsonify(response)
             except json.JSONDecodeError:
                 return jsonify({'error': 'Invalid condition JSON'}), 400
             except Exception as e:
@@ -1243,7 +5150,23 @@ class ADBAPIServer:
             data = request.get_json()
             if not data.get('column'):
                 return jsonify({'error': 'Column name is required'}), 400
-            return self._handle_api_call(self.db.create_index, table_name, data.get('column'))
+            return self._handle_api_call(self.db.create_index, table_name, data.get('column'),
+                                         data.get('kind', 'hash'), data.get('tokenizer'), data.get('where'),
+                                         bool(data.get('online', False)))
+        
+        @self.app.route('/api/tables/<table_name>/indexes', methods=['GET'])
+        @self._require_api_key
+        def list_indexes(table_name):
+            return self._handle_api_call(lambda: {'indexes': self.db.list_indexes(table_name, with_status=True)})
+        
+        @self.app.route('/api/tables/<table_name>/indexes/advice', methods=['GET', 'POST'])
+        @self._require_api_key
+        def advise_indexes(table_name):
+            # GET 只给出建议，POST 按建议创建索引
+            return self._handle_api_call(lambda: {
+                'recommendations': self.db.advise_indexes(table_name, apply=request.method == 'POST'),
+                'workload': self.db.query_stats(table_name)
+            })
         
         @self.app.route('/api/tables/<table_name>/indexes/<column>', methods=['DELETE'])
         @self._require_api_key
@@ -1256,6 +5179,16 @@ class ADBAPIServer:
             condition = json.loads(request.args.get('condition', 'null'))
             return self._handle_api_call(self.db.count, table_name, condition)
         
+        @self.app.route('/api/tables/<table_name>/distinct/<column>', methods=['GET'])
+        @self._require_api_key
+        def distinct_values(table_name, column):
+            condition = json.loads(request.args.get('condition', 'null'))
+            
+            def distinct():
+                values = self.db.distinct(table_name, column, condition)
+                return {'values': values, 'count': len(values)}
+            return self._handle_api_call(distinct)
+        
         @self.app.route('/api/tables/<table_name>/aggregate', methods=['POST'])
         @self._require_api_key
         def aggregate_query(table_name):
@@ -1307,7 +5240,18 @@ class ADBAPIServer:
         def export_data(table_name):
             condition = json.loads(request.args.get('condition', 'null'))
             format_type = request.args.get('format', 'json')
-            data = self.db.export_data(table_name, condition, format_type)
+            limit = request.args.get('limit', type=int)
+            if format_type in ('json', 'jsonl') and not limit:
+                # 完整导出时逐批流式返回，不在内存中生成整个响应
+                try:
+                    cursor = self.db.iter_select(table_name, condition)
+                except TableNotFoundError as e:
+                    return jsonify({'error': str(e), 'error_type': 'not_found'}), 404
+                except ADBError as e:
+                    return jsonify({'error': str(e), 'error_type': 'database'}), 400
+                mimetype = 'application/json' if format_type == 'json' else 'application/x-ndjson'
+                return Response(self.db._export_chunks(cursor, format_type), mimetype=mimetype)
+            data = self.db.export_data(table_name, condition, format_type, limit)
             
             if format_type == 'json':
                 return data, 200, {'Content-Type': 'application/json'}
@@ -10,7 +10,7 @@ from pathlib import Path
 # 添加当前目录到路径
 sys.path.insert(0, str(Path(__file__).parent))
 
-from adb import ADB, ADBError
+from adb import ADB, ADBError, supports_lazy_load
 
 def show_interactive_menu(parser):
     """显示交互式菜单"""
@@ -66,7 +66,7 @@ def interactive_create_table():
             print("❌ 表名不能为空")
             return
             
-        db = ADB(db_path, enable_logging=True)
+        db = ADB(db_path, enable_logging=True, lazy_load=supports_lazy_load(db_path))
         success = db.create_table(table_name)
         
         if success:
@@ -81,7 +81,7 @@ def interactive_list_tables():
     """交互式列出表"""
     try:
         db_path = input("数据库文件路径 (回车使用默认 'adb_data.json'): ").strip() or "adb_data.json"
-        db = ADB(db_path, enable_logging=True)
+        db = ADB(db_path, enable_logging=True, lazy_load=supports_lazy_load(db_path))
         tables = db.list_tables()
         
         if not tables:
@@ -116,7 +116,7 @@ def interactive_insert():
         import json
         data = json.loads(data_str)
         
-        db = ADB(db_path, enable_logging=True)
+        db = ADB(db_path, enable_logging=True, lazy_load=supports_lazy_load(db_path))
         success = db.insert(table_name, data)
         
         if success:
@@ -142,7 +142,7 @@ def interactive_select():
         limit_str = input("限制结果数量 (回车显示所有): ").strip()
         limit = int(limit_str) if limit_str else None
         
-        db = ADB(db_path, enable_logging=True)
+        db = ADB(db_path, enable_logging=True, lazy_load=supports_lazy_load(db_path))
         records = db.select(table_name, limit=limit)
         
         print(f"\n📋 查询结果 (共 {len(records)} 条记录):")
@@ -161,7 +161,7 @@ def interactive_backup():
         db_path = input("数据库文件路径 (回车使用默认 'adb_data.json'): ").strip() or "adb_data.json"
         backup_path = input("备份文件路径 (回车自动生成): ").strip() or None
         
-        db = ADB(db_path, enable_logging=True)
+        db = ADB(db_path, enable_logging=True, lazy_load=supports_lazy_load(db_path))
         success = db.backup(backup_path)
         
         if success:
@@ -185,7 +185,7 @@ def main():
     create_parser.add_argument("--schema", help="表结构JSON文件")
     
     # 列出表命令
-    list_parser = subparsers.add_parser("list-tables", help="列出所有表")
+    subparsers.add_parser("list-tables", help="列出所有表")
     
     # 插入数据命令
     insert_parser = subparsers.add_parser("insert", help="插入数据")
@@ -202,6 +202,20 @@ def main():
     backup_parser = subparsers.add_parser("backup", help="备份数据库")
     backup_parser.add_argument("--path", help="备份文件路径")
     
+    # 迁移存储布局命令
+    migrate_parser = subparsers.add_parser("migrate", help="迁移存储布局")
+    migrate_parser.add_argument("--layout", choices=["file", "directory"], default="directory",
+                                help="目标存储布局")
+    migrate_parser.add_argument("--target", help="目标路径")
+    
+    # 数据库维护命令
+    subparsers.add_parser("vacuum", help="数据库维护（重建索引、压缩并清理未引用的数据文件）")
+    
+    # 索引建议命令
+    advise_parser = subparsers.add_parser("advise-indexes", help="根据查询负载推荐索引")
+    advise_parser.add_argument("table", help="表名")
+    advise_parser.add_argument("--apply", action="store_true", help="按建议创建索引")
+    
     args = parser.parse_args()
     
     if not args.command:
@@ -209,8 +223,9 @@ def main():
         show_interactive_menu(parser)
         return
     
+    db = None
     try:
-        db = ADB(args.db, enable_logging=True)
+        db = ADB(args.db, enable_logging=True, lazy_load=supports_lazy_load(args.db))
         
         if args.command == "create-table":
             schema = None
@@ -248,12 +263,36 @@ def main():
             success = db.backup(args.path)
             print(f"备份{'成功' if success else '失败'}")
             
+        elif args.command == "migrate":
+            success = db.migrate_storage(args.layout, args.target)
+            if success:
+                print(f"已迁移到 {args.layout} 布局: {db.db_path}")
+            else:
+                print(f"数据库已是 {args.layout} 布局")
+        
+        elif args.command == "vacuum":
+            success = db.vacuum()
+            print(f"数据库维护{'完成' if success else '失败'}")
+        
+        elif args.command == "advise-indexes":
+            recommendations = db.advise_indexes(args.table, apply=args.apply)
+            if not recommendations:
+                print(f"表 {args.table} 暂无索引建议（没有足够的查询记录或现有索引已够用）")
+            for item in recommendations:
+                created = " [已创建]" if item.get('created') else ""
+                print(f"  - {item['name']} ({item['kind']}){created}: 预计减少 {item['estimated_savings']} 次记录检查，"
+                      f"约 {item['estimated_bytes'] / 1024:.0f}KB，涉及 {item['queries']} 次查询")
+            
     except ADBError as e:
         print(f"❌ ADB错误: {e}")
         sys.exit(1)
     except Exception as e:
         print(f"❌ 未知错误: {e}")
         sys.exit(1)
+    finally:
+        # 写入未落盘的变更和本次记录的查询负载（供之后的 advise-indexes 使用）
+        if db is not None:
+            db.close()
 
 if __name__ == "__main__":
     main()
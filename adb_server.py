@@ -10,7 +10,7 @@ from pathlib import Path
 # 添加当前目录到路径
 sys.path.insert(0, str(Path(__file__).parent))
 
-from adb import ADB, ADBAPIServer
+from adb import ADB, ADBAPIServer, supports_lazy_load
 
 def main():
     parser = argparse.ArgumentParser(description="ADB API 服务器")
@@ -24,7 +24,7 @@ def main():
     
     try:
         # 创建数据库实例
-        db = ADB(args.db, enable_logging=True)
+        db = ADB(args.db, enable_logging=True, lazy_load=supports_lazy_load(args.db))
         
         # 创建API服务器
         server = ADBAPIServer(db, api_key=args.api_key)
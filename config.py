@@ -31,7 +31,20 @@ class ADBConfig:
                 'path': './data/adb_database.json',
                 'backup_dir': './backups',
                 'auto_backup_interval': 3600,  # 秒
-                'max_records_per_table': 100000
+                'max_records_per_table': 100000,
+                'storage_layout': 'file',  # file: 单个JSON文件; directory: 清单文件 + 每表一个数据文件
+                'lazy_load': False,  # 打开时只读取元数据，表数据首次访问时加载（目录布局或压缩快照格式）
+                'snapshot_cache': False,  # 保存时写入二进制快照缓存(.cache)，加速启动
+                'snapshot_format': 'json',  # json: 可读的JSON; compressed: 分块压缩并带CRC校验（读取时自动识别）
+                'compression': 'zlib',  # zlib / lzma / bz2（snapshot_format=compressed时生效）
+                'compression_level': 6,
+                'journal_mode': 'snapshot',  # snapshot: 每次写入保存完整快照; wal: 追加预写日志
+                'wal_fsync': 'always',  # always / interval / never
+                'wal_fsync_interval': 1.0,  # 秒（wal_fsync=interval时生效）
+                'wal_checkpoint_size': 4194304,  # WAL超过该大小(字节)时自动检查点
+                'durability': 'sync',  # sync: 写操作返回前落盘; group: 并发写合并刷盘; async: 后台定时刷盘（崩溃时可能丢失最近的变更）
+                'flush_interval': 1.0,  # 秒（async模式的合并刷盘间隔）
+                'flush_bytes': 1048576  # 未落盘变更超过该大小(字节)时提前刷盘
             },
             
             # 日志配置
@@ -60,7 +73,9 @@ class ADBConfig:
             
             # 性能配置
             'performance': {
-                'index_cache_size': 1000,
+                'query_stats_size': 1000,     # 每张表最多记录的查询条件形状数
+                'auto_index': False,          # 根据查询负载自动创建索引
+                'auto_index_memory': 67108864,  # 自动创建的索引总大小上限（64MB）
                 'query_timeout': 30,
                 'transaction_timeout': 60,
                 'memory_limit': 536870912  # 512MB
@@ -88,6 +103,22 @@ class ADBConfig:
             self._config['database']['path'] = os.getenv('ADB_DATABASE_PATH')
         if os.getenv('ADB_BACKUP_DIR'):
             self._config['database']['backup_dir'] = os.getenv('ADB_BACKUP_DIR')
+        if os.getenv('ADB_STORAGE_LAYOUT'):
+            self._config['database']['storage_layout'] = os.getenv('ADB_STORAGE_LAYOUT')
+        if os.getenv('ADB_LAZY_LOAD'):
+            self._config['database']['lazy_load'] = os.getenv('ADB_LAZY_LOAD').lower() == 'true'
+        if os.getenv('ADB_SNAPSHOT_CACHE'):
+            self._config['database']['snapshot_cache'] = os.getenv('ADB_SNAPSHOT_CACHE').lower() == 'true'
+        if os.getenv('ADB_SNAPSHOT_FORMAT'):
+            self._config['database']['snapshot_format'] = os.getenv('ADB_SNAPSHOT_FORMAT')
+        if os.getenv('ADB_COMPRESSION'):
+            self._config['database']['compression'] = os.getenv('ADB_COMPRESSION')
+        if os.getenv('ADB_JOURNAL_MODE'):
+            self._config['database']['journal_mode'] = os.getenv('ADB_JOURNAL_MODE')
+        if os.getenv('ADB_DURABILITY'):
+            self._config['database']['durability'] = os.getenv('ADB_DURABILITY')
+        if os.getenv('ADB_WAL_FSYNC'):
+            self._config['database']['wal_fsync'] = os.getenv('ADB_WAL_FSYNC')
         
         # 日志配置
         if os.getenv('ADB_LOG_LEVEL'):
@@ -108,8 +139,10 @@ class ADBConfig:
         # 性能配置
         if os.getenv('ADB_MAX_RECORDS_PER_TABLE'):
             self._config['database']['max_records_per_table'] = int(os.getenv('ADB_MAX_RECORDS_PER_TABLE'))
-        if os.getenv('ADB_INDEX_CACHE_SIZE'):
-            self._config['performance']['index_cache_size'] = int(os.getenv('ADB_INDEX_CACHE_SIZE'))
+        if os.getenv('ADB_QUERY_STATS_SIZE'):
+            self._config['performance']['query_stats_size'] = int(os.getenv('ADB_QUERY_STATS_SIZE'))
+        if os.getenv('ADB_AUTO_INDEX'):
+            self._config['performance']['auto_index'] = os.getenv('ADB_AUTO_INDEX').lower() == 'true'
         
         # 安全配置
         if os.getenv('ADB_ALLOW_SCHEMA_CHANGES'):
@@ -226,6 +259,28 @@ class ADBConfig:
         if log_level not in ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']:
             errors.append("无效的日志级别")
         
+        # 验证存储布局和日志模式
+        if self.get('database.storage_layout') not in ['file', 'directory']:
+            errors.append("storage_layout 必须是 file 或 directory")
+        if self.get('database.snapshot_format') not in ['json', 'compressed']:
+            errors.append("snapshot_format 必须是 json 或 compressed")
+        if self.get('database.compression') not in ['zlib', 'lzma', 'bz2']:
+            errors.append("compression 必须是 zlib、lzma 或 bz2")
+        if self.get('database.journal_mode') not in ['snapshot', 'wal']:
+            errors.append("journal_mode 必须是 snapshot 或 wal")
+        if self.get('database.wal_fsync') not in ['always', 'interval', 'never']:
+            errors.append("wal_fsync 必须是 always、interval 或 never")
+        if self.get('database.durability') not in ['sync', 'group', 'async']:
+            errors.append("durability 必须是 sync、group 或 async")
+        
+        memory = self.get('performance.auto_index_memory')
+        if not isinstance(memory, int) or memory < 0:
+            errors.append("auto_index_memory 必须是非负整数")
+        
+        stats_size = self.get('performance.query_stats_size')
+        if not isinstance(stats_size, int) or stats_size <= 0:
+            errors.append("query_stats_size 必须是正整数")
+        
         if errors:
             for error in errors:
                 print(f"配置错误: {error}")
@@ -0,0 +1,98 @@
+"""
+ADB 条件匹配性能基准测试
+
+比较逐条解释条件字典（_match_condition）与按条件结构编译的谓词（_compile_condition）
+每秒检查的记录数，以及两种方式下全表扫描 select 的耗时。
+
+用法:
+    python scripts/benchmark_predicates.py
+    python scripts/benchmark_predicates.py --size 200000 --repeat 5
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import adb
+from adb import ADB, _compile_condition, _match_condition
+
+CONDITIONS = {
+    '等值': {'city': '上海'},
+    '范围': {'age': {'$gte': 20, '$lt': 40}},
+    '模糊': {'email': {'$like': 'USER1'}},
+    '$in': {'city': {'$in': ['北京', '广州']}},
+    '组合': {'city': '深圳', 'age': {'$gt': 30}, 'email': {'$like': '9@'}},
+}
+
+def build_records(size: int) -> list:
+    """生成size条测试记录"""
+    return [
+        {
+            '_id': i + 1,
+            'name': f'用户{i}',
+            'age': 18 + i % 60,
+            'email': f'user{i}@example.com',
+            'city': ('北京', '上海', '广州', '深圳')[i % 4]
+        }
+        for i in range(size)
+    ]
+
+def best_of(repeat: int, func) -> float:
+    """多次运行，返回最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def interpret_condition(condition):
+    """代替 _compile_condition：返回逐条解释执行条件字典的谓词"""
+    return lambda record: _match_condition(record, condition)
+
+def main():
+    """运行条件匹配基准测试"""
+    parser = argparse.ArgumentParser(description="ADB 条件匹配性能基准测试")
+    parser.add_argument("--size", type=int, default=200000, help="记录数量")
+    parser.add_argument("--repeat", type=int, default=3, help="每种情况重复次数（取最短耗时）")
+    args = parser.parse_args()
+
+    records = build_records(args.size)
+    print("=== ADB 条件匹配性能基准测试 ===\n")
+    print(f"记录数: {args.size}\n")
+    print(f"{'条件':>6} {'解释执行':>14} {'编译谓词':>14} {'加速比':>8}")
+    for label, condition in CONDITIONS.items():
+        interpreted = best_of(args.repeat, lambda: [r for r in records if _match_condition(r, condition)])
+        compiled = best_of(args.repeat, lambda: list(filter(_compile_condition(condition), records)))
+        print(f"{label:>6} {args.size / interpreted:>11,.0f}行/s {args.size / compiled:>11,.0f}行/s "
+              f"{interpreted / compiled:>7.1f}x")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        db = ADB(db_path=os.path.join(temp_dir, "bench.json"), enable_logging=False)
+        db.max_records = max(db.max_records, args.size)
+        db.create_table("users")
+        db.data["users"] = records
+        db._index_rows("users")
+
+        print(f"\n{'select':>6} {'解释执行':>14} {'编译谓词':>14} {'加速比':>8}")
+        for label, condition in CONDITIONS.items():
+            with mock.patch.object(adb, '_compile_condition', interpret_condition):
+                interpreted = best_of(args.repeat, lambda: db.select("users", condition))
+            compiled = best_of(args.repeat, lambda: db.select("users", condition))
+            print(f"{label:>6} {interpreted * 1000:>12.1f}ms {compiled * 1000:>12.1f}ms "
+                  f"{interpreted / compiled:>7.1f}x")
+        db.close()
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+ADB 启动性能基准测试
+
+比较不同数据量下，仅使用JSON文件与使用二进制快照缓存(.cache)时的冷启动耗时。
+
+用法:
+    python scripts/benchmark_startup.py
+    python scripts/benchmark_startup.py --sizes 10000 100000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from adb import ADB
+
+def build_database(db_path: str, size: int) -> None:
+    """生成包含size条记录的数据库，并写入JSON文件和快照缓存"""
+    db = ADB(db_path=db_path, enable_logging=False, snapshot_cache=True)
+    db.max_records = max(db.max_records, size)
+    db.create_table("users")
+
+    # 直接构造记录，避免逐条插入的开销影响基准准备时间
+    db.data["users"] = [
+        {
+            '_id': i + 1,
+            '_created_at': '2024-01-01T00:00:00',
+            'name': f'用户{i}',
+            'age': 18 + i % 60,
+            'email': f'user{i}@example.com',
+            'city': ('北京', '上海', '广州', '深圳')[i % 4]
+        }
+        for i in range(size)
+    ]
+    db.save_database()
+    db.close()
+
+def time_open(db_path: str, snapshot_cache: bool, repeat: int) -> float:
+    """多次打开数据库，返回最短耗时（秒）"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        db = ADB(db_path=db_path, enable_logging=False, snapshot_cache=snapshot_cache)
+        elapsed = time.perf_counter() - start
+        db.close()
+        best = min(best, elapsed)
+    return best
+
+def main():
+    """运行启动基准测试"""
+    parser = argparse.ArgumentParser(description="ADB 启动性能基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000],
+                        help="记录数量列表")
+    parser.add_argument("--repeat", type=int, default=3, help="每种情况重复次数（取最短耗时）")
+    args = parser.parse_args()
+
+    print("=== ADB 启动性能基准测试 ===\n")
+    print(f"{'记录数':>10} {'JSON大小':>12} {'缓存大小':>12} {'JSON启动':>10} {'缓存启动':>10} {'加速比':>8}")
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        for size in args.sizes:
+            db_path = os.path.join(temp_dir, f"bench_{size}.json")
+            build_database(db_path, size)
+
+            json_time = time_open(db_path, snapshot_cache=False, repeat=args.repeat)
+            cache_time = time_open(db_path, snapshot_cache=True, repeat=args.repeat)
+            json_size = os.path.getsize(db_path) / 1024 / 1024
+            cache_size = os.path.getsize(db_path + ".cache") / 1024 / 1024
+
+            print(f"{size:>10} {json_size:>10.1f}MB {cache_size:>10.1f}MB "
+                  f"{json_time:>9.3f}s {cache_time:>9.3f}s {json_time / cache_time:>7.1f}x")
+    finally:
+        shutil.rmtree(temp_dir)
+
+if __name__ == "__main__":
+    main()
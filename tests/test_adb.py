@@ -3,16 +3,28 @@ ADB 测试套件
 """
 
 import unittest
+import io
 import tempfile
 import shutil
+import json
 import os
+import time
+import threading
+import weakref
+import gc
+import subprocess
 from pathlib import Path
+from unittest import mock
 import sys
 
 # 添加项目根目录到路径
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from adb import ADB, ADBError, ValidationError, TableNotFoundError
+import adb
+
+from adb import (ADB, ADBError, ValidationError, TableNotFoundError, register_tokenizer,
+                 register_key_function, _compile_condition, _match_condition, _predicate_factory,
+                 _close_open_databases, supports_lazy_load)
 
 class TestADB(unittest.TestCase):
     """ADB核心功能测试"""
@@ -189,5 +201,2158 @@ class TestADB(unittest.TestCase):
         self.assertTrue(self.db.drop_table("renamed_table"))
         self.assertNotIn("renamed_table", self.db.list_tables())
 
+class TestWAL(unittest.TestCase):
+    """WAL日志模式测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "wal_db.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal', durability='sync')
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def reopen(self):
+        """模拟进程重启"""
+        self.db.close()
+        return ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal', durability='sync')
+    
+    def test_mutations_append_to_wal(self):
+        """测试变更只追加日志，不重写快照"""
+        self.db.create_table("users", {'age': {'type': int}})
+        self.db.insert("users", {"name": "张三", "age": 25})
+        
+        self.assertFalse(os.path.exists(self.db_path))
+        self.assertTrue(os.path.exists(self.db_path + ".wal"))
+        with open(self.db_path + ".wal", encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 2)
+    
+    def test_replay_after_restart(self):
+        """测试重启后重放WAL恢复数据"""
+        self.db.create_table("users", {'age': {'type': int}})
+        self.db.insert("users", {"name": "张三", "age": 25})
+        self.db.insert("users", {"name": "李四", "age": 30})
+        self.db.insert("users", {"name": "王五", "age": 35})
+        self.db.update("users", {"name": "张三"}, {"age": 26})
+        self.db.delete("users", {"name": "李四"})
+        self.db.rename_table("users", "people")
+        
+        db2 = self.reopen()
+        self.assertEqual(db2.list_tables(), ["people"])
+        self.assertEqual(db2.get_schema("people"), {'age': {'type': int}})
+        records = db2.select("people")
+        self.assertEqual([r["name"] for r in records], ["张三", "王五"])
+        self.assertEqual(records[0]["age"], 26)
+        self.assertEqual(records[0]["_updated_at"], self.db.select("people")[0]["_updated_at"])
+        db2.close()
+    
+    def test_checkpoint(self):
+        """测试检查点写入快照并清空WAL"""
+        self.db.create_table("users")
+        self.db.insert("users", {"name": "张三"})
+        self.assertTrue(self.db.checkpoint())
+        self.assertTrue(os.path.exists(self.db_path))
+        self.assertFalse(os.path.exists(self.db_path + ".wal"))
+        
+        self.db.insert("users", {"name": "李四"})
+        db2 = self.reopen()
+        self.assertEqual([r["name"] for r in db2.select("users")], ["张三", "李四"])
+        db2.close()
+    
+    def test_torn_tail_is_ignored(self):
+        """测试WAL末尾残缺记录被忽略"""
+        self.db.create_table("users")
+        self.db.insert("users", {"name": "张三"})
+        self.db.close()
+        with open(self.db_path + ".wal", "ab") as f:
+            f.write(b'{"seq": 3, "op": "ins')
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.assertEqual(len(db2.select("users")), 1)
+        db2.insert("users", {"name": "李四"})
+        db2.close()
+        
+        db3 = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.assertEqual(len(db3.select("users")), 2)
+        db3.close()
+    
+    def test_rolled_back_transaction_not_logged(self):
+        """测试回滚的事务不写入WAL"""
+        self.db.create_table("users")
+        try:
+            with self.db.transaction():
+                self.db.insert("users", {"name": "张三"})
+                raise Exception("模拟错误")
+        except Exception:
+            pass
+        
+        with self.db.transaction():
+            self.db.insert("users", {"name": "李四"})
+        
+        db2 = self.reopen()
+        self.assertEqual([r["name"] for r in db2.select("users")], ["李四"])
+        db2.close()
+
+class TestDirectoryLayout(unittest.TestCase):
+    """目录存储布局测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "dir_db")
+        self.db = ADB(db_path=self.db_path, enable_logging=False, storage_layout='directory')
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def table_file(self, table_name):
+        """返回表当前的数据文件路径"""
+        with open(os.path.join(self.db_path, "manifest.json"), encoding='utf-8') as f:
+            manifest = json.load(f)
+        return os.path.join(self.db_path, manifest['tables'][table_name]['file'])
+    
+    def test_only_dirty_tables_rewritten(self):
+        """测试只重写有变更的表"""
+        self.db.create_table("config")
+        self.db.create_table("events")
+        self.db.insert("events", {"type": "click"})
+        self.assertTrue(self.db.checkpoint())
+        events_file = self.table_file("events")
+        config_file = self.table_file("config")
+        
+        self.db.insert("config", {"key": "theme"})
+        self.assertTrue(self.db.checkpoint())
+        self.assertEqual(self.table_file("events"), events_file)
+        self.assertNotEqual(self.table_file("config"), config_file)
+        self.assertFalse(os.path.exists(config_file))
+    
+    def test_open_keeps_unreferenced_files_until_vacuum(self):
+        """测试打开数据库不删除未引用的文件（可能属于其他进程），vacuum 时才清理"""
+        self.db.create_table("events")
+        self.db.insert("events", {"type": "click"})
+        self.db.close()
+        pending = os.path.join(self.db_path, "tables", "1-99.json")
+        with open(pending, "w", encoding="utf-8") as f:
+            f.write("{}")
+        
+        db = ADB(db_path=self.db_path, enable_logging=False, lazy_load=True)
+        self.assertTrue(os.path.exists(pending))
+        self.assertTrue(db.vacuum())
+        self.assertFalse(os.path.exists(pending))
+        self.assertEqual(db.count("events"), 1)
+        db.close()
+    
+    def test_rename_and_drop_edit_manifest(self):
+        """测试重命名和删除表只修改清单"""
+        self.db.create_table("events")
+        self.db.insert("events", {"type": "click"})
+        self.db.create_table("tmp")
+        self.assertTrue(self.db.checkpoint())
+        events_file = self.table_file("events")
+        tmp_file = self.table_file("tmp")
+        
+        self.db.rename_table("events", "clicks")
+        self.db.drop_table("tmp")
+        self.assertTrue(self.db.checkpoint())
+        self.assertEqual(self.table_file("clicks"), events_file)
+        self.assertFalse(os.path.exists(tmp_file))
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertEqual(db2.storage_layout, 'directory')
+        self.assertEqual(db2.list_tables(), ["clicks"])
+        self.assertEqual(db2.select("clicks")[0]["type"], "click")
+    
+    def test_migrate_from_single_file(self):
+        """测试从单文件数据库迁移"""
+        file_path = os.path.join(self.temp_dir, "legacy.json")
+        legacy = ADB(db_path=file_path, enable_logging=False)
+        legacy.create_table("users", {'age': {'type': int}})
+        legacy.insert("users", {"name": "张三", "age": 25})
+        
+        self.assertTrue(legacy.migrate_storage('directory'))
+        target = os.path.join(self.temp_dir, "legacy")
+        self.assertTrue(os.path.isdir(target))
+        
+        db2 = ADB(db_path=target, enable_logging=False)
+        self.assertEqual(db2.get_schema("users"), {'age': {'type': int}})
+        self.assertEqual(db2.select("users")[0]["name"], "张三")
+    
+    def test_lazy_load(self):
+        """测试延迟加载：元数据操作不读取表数据"""
+        self.db.create_table("events", {'type': {'type': str}})
+        self.db.insert("events", {"type": "click"})
+        self.db.insert("events", {"type": "view"})
+        self.db.create_index("events", "type")
+        self.db.create_table("config")
+        self.assertTrue(self.db.checkpoint())
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False, lazy_load=True)
+        self.assertEqual(sorted(db2.list_tables()), ["config", "events"])
+        info = db2.get_table_info("events")
+        self.assertFalse(info['loaded'])
+        self.assertEqual(info['record_count'], 2)
+        self.assertEqual(info['indexes'], ["type"])
+        self.assertEqual(db2.get_database_info()['total_records'], 2)
+        
+        self.assertEqual(db2.count("events"), 2)
+        self.assertTrue(db2.get_table_info("events")['loaded'])
+        self.assertFalse(db2.get_table_info("config")['loaded'])
+    
+    def test_lazy_rename_and_rollback(self):
+        """测试延迟加载模式下重命名和事务回滚"""
+        self.db.create_table("events")
+        self.db.insert("events", {"type": "click"})
+        self.db.create_table("logs")
+        self.db.insert("logs", {"msg": "start"})
+        self.assertTrue(self.db.checkpoint())
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False, lazy_load=True)
+        self.assertTrue(db2.rename_table("events", "clicks"))
+        self.assertFalse(db2.get_table_info("clicks")['loaded'])
+        try:
+            with db2.transaction():
+                db2.insert("logs", {"msg": "stop"})
+                raise Exception("模拟错误")
+        except Exception:
+            pass
+        self.assertEqual(db2.count("logs"), 1)
+        self.assertTrue(db2.checkpoint())
+        
+        db3 = ADB(db_path=self.db_path, enable_logging=False, lazy_load=True)
+        self.assertEqual(db3.select("clicks")[0]["type"], "click")
+        self.assertEqual(db3.count("logs"), 1)
+    
+    def test_wal_replay(self):
+        """测试目录布局下的WAL重放"""
+        db = ADB(db_path=os.path.join(self.temp_dir, "wal_dir"), enable_logging=False,
+                 journal_mode='wal', storage_layout='directory')
+        db.create_table("users")
+        self.assertTrue(db.checkpoint())
+        db.insert("users", {"name": "张三"})
+        db.close()
+        
+        db2 = ADB(db_path=os.path.join(self.temp_dir, "wal_dir"), enable_logging=False, journal_mode='wal')
+        self.assertEqual(len(db2.select("users")), 1)
+        db2.close()
+
+class TestDurability(unittest.TestCase):
+    """持久化级别与后台刷盘测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "durable_db.json")
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def open_db(self, **kwargs):
+        """打开数据库实例"""
+        return ADB(db_path=self.db_path, enable_logging=False, **kwargs)
+    
+    def test_sync_persists_every_write(self):
+        """测试sync模式下连续写入全部落盘"""
+        db = self.open_db(durability='sync')
+        db.create_table("users")
+        for i in range(5):
+            db.insert("users", {"n": i})
+        self.assertEqual(self.open_db().count("users"), 5)
+        db.close()
+    
+    def test_async_flush_and_close(self):
+        """测试async模式下flush和close写入剩余变更"""
+        db = self.open_db(durability='async', journal_mode='wal')
+        db.flush_interval = 60
+        db.create_table("users")
+        db.insert("users", {"n": 1})
+        self.assertFalse(os.path.exists(self.db_path + ".wal"))
+        
+        self.assertTrue(db.flush())
+        self.assertEqual(self.open_db(journal_mode='wal').count("users"), 1)
+        
+        db.insert("users", {"n": 2})
+        db.close()
+        self.assertEqual(self.open_db(journal_mode='wal').count("users"), 2)
+    
+    def test_async_dirty_bytes_threshold(self):
+        """测试脏数据超过阈值时提前刷盘"""
+        db = self.open_db(durability='async')
+        db.flush_interval = 60
+        db.flush_bytes = 100
+        db.create_table("docs")
+        db.insert("docs", {"body": "x" * 200})
+        
+        deadline = time.time() + 5
+        while db.get_database_info()['pending_bytes'] and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.open_db().count("docs"), 1)
+        db.close()
+    
+    def test_default_sync_and_async_coalesces_writes(self):
+        """测试默认sync模式；显式开启async后连续写入合并为少量快照写入"""
+        self.assertEqual(self.open_db().durability, 'sync')
+        db = self.open_db(durability='async')
+        db.flush_interval = 60
+        db.create_table("users")
+        with mock.patch.object(db, '_write_snapshot', wraps=db._write_snapshot) as write_snapshot:
+            for i in range(200):
+                db.insert("users", {"n": i})
+            self.assertEqual(write_snapshot.call_count, 0)
+            db.close()
+            self.assertEqual(write_snapshot.call_count, 1)
+        self.assertEqual(self.open_db().count("users"), 200)
+    
+    def test_deferred_flush_does_not_recreate_directory(self):
+        """测试数据库目录被删除后，后台刷盘和退出时的写入不重新创建目录"""
+        db_dir = os.path.join(self.temp_dir, "sub")
+        os.mkdir(db_dir)
+        db = ADB(db_path=os.path.join(db_dir, "db.json"), enable_logging=False, durability='async')
+        db.flush_interval = 0.01
+        db.create_table("users")
+        shutil.rmtree(db_dir)
+        db.insert("users", {"n": 1})
+        thread = db._flush_thread
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(db_dir))
+        
+        with mock.patch('adb._open_databases', weakref.WeakSet([db])):
+            _close_open_databases()
+        self.assertFalse(os.path.exists(db_dir))
+    
+    def test_flush_thread_exits_with_instance(self):
+        """测试实例不再被引用后后台刷盘线程退出"""
+        db = self.open_db(durability='async')
+        db.flush_interval = 0.01
+        db.create_table("users")
+        thread = db._flush_thread
+        del db
+        gc.collect()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+    
+    def test_restore_and_migrate_with_flush_thread(self):
+        """测试后台刷盘线程运行时恢复备份和迁移不会死锁，之后仍按async模式写入"""
+        db = self.open_db(durability='async')
+        db.create_table("users")
+        db.insert("users", {"n": 1})
+        backup_path = os.path.join(self.temp_dir, "backup.json")
+        self.assertTrue(db.backup(backup_path))
+        db.insert("users", {"n": 2})
+        
+        self.assertTrue(db.restore(backup_path))
+        self.assertEqual(db.count("users"), 1)
+        self.assertTrue(db.migrate_storage('directory', os.path.join(self.temp_dir, "migrated")))
+        db.insert("users", {"n": 3})
+        self.assertTrue(db.get_database_info()['pending_bytes'] > 0)
+        db.close()
+        migrated = ADB(db_path=os.path.join(self.temp_dir, "migrated"), enable_logging=False)
+        self.assertEqual(migrated.count("users"), 2)
+        migrated.close()
+    
+    def test_group_commit_concurrent_writers(self):
+        """测试group模式下并发写入返回前均已落盘"""
+        db = self.open_db(durability='group', journal_mode='wal')
+        db.create_table("events")
+        
+        def writer(worker):
+            for i in range(20):
+                db.insert("events", {"worker": worker, "n": i})
+        
+        threads = [threading.Thread(target=writer, args=(w,)) for w in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(self.open_db(journal_mode='wal').count("events"), 80)
+        db.close()
+
+class TestSnapshotCache(unittest.TestCase):
+    """二进制快照缓存测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "cached_db.json")
+        self.cache_path = self.db_path + ".cache"
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_cache=True)
+        db.create_table("users", {'age': {'type': int}})
+        db.insert("users", {"name": "张三", "age": 25})
+        db.close()
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def scramble_json(self):
+        """破坏JSON内容但保持大小和修改时间不变"""
+        stat = os.stat(self.db_path)
+        with open(self.db_path, "r+b") as f:
+            f.write(b"#")
+        os.utime(self.db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    
+    def test_fresh_cache_is_preferred(self):
+        """测试缓存有效时不读取JSON"""
+        self.assertTrue(os.path.exists(self.cache_path))
+        self.scramble_json()
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_cache=True)
+        self.assertEqual(db.select("users")[0]["name"], "张三")
+        self.assertEqual(db.get_schema("users"), {'age': {'type': int}})
+    
+    def test_stale_cache_falls_back_to_json(self):
+        """测试数据文件变化后回退到JSON"""
+        db = ADB(db_path=self.db_path, enable_logging=False)
+        db.insert("users", {"name": "李四", "age": 30})
+        db.close()
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False, snapshot_cache=True)
+        self.assertEqual(db2.count("users"), 2)
+    
+    def test_corrupt_cache_falls_back_to_json(self):
+        """测试缓存校验失败时回退到JSON"""
+        with open(self.cache_path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_cache=True)
+        self.assertEqual(db.count("users"), 1)
+    
+    def test_directory_layout(self):
+        """测试目录布局下每个表文件的缓存"""
+        dir_path = os.path.join(self.temp_dir, "dir_db")
+        db = ADB(db_path=dir_path, enable_logging=False, storage_layout='directory', snapshot_cache=True)
+        db.create_table("events")
+        db.insert("events", {"type": "click"})
+        db.close()
+        
+        caches = [name for name in os.listdir(os.path.join(dir_path, "tables")) if name.endswith(".cache")]
+        self.assertEqual(len(caches), 1)
+        db2 = ADB(db_path=dir_path, enable_logging=False, snapshot_cache=True)
+        self.assertEqual(db2.select("events")[0]["type"], "click")
+
+class TestCompressedSnapshot(unittest.TestCase):
+    """压缩快照格式测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "compressed_db.json")
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def populate(self, db):
+        """写入测试数据"""
+        db.create_table("users", {'age': {'type': int}})
+        db.create_table("orders")
+        for i in range(50):
+            db.insert("users", {"name": f"用户{i}", "age": 20 + i % 10})
+        db.insert("orders", {"user": "用户1", "amount": 99})
+        db.create_index("users", "age")
+    
+    def test_round_trip_all_codecs(self):
+        """测试各压缩算法的保存和加载"""
+        for codec in ('zlib', 'lzma', 'bz2'):
+            path = os.path.join(self.temp_dir, f"{codec}.db")
+            db = ADB(db_path=path, enable_logging=False, snapshot_format='compressed')
+            db.compression = codec
+            self.populate(db)
+            db.close()
+            
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(4), b"ADBZ")
+            db2 = ADB(db_path=path, enable_logging=False)
+            self.assertEqual(db2.count("users"), 50)
+            self.assertEqual(db2.count("users", {"age": 25}), 5)
+            self.assertEqual(db2.get_schema("users"), {'age': {'type': int}})
+            self.assertEqual(db2.list_indexes("users"), ["age"])
+    
+    def test_format_switch_and_size(self):
+        """测试JSON与压缩格式互相转换，压缩后文件更小"""
+        db = ADB(db_path=self.db_path, enable_logging=False)
+        self.populate(db)
+        db.close()
+        json_size = os.path.getsize(self.db_path)
+        
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_format='compressed')
+        self.assertEqual(db.count("users"), 50)
+        db.save_database()
+        db.close()
+        self.assertLess(os.path.getsize(self.db_path), json_size)
+        
+        db = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertEqual(db.count("orders"), 1)
+        db.save_database()
+        with open(self.db_path, "r", encoding="utf-8") as f:
+            self.assertIn("tables", json.load(f))
+    
+    def test_corrupted_block_detected(self):
+        """测试数据块损坏时校验失败"""
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_format='compressed')
+        self.populate(db)
+        db.close()
+        
+        with open(self.db_path, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+        
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_format='compressed',
+                 lazy_load=True)
+        self.assertEqual(db.count("users"), 50)
+        with self.assertRaises(ADBError):
+            db.select("orders")
+    
+    def test_lazy_load_single_file(self):
+        """测试单文件压缩快照的延迟加载，未访问的表原样写回"""
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_format='compressed')
+        self.populate(db)
+        db.close()
+        
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_format='compressed',
+                 lazy_load=True)
+        self.assertFalse(db.get_table_info("users")["loaded"])
+        self.assertEqual(db.get_table_info("users")["record_count"], 50)
+        db.insert("orders", {"user": "用户2", "amount": 10})
+        db.close()
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertEqual(db2.count("users"), 50)
+        self.assertEqual(db2.count("orders"), 2)
+    
+    def test_lazy_load_single_file_json_warns(self):
+        """测试单文件JSON格式开启延迟加载时记录警告并读取全部数据"""
+        db = ADB(db_path=self.db_path, enable_logging=False)
+        self.populate(db)
+        db.close()
+        
+        with self.assertLogs('adb', level='WARNING') as logs:
+            db = ADB(db_path=self.db_path, enable_logging=False, lazy_load=True)
+        self.assertIn("延迟加载", logs.output[0])
+        self.assertTrue(db.get_table_info("users")["loaded"])
+        db.close()
+    
+    def test_supports_lazy_load(self):
+        """测试按实际布局和格式判断是否支持延迟加载"""
+        db = ADB(db_path=self.db_path, enable_logging=False)
+        self.populate(db)
+        db.close()
+        self.assertFalse(supports_lazy_load(self.db_path))
+        
+        db = ADB(db_path=self.db_path, enable_logging=False, snapshot_format='compressed')
+        db.insert("users", {"name": "新用户", "age": 1})
+        db.close()
+        self.assertTrue(supports_lazy_load(self.db_path))
+        self.assertTrue(supports_lazy_load(self.temp_dir))
+    
+    def test_directory_layout(self):
+        """测试目录布局的压缩表文件"""
+        dir_path = os.path.join(self.temp_dir, "dir_db")
+        db = ADB(db_path=dir_path, enable_logging=False, storage_layout='directory',
+                 snapshot_format='compressed')
+        self.populate(db)
+        db.close()
+        
+        files = os.listdir(os.path.join(dir_path, "tables"))
+        self.assertTrue(all(name.endswith(".adbz") for name in files))
+        db2 = ADB(db_path=dir_path, enable_logging=False, storage_layout='directory')
+        self.assertEqual(db2.count("users", {"age": 21}), 5)
+
+class TestSortedIndex(unittest.TestCase):
+    """有序索引测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "sorted_db.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.db.create_table("users")
+        for i in range(100):
+            self.db.insert("users", {"name": f"用户{i}", "age": i % 50, "score": i / 2})
+        self.db.insert("users", {"name": "无年龄"})
+        self.db.create_index("users", "age", kind='sorted')
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def full_scan(self, condition):
+        """不使用索引的查询结果"""
+        return [r for r in self.db.data["users"]
+                if r is not None and self.db._match_condition(r, condition)]
+    
+    def test_range_queries_match_full_scan(self):
+        """测试范围查询与全表扫描结果一致"""
+        conditions = [
+            {"age": {"$gt": 10, "$lte": 20}},
+            {"age": {"$gte": 45}},
+            {"age": {"$lt": 3}},
+            {"age": 7},
+            {"age": {"$gt": 10, "$lt": 30}, "score": {"$lt": 20}},
+        ]
+        for condition in conditions:
+            self.assertEqual(self.db.select("users", condition), self.full_scan(condition))
+            self.assertEqual(self.db.count("users", condition), len(self.full_scan(condition)))
+    
+    def test_explain_reports_range(self):
+        """测试执行计划报告范围边界"""
+        plan = self.db.explain_query("users", {"age": {"$gte": 10, "$lt": 20}})
+        self.assertEqual(plan['scan_type'], 'index_range_scan')
+        self.assertEqual(plan['indexes_used'], ['age'])
+        self.assertEqual(plan['range'], {'column': 'age', 'low': 10, 'low_inclusive': True,
+                                         'high': 20, 'high_inclusive': False})
+        # 缺少该列的记录也满足范围条件
+        self.assertEqual(plan['estimated_rows'], 21)
+        
+        self.db.create_index("users", "name")
+        plan = self.db.explain_query("users", {"name": {"$gt": "a"}})
+        self.assertEqual(plan['scan_type'], 'full_scan')
+    
+    def test_update_and_delete_use_index(self):
+        """测试更新和删除后索引保持正确"""
+        # 缺少age的记录同样满足范围条件
+        self.assertEqual(self.db.update("users", {"age": {"$lt": 5}}, {"age": 100}), 11)
+        self.assertEqual(self.db.delete("users", {"age": {"$gte": 40, "$lt": 50}}), 20)
+        self.assertEqual(self.db.count("users", {"age": {"$gt": 99}}), 11)
+        self.assertEqual(self.db.select("users", {"age": {"$gte": 40}}),
+                         self.full_scan({"age": {"$gte": 40}}))
+    
+    def test_persisted_across_reload(self):
+        """测试有序索引保存后重新加载"""
+        self.db.close()
+        db2 = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertEqual(db2.count("users", {"age": {"$gte": 48}}), 5)
+        self.assertEqual(db2.explain_query("users", {"age": {"$gt": 45}})['scan_type'],
+                         'index_range_scan')
+
+class TestIndexMaintenance(unittest.TestCase):
+    """索引增量维护测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "maint_db.json"), enable_logging=False)
+        self.db.create_table("items")
+        for i in range(60):
+            record = {"group": f"g{i % 6}", "value": i % 13}
+            if i % 10 == 0:
+                del record["value"]
+            self.db.insert("items", record)
+        self.db.create_index("items", "group")
+        self.db.create_index("items", "value", kind='sorted')
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def test_update_and_delete_keep_indexes_consistent(self):
+        """测试更新和删除后索引与全表扫描一致"""
+        self.db.update("items", {"group": "g1"}, {"group": "g2", "value": 99})
+        self.assertEqual(self.db.check_indexes("items"), {"group": True, "value": True})
+        self.db.update("items", {"value": {"$gt": 10}}, {"extra": True})
+        self.db.delete("items", {"value": {"$lt": 4}})
+        self.assertEqual(self.db.check_indexes("items"), {"group": True, "value": True})
+        self.db.delete("items", {"group": "g0"})
+        self.db.insert("items", {"group": "g0", "value": 5})
+        self.assertEqual(self.db.check_indexes("items"), {"group": True, "value": True})
+        self.assertEqual(self.db.select("items", {"group": "g2"}),
+                         [r for r in self.db.data["items"] if r and r["group"] == "g2"])
+    
+    def test_checker_detects_stale_index(self):
+        """测试校验能发现过期的索引"""
+        self.db.data["items"][0]["group"] = "changed"
+        self.assertEqual(self.db.check_indexes("items"), {"group": False, "value": True})
+        self.db.optimize_table("items")
+        self.assertEqual(self.db.check_indexes("items"), {"group": True, "value": True})
+    
+    def test_transaction_rollback_restores_indexes(self):
+        """测试事务回滚后索引与数据一致"""
+        with self.assertRaises(ValidationError):
+            with self.db.transaction():
+                self.db.delete("items", {"group": "g3"})
+                raise ValidationError("回滚")
+        self.assertEqual(self.db.count("items", {"group": "g3"}), 10)
+        self.assertEqual(self.db.check_indexes("items"), {"group": True, "value": True})
+
+class TestRowIds(unittest.TestCase):
+    """稳定记录ID和删除空位测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "rows_db.json")
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def open_db(self, **kwargs):
+        """打开测试数据库并写入10条记录"""
+        db = ADB(db_path=self.db_path, enable_logging=False, **kwargs)
+        db.create_table("users")
+        db.create_index("users", "age", kind='sorted')
+        for i in range(10):
+            db.insert("users", {"name": f"用户{i}", "age": i})
+        return db
+    
+    def test_ids_not_reused_after_delete(self):
+        """测试删除后新记录的ID不重复"""
+        db = self.open_db()
+        db.delete("users", {"age": 9})
+        db.insert("users", {"name": "新用户", "age": 20})
+        ids = [r["_id"] for r in db.select("users")]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(db.select("users", {"age": 20})[0]["_id"], 11)
+        
+        # 序列随快照保存，重新加载后仍不复用
+        db.delete("users", {"age": 20})
+        db.close()
+        db2 = ADB(db_path=self.db_path, enable_logging=False)
+        db2.insert("users", {"name": "再来", "age": 30})
+        self.assertEqual(db2.select("users", {"age": 30})[0]["_id"], 12)
+    
+    def test_delete_leaves_tombstone_and_keeps_positions(self):
+        """测试删除留下空位，其余记录位置和索引不变"""
+        db = self.open_db()
+        db.delete("users", {"age": 3})
+        self.assertEqual(len(db.data["users"]), 10)
+        self.assertIsNone(db.data["users"][3])
+        self.assertEqual(db.data["users"][4]["age"], 4)
+        self.assertEqual(db.count("users"), 9)
+        self.assertEqual(len(db.select("users", limit=5, offset=2)), 5)
+        self.assertEqual(db.check_indexes("users"), {"age": True})
+        self.assertEqual(db._id_map["users"][5], 4)
+    
+    def test_compaction_when_majority_deleted(self):
+        """测试空位超过一半时整理表"""
+        db = self.open_db()
+        db.delete("users", {"age": {"$lt": 6}})
+        self.assertEqual(len(db.data["users"]), 4)
+        self.assertEqual([r["_id"] for r in db.data["users"]], [7, 8, 9, 10])
+        self.assertEqual(db._id_map["users"], {7: 0, 8: 1, 9: 2, 10: 3})
+        self.assertEqual(db.check_indexes("users"), {"age": True})
+    
+    def test_optimize_keeps_ids(self):
+        """测试优化表只整理空位，不重新分配 _id"""
+        db = self.open_db(journal_mode='wal')
+        db.delete("users", {"age": {"$lt": 3}})
+        db.optimize_table("users")
+        self.assertEqual(len(db.data["users"]), 7)
+        self.assertEqual([r["_id"] for r in db.data["users"]], list(range(4, 11)))
+        self.assertEqual([r["age"] for r in db.get_many("users", [4, 10])], [3, 9])
+        self.assertEqual(db.check_indexes("users"), {"age": True})
+        db.insert("users", {"name": "新用户", "age": 20})
+        self.assertEqual(db.select("users", {"age": 20})[0]["_id"], 11)
+        expected = db.select("users")
+        db.close()
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.assertEqual(db2.select("users"), expected)
+    
+    def test_wal_replay_with_tombstones(self):
+        """测试WAL重放删除和整理后数据一致"""
+        db = self.open_db(journal_mode='wal')
+        db.delete("users", {"age": 2})
+        db.update("users", {"age": 5}, {"name": "改名"})
+        db.delete("users", {"age": {"$lt": 7}})
+        db.insert("users", {"name": "新用户", "age": 42})
+        expected = db.select("users")
+        db.close()
+        
+        db2 = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.assertEqual(db2.select("users"), expected)
+        self.assertEqual(db2.check_indexes("users"), {"age": True})
+
+class TestPrimaryKey(unittest.TestCase):
+    """主键查找测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "pk_db.json"), enable_logging=False)
+        self.db.create_table("users")
+        for i in range(20):
+            self.db.insert("users", {"name": f"用户{i}", "age": i})
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def test_id_conditions_use_primary_key(self):
+        """测试 _id 等值和 $in 条件"""
+        self.assertEqual(self.db.select("users", {"_id": 5})[0]["name"], "用户4")
+        self.assertEqual([r["_id"] for r in self.db.select("users", {"_id": {"$in": [7, 3, 99]}})], [3, 7])
+        self.assertEqual(self.db.count("users", {"_id": {"$in": [1, 2]}, "age": 1}), 1)
+        plan = self.db.explain_query("users", {"_id": {"$in": [1, 2]}})
+        self.assertEqual(plan['scan_type'], 'primary_key_lookup')
+        self.assertEqual(plan['estimated_rows'], 2)
+        
+        self.assertEqual(self.db.update("users", {"_id": 2}, {"age": 100}), 1)
+        self.assertEqual(self.db.delete("users", {"_id": {"$in": [2, 3]}}), 2)
+        self.assertEqual(self.db.select("users", {"_id": 2}), [])
+    
+    def test_legacy_duplicate_ids_fall_back_to_scan(self):
+        """测试旧版本写入的重复 _id 在加载时被发现，按 _id 更新、删除仍作用于所有同 _id 的记录"""
+        legacy_path = os.path.join(self.temp_dir, "legacy_db.json")
+        records = [{"_id": 1, "name": "甲"}, {"_id": 2, "name": "乙"},
+                   {"_id": 2, "name": "丙"}, {"_id": 3, "name": "丁"}]
+        with open(legacy_path, "w", encoding="utf-8") as f:
+            json.dump({"tables": {"users": records}, "schemas": {}, "indexes": {}}, f, ensure_ascii=False)
+        
+        db = ADB(db_path=legacy_path, enable_logging=False)
+        self.assertNotEqual(db.explain_query("users", {"_id": 2})['scan_type'], 'primary_key_lookup')
+        self.assertEqual(len(db.select("users", {"_id": 2})), 2)
+        self.assertEqual(db.update("users", {"_id": 2}, {"age": 30}), 2)
+        self.assertEqual(db.delete("users", {"_id": {"$in": [2]}}), 2)
+        self.assertEqual([r["name"] for r in db.select("users")], ["甲", "丁"])
+        self.assertEqual(db.insert("users", {"name": "戊"}), True)
+        self.assertEqual(db.select("users", {"name": "戊"})[0]["_id"], 4)
+        db.close()
+    
+    def test_in_operator_with_index(self):
+        """测试 $in 条件使用普通索引"""
+        self.db.create_index("users", "age")
+        condition = {"age": {"$in": [1, 5, 50]}}
+        self.assertEqual([r["age"] for r in self.db.select("users", condition)], [1, 5])
+        self.assertEqual(self.db.explain_query("users", condition)['scan_type'], 'index_scan')
+    
+    def test_get_many_and_import_update(self):
+        """测试批量获取和按ID导入更新"""
+        self.assertEqual([r["_id"] for r in self.db.get_many("users", [10, 1, 42])], [10, 1])
+        self.db.delete("users", {"_id": 10})
+        self.assertEqual(self.db.get_many("users", [10]), [])
+        
+        result = self.db.import_data("users", [{"_id": 1, "age": 99}, {"_id": 2, "age": 98}],
+                                     mode='update')
+        self.assertEqual(result['imported'], 2)
+        self.assertEqual([r["age"] for r in self.db.get_many("users", [1, 2])], [99, 98])
+
+class TestCompositeIndex(unittest.TestCase):
+    """复合索引和索引求交测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "composite_db.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.db.create_table("tickets")
+        for i in range(120):
+            self.db.insert("tickets", {"tenant": f"t{i % 4}", "status": ("open", "closed", "hold")[i % 3],
+                                       "priority": i % 5})
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def expected(self, condition):
+        """全表扫描的结果"""
+        return [r for r in self.db.data["tickets"]
+                if r is not None and self.db._match_condition(r, condition)]
+    
+    def test_composite_index(self):
+        """测试复合索引查询和维护"""
+        self.assertTrue(self.db.create_index("tickets", ["tenant", "status"]))
+        self.assertIn("tenant,status", self.db.list_indexes("tickets"))
+        condition = {"tenant": "t1", "status": "open", "priority": {"$gt": 1}}
+        self.assertEqual(self.db.select("tickets", condition), self.expected(condition))
+        plan = self.db.explain_query("tickets", condition)
+        self.assertEqual(plan['strategy'], 'composite')
+        self.assertEqual(plan['indexes_used'], ["tenant,status"])
+        self.assertEqual(plan['estimated_rows'], 10)
+        
+        self.db.update("tickets", {"tenant": "t1", "status": "open"}, {"status": "closed"})
+        self.db.delete("tickets", {"tenant": "t2", "status": "hold"})
+        self.assertEqual(self.db.check_indexes("tickets"), {"tenant,status": True})
+        self.assertEqual(self.db.count("tickets", {"tenant": "t1", "status": "open"}), 0)
+        
+        with self.assertRaises(ADBError):
+            self.db.create_index("tickets", ["tenant", "priority"], kind='sorted')
+        self.assertTrue(self.db.drop_index("tickets", ["tenant", "status"]))
+    
+    def test_intersection_of_single_indexes(self):
+        """测试多个单列索引求交集"""
+        self.db.create_index("tickets", "tenant")
+        self.db.create_index("tickets", "status")
+        condition = {"tenant": "t3", "status": "hold"}
+        self.assertEqual(self.db.select("tickets", condition), self.expected(condition))
+        plan = self.db.explain_query("tickets", condition)
+        self.assertEqual(plan['strategy'], 'intersection')
+        self.assertEqual(plan['scan_type'], 'index_intersection')
+        self.assertEqual(sorted(plan['indexes_used']), ["status", "tenant"])
+        self.assertEqual(plan['estimated_rows'], 10)
+    
+    def test_composite_survives_reload(self):
+        """测试复合索引保存后重新加载"""
+        self.db.create_index("tickets", ["tenant", "priority"])
+        self.db.close()
+        db2 = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertEqual(db2.count("tickets", {"tenant": "t0", "priority": 0}), 6)
+        self.assertEqual(db2.check_indexes("tickets"), {"tenant,priority": True})
+
+class TestTypedIndexPersistence(unittest.TestCase):
+    """索引持久化类型保持测试"""
+    
+    VALUES = [25, 25.5, True, None, "25", 0, False, "", 7]
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """测试后清理"""
+        shutil.rmtree(self.temp_dir)
+    
+    def build(self, path, **kwargs):
+        """创建带各类型取值的表和索引"""
+        db = ADB(db_path=path, enable_logging=False, **kwargs)
+        db.create_table("items")
+        for value in self.VALUES:
+            db.insert("items", {"value": value, "tag": str(value)})
+        db.create_index("items", "value")
+        db.create_index("items", ["value", "tag"])
+        db.create_index("items", "tag", kind='sorted')
+        db.close()
+        return db
+    
+    def assert_round_trip(self, path, **kwargs):
+        """重新加载后索引内容与保存前完全一致"""
+        before = self.build(path, **kwargs).indexes["items"]
+        db = ADB(db_path=path, enable_logging=False, **kwargs)
+        after = db.indexes["items"]
+        self.assertEqual(set(after), set(before))
+        for name in before:
+            self.assertEqual(after[name], before[name])
+            self.assertEqual(repr(after[name].to_json()), repr(before[name].to_json()))
+        
+        self.assertEqual(db.count("items", {"value": 25}), 1)
+        self.assertEqual(db.count("items", {"value": None}), 1)
+        self.assertEqual(db.explain_query("items", {"value": "25"})['estimated_rows'], 1)
+        self.assertEqual(db.count("items", {"value": 25.5, "tag": "25.5"}), 1)
+    
+    def test_round_trip_json(self):
+        """测试JSON快照"""
+        self.assert_round_trip(os.path.join(self.temp_dir, "typed.json"))
+    
+    def test_round_trip_directory_and_compressed(self):
+        """测试目录布局和压缩快照"""
+        self.assert_round_trip(os.path.join(self.temp_dir, "typed_dir"), storage_layout='directory')
+        self.assert_round_trip(os.path.join(self.temp_dir, "typed.adb"), snapshot_format='compressed')
+    
+    def test_legacy_index_format_rebuilt(self):
+        """测试旧版 {值: 位置列表} 格式的索引加载时按记录重建"""
+        path = os.path.join(self.temp_dir, "legacy.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": "1.0",
+                "tables": {"users": [{"_id": 1, "age": 25}, {"_id": 2, "age": 30}]},
+                "schemas": {},
+                "indexes": {"users": {"age": {"25": [0], "30": [1]}}}
+            }, f)
+        db = ADB(db_path=path, enable_logging=False)
+        self.assertEqual(db.select("users", {"age": 25})[0]["_id"], 1)
+        self.assertEqual(db.check_indexes("users"), {"age": True})
+
+class TestBitmapIndex(unittest.TestCase):
+    """位图索引测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "bitmap.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.db.create_table("orders")
+        for i in range(200):
+            self.db.insert("orders", {
+                "status": ("new", "paid", "shipped", "done")[i % 4],
+                "region": ("north", "south")[i % 2],
+                "amount": i
+            })
+        self.db.create_index("orders", "status", kind='bitmap')
+        self.db.create_index("orders", "region", kind='bitmap')
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def scan(self, condition):
+        """全表扫描得到的期望结果"""
+        return [record for record in self.db.data["orders"]
+                if record is not None and self.db._match_condition(record, condition)]
+    
+    def test_and_or_conditions(self):
+        """测试等值条件按位与、$in 条件按位或"""
+        conditions = [
+            {"status": "paid"},
+            {"status": "paid", "region": "south"},
+            {"status": {"$in": ["new", "done"]}, "region": "north"},
+            {"status": "paid", "region": "north"},
+            {"status": "paid", "amount": {"$lt": 50}},
+            {"status": "missing"}
+        ]
+        for condition in conditions:
+            self.assertEqual(self.db.select("orders", condition), self.scan(condition))
+            self.assertEqual(self.db.count("orders", condition), len(self.scan(condition)))
+    
+    def test_explain_and_count_without_records(self):
+        """测试执行计划和只依赖位图的计数"""
+        plan = self.db.explain_query("orders", {"status": "paid", "region": "south"})
+        self.assertEqual(plan['scan_type'], 'bitmap_scan')
+        self.assertEqual(set(plan['indexes_used']), {"status", "region"})
+        self.assertEqual(plan['estimated_rows'], 50)
+        
+        index_plan = self.db._plan_index_scan("orders", {"status": {"$in": ["new", "paid"]}})
+        self.assertTrue(index_plan['exact'])
+        self.assertNotIn('positions', index_plan)
+        self.assertEqual(self.db.count("orders", {"status": {"$in": ["new", "paid"]}}), 100)
+    
+    def test_maintenance(self):
+        """测试更新、删除、压缩后位图与记录一致"""
+        self.db.update("orders", {"status": "new"}, {"status": "done"})
+        self.db.delete("orders", {"region": "north", "status": "done"})
+        self.assertTrue(all(self.db.check_indexes("orders").values()))
+        self.assertEqual(self.db.count("orders", {"status": "new"}), 0)
+        self.assertEqual(self.db.count("orders", {"status": "done"}),
+                         len(self.scan({"status": "done"})))
+        self.db.optimize_table("orders")
+        self.assertTrue(all(self.db.check_indexes("orders").values()))
+        self.assertEqual(self.db.select("orders", {"status": "paid", "region": "south"}),
+                         self.scan({"status": "paid", "region": "south"}))
+    
+    def test_sparse_values_stored_as_positions(self):
+        """测试取值种类多的列上稀疏取值存为位置列表，取值变多后转为位集合"""
+        self.db.create_index("orders", "amount", kind='bitmap')
+        index = self.db.indexes["orders"]["amount"]
+        self.assertIsInstance(index.entries[150], bytearray)
+        with self.db.transaction():
+            for i in range(400):
+                self.db.insert("orders", {"status": "new", "region": "north", "amount": 1000 + i})
+        self.assertIsInstance(index.entries[1399], list)
+        self.assertEqual(self.db.select("orders", {"amount": {"$in": [5, 1399]}}),
+                         self.scan({"amount": {"$in": [5, 1399]}}))
+        
+        with self.db.transaction():
+            for i in range(20):
+                self.db.insert("orders", {"status": "new", "region": "south", "amount": 1399})
+        self.assertIsInstance(index.entries[1399], bytearray)
+        self.assertEqual(self.db.count("orders", {"amount": 1399}), 21)
+        self.db.delete("orders", {"amount": 1399})
+        self.assertNotIn(1399, index.entries)
+        self.assertTrue(all(self.db.check_indexes("orders").values()))
+    
+    def test_aggregate_match_and_persistence(self):
+        """测试聚合 $match 使用位图索引，以及保存后重新加载"""
+        pipeline = [{"$match": {"region": "south"}}, {"$group": {"_id": "status"}}]
+        self.assertEqual(self.db.aggregate("orders", pipeline),
+                         [{"_id": "paid", "count": 50}, {"_id": "done", "count": 50}])
+        self.assertEqual(self.db.aggregate("orders", [{"$group": {"_id": "region"}}]),
+                         [{"_id": "north", "count": 100}, {"_id": "south", "count": 100}])
+        self.db.insert("orders", {"region": "north"})
+        result = self.db.aggregate("orders", [{"$match": {"region": "north"}}, {"$group": {"_id": "status"}}])
+        self.assertEqual(result[-1], {"_id": "null", "count": 1})
+        self.assertEqual(self.db.aggregate("orders", [{"$match": {"status": "paid", "region": "south"}}]),
+                         self.scan({"status": "paid", "region": "south"}))
+        
+        self.db.close()
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        index = self.db.indexes["orders"]["status"]
+        self.assertEqual(index.kind, 'bitmap')
+        self.assertTrue(all(self.db.check_indexes("orders").values()))
+        self.assertEqual(self.db.count("orders", {"status": "shipped"}), 50)
+        self.assertEqual(self.db.count("orders", {"region": "north"}), 101)
+
+class TestNgramIndex(unittest.TestCase):
+    """N 元组索引（$like 预筛选）测试"""
+    
+    NAMES = ["苹果手机壳", "华为手机", "小米充电器", "iPhone Case", "USB-C Cable",
+             "苹果数据线", "Phone Stand", "无线耳机"]
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "ngram.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.db.create_table("products")
+        for i in range(40):
+            self.db.insert("products", {"name": self.NAMES[i % len(self.NAMES)], "sku": i})
+        self.db.insert("products", {"sku": 99})
+        self.db.create_index("products", "name", kind='ngram')
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def scan(self, condition):
+        """全表扫描得到的期望结果"""
+        return [record for record in self.db.data["products"]
+                if record is not None and self.db._match_condition(record, condition)]
+    
+    def assert_like(self, pattern):
+        condition = {"name": {"$like": pattern}}
+        self.assertEqual(self.db.select("products", condition), self.scan(condition))
+    
+    def test_like_matches_full_scan(self):
+        """测试各类查询串的结果与全表扫描一致"""
+        for pattern in ["手机", "苹果", "PHONE", "phone c", "usb-c", "线", "ca", "不存在的商品", "b-c ca"]:
+            self.assert_like(pattern)
+    
+    def test_candidates_pruned(self):
+        """测试执行计划报告候选记录数"""
+        plan = self.db.explain_query("products", {"name": {"$like": "手机"}})
+        self.assertEqual(plan['indexes_used'], ["name"])
+        self.assertEqual(plan['index_kind'], 'ngram')
+        # 10 条含“手机”的记录 + 1 条不含 name 列的记录
+        self.assertEqual(plan['candidates'], 11)
+        self.assertEqual(self.db.explain_query("products", {"name": {"$like": "线"}})['scan_type'], 'full_scan')
+    
+    def test_maintenance_and_reload(self):
+        """测试插入、更新、删除后索引与记录一致，重新加载后按记录重建"""
+        self.db.insert("products", {"name": "蓝牙手机支架"})
+        self.db.update("products", {"name": "华为手机"}, {"name": "华为平板"})
+        self.db.delete("products", {"name": "小米充电器"})
+        self.assertTrue(all(self.db.check_indexes("products").values()))
+        for pattern in ["手机", "平板", "充电", "支架"]:
+            self.assert_like(pattern)
+        
+        self.db.close()
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertEqual(self.db.indexes["products"]["name"].kind, 'ngram')
+        self.assertTrue(all(self.db.check_indexes("products").values()))
+        self.assert_like("平板")
+
+class TestFulltextIndex(unittest.TestCase):
+    """全文索引与 $text 检索测试"""
+    
+    DOCS = [
+        "无线蓝牙耳机，主动降噪，续航持久",
+        "有线耳机 入门款",
+        "无线鼠标 静音",
+        "Wireless earbuds with noise cancelling",
+        "Mechanical keyboard",
+        "降噪耳机 无线 蓝牙 耳机 头戴式",
+    ]
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "fulltext.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.db.create_table("items")
+        for i, text in enumerate(self.DOCS):
+            self.db.insert("items", {"description": text, "price": i * 100})
+        self.db.create_index("items", "description", kind='fulltext')
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def descriptions(self, records):
+        return [record["description"] for record in records]
+    
+    def test_ranked_search(self):
+        """测试结果按 BM25 相关度排序，limit 只保留前几条"""
+        results = self.db.select("items", {"description": {"$text": "降噪耳机"}})
+        self.assertEqual(self.descriptions(results)[0], self.DOCS[5])
+        self.assertEqual(set(self.descriptions(results)), {self.DOCS[0], self.DOCS[1], self.DOCS[5]})
+        self.assertEqual(self.db.select("items", {"description": {"$text": "降噪耳机"}}, limit=2), results[:2])
+        self.assertEqual(self.db.select("items", {"description": {"$text": "降噪耳机"}}, limit=1, offset=1),
+                         results[1:2])
+        
+        english = self.db.select("items", {"description": {"$text": "Noise EARBUDS"}})
+        self.assertEqual(self.descriptions(english), [self.DOCS[3]])
+        self.assertEqual(self.db.count("items", {"description": {"$text": "无线"}}), 3)
+        self.assertEqual(self.db.select("items", {"description": {"$text": "手表"}}), [])
+    
+    def test_combined_conditions(self):
+        """测试 $text 与其他条件组合"""
+        results = self.db.select("items", {"description": {"$text": "耳机"}, "price": {"$lt": 300}})
+        self.assertEqual(set(self.descriptions(results)), {self.DOCS[0], self.DOCS[1]})
+        self.assertEqual(self.db.select("items", {"_id": 6, "description": {"$text": "键盘"}}), [])
+        self.assertEqual(self.db.explain_query("items", {"description": {"$text": "耳机"}})['index_kind'],
+                         'fulltext')
+    
+    def test_requires_fulltext_index(self):
+        """测试没有全文索引的列不能使用 $text"""
+        with self.assertRaises(ADBError):
+            self.db.select("items", {"price": {"$text": "100"}})
+        with self.assertRaises(ADBError):
+            self.db.create_index("items", "price", tokenizer='whitespace')
+    
+    def test_maintenance_and_reload(self):
+        """测试增删改后索引与记录一致，重新加载后按记录重建"""
+        self.db.insert("items", {"description": "骨传导耳机"})
+        self.db.update("items", {"price": 100}, {"description": "智能手表"})
+        self.db.delete("items", {"price": 200})
+        self.db.optimize_table("items")
+        self.assertTrue(all(self.db.check_indexes("items").values()))
+        self.assertEqual(len(self.db.select("items", {"description": {"$text": "耳机"}})), 3)
+        
+        self.db.close()
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertTrue(all(self.db.check_indexes("items").values()))
+        self.assertEqual(self.descriptions(self.db.select("items", {"description": {"$text": "手表"}})),
+                         ["智能手表"])
+    
+    def test_custom_tokenizer(self):
+        """测试注册自定义分词器"""
+        register_tokenizer('comma', lambda text: [part.strip().lower() for part in text.split(',')])
+        self.db.create_table("tags")
+        self.db.insert("tags", {"tags": "Red, Large"})
+        self.db.insert("tags", {"tags": "red wine, small"})
+        self.db.create_index("tags", "tags", kind='fulltext', tokenizer='comma')
+        self.assertEqual(self.db.count("tags", {"tags": {"$text": "red"}}), 1)
+        self.assertEqual(self.db.count("tags", {"tags": {"$text": "red wine"}}), 1)
+
+class TestIndexOnlyExecution(unittest.TestCase):
+    """只读索引的 count 与 distinct 测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "index_only.json"), enable_logging=False)
+        self.db.create_table("users")
+        for i in range(60):
+            self.db.insert("users", {"city": ("北京", "上海", "广州")[i % 3], "age": 20 + i % 7,
+                                     "level": i % 2, "tags": ["a"] if i % 5 else ["b"]})
+        self.db.insert("users", {"name": "无城市"})
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_count_without_reading_records(self):
+        """测试条件由索引精确回答时 count 不检查记录"""
+        self.db.create_index("users", "city")
+        self.db.create_index("users", "age", kind='sorted')
+        with mock.patch('adb._compile_condition', wraps=_compile_condition) as compiled:
+            self.assertEqual(self.db.count("users", {"city": "北京"}), 20)
+            self.assertEqual(self.db.count("users", {"city": {"$in": ["北京", "广州"]}}), 40)
+            self.assertEqual(self.db.count("users", {"city": "上海", "age": 21}), 3)
+            self.assertEqual(self.db.count("users", {"_id": {"$in": [1, 2, 999]}}), 2)
+            self.assertFalse(compiled.called)
+            
+            # 范围条件和未建索引的列仍逐条检查
+            self.assertEqual(self.db.count("users", {"city": "北京", "level": 1}), 10)
+            self.assertEqual(self.db.count("users", {"age": {"$gte": 25}}), 17)
+            self.assertTrue(compiled.called)
+    
+    def test_distinct(self):
+        """测试 distinct 读取索引键，未建索引的列遍历一次"""
+        expected_cities = ["北京", "上海", "广州"]
+        self.assertEqual(self.db.distinct("users", "city"), expected_cities)
+        self.assertEqual(self.db.distinct("users", "tags"), [["b"], ["a"]])
+        self.assertEqual(self.db.distinct("users", "city", {"age": 20}), expected_cities)
+        
+        self.db.create_index("users", "city", kind='bitmap')
+        self.db.create_index("users", "level", kind='bitmap')
+        self.db.create_index("users", "age", kind='sorted')
+        self.assertEqual(sorted(self.db.distinct("users", "city")), sorted(expected_cities))
+        self.assertEqual(self.db.distinct("users", "age"), list(range(20, 27)))
+        self.assertEqual(self.db.distinct("users", "city", {"level": 0, "city": {"$in": ["北京", "上海"]}}),
+                         ["北京", "上海"])
+        self.assertEqual(self.db.distinct("users", "level", {"age": {"$gte": 26}}), [0, 1])
+        
+        self.db.delete("users", {"city": "上海"})
+        self.assertEqual(sorted(self.db.distinct("users", "city")), sorted(["北京", "广州"]))
+        with self.assertRaises(TableNotFoundError):
+            self.db.distinct("missing", "city")
+
+class TestPartialAndExpressionIndex(unittest.TestCase):
+    """部分索引与表达式索引测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "derived.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.db.create_table("tasks")
+        for i in range(50):
+            self.db.insert("tasks", {
+                "status": "pending" if i % 10 == 0 else "done",
+                "owner": f"user{i % 5}",
+                "email": f"User{i % 5}@Example.COM",
+                "meta": {"region": ("north", "south")[i % 2]}
+            })
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def scan(self, condition):
+        """全表扫描得到的期望结果"""
+        return [record for record in self.db.data["tasks"]
+                if record is not None and self.db._match_condition(record, condition)]
+    
+    def test_partial_index(self):
+        """测试部分索引只收录满足条件的记录，只在查询包含 where 条件时使用"""
+        self.db.create_index("tasks", "owner", where={"status": "pending"})
+        index = self.db.indexes["tasks"]['owner WHERE {"status":"pending"}']
+        self.assertEqual(sum(len(positions) for positions in index.entries.values()), 5)
+        
+        condition = {"status": "pending", "owner": "user0"}
+        plan = self.db.explain_query("tasks", condition)
+        self.assertEqual(plan['indexes_used'], ['owner WHERE {"status":"pending"}'])
+        self.assertEqual(plan['estimated_rows'], 5)
+        self.assertEqual(self.db.select("tasks", condition), self.scan(condition))
+        self.assertEqual(self.db.count("tasks", condition), 5)
+        
+        # 查询不包含 where 条件时不能使用部分索引
+        self.assertEqual(self.db.explain_query("tasks", {"owner": "user0"})['scan_type'], 'full_scan')
+        self.assertEqual(self.db.count("tasks", {"owner": "user0"}), 10)
+        self.assertEqual(self.db.explain_query("tasks", {"status": "done", "owner": "user0"})['scan_type'],
+                         'full_scan')
+        
+        # 修改 where 条件涉及的列时维护索引
+        self.db.update("tasks", {"owner": "user1"}, {"status": "pending"})
+        self.db.delete("tasks", {"owner": "user0", "status": "pending"})
+        self.assertTrue(all(self.db.check_indexes("tasks").values()))
+        self.assertEqual(self.db.count("tasks", {"status": "pending", "owner": "user1"}), 10)
+    
+    def test_expression_indexes(self):
+        """测试 lower、date、嵌套路径表达式索引"""
+        self.db.create_index("tasks", "lower(email)")
+        self.db.create_index("tasks", "path(meta.region)", kind='bitmap')
+        self.db.create_index("tasks", "date(_created_at)", kind='sorted')
+        
+        condition = {"lower(email)": "user3@example.com"}
+        self.assertEqual(self.db.explain_query("tasks", condition)['indexes_used'], ["lower(email)"])
+        self.assertEqual(len(self.db.select("tasks", condition)), 10)
+        self.assertEqual(self.db.count("tasks", {"lower(email)": "User3@Example.COM"}), 0)
+        self.assertEqual(self.db.count("tasks", {"path(meta.region)": "south", "lower(email)": "user1@example.com"}),
+                         5)
+        today = self.db.data["tasks"][0]["_created_at"][:10]
+        self.assertEqual(self.db.count("tasks", {"date(_created_at)": {"$gte": today}}), 50)
+        
+        self.db.update("tasks", {"owner": "user3"}, {"email": "NEW@example.com", "meta": {"region": "west"}})
+        self.assertTrue(all(self.db.check_indexes("tasks").values()))
+        self.assertEqual(self.db.count("tasks", {"lower(email)": "new@example.com"}), 10)
+        self.assertEqual(self.db.select("tasks", {"path(meta.region)": "west"}),
+                         self.scan({"path(meta.region)": "west"}))
+        
+        self.db.alter_table("tasks", "drop_column", column_name="meta")
+        self.assertNotIn("path(meta.region)", self.db.indexes["tasks"])
+    
+    def test_persistence_and_custom_function(self):
+        """测试部分索引、表达式索引的保存与重新加载，以及自定义键函数"""
+        register_key_function('domain', lambda value: str(value).rsplit('@', 1)[-1].lower())
+        self.db.create_index("tasks", "domain(email)", kind='bitmap', where={"status": "done"})
+        self.db.create_index("tasks", "lower(email)", kind='sorted')
+        self.db.close()
+        
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertTrue(all(self.db.check_indexes("tasks").values()))
+        self.assertEqual(self.db.indexes["tasks"]['domain(email) WHERE {"status":"done"}'].where, {"status": "done"})
+        self.assertEqual(self.db.count("tasks", {"status": "done", "domain(email)": "example.com"}), 45)
+        self.assertEqual(self.db.count("tasks", {"lower(email)": {"$gt": "user2"}}), 30)
+        with self.assertRaises(ADBError):
+            self.db.create_index("tasks", ["lower(email)", "owner"])
+    
+    def test_full_and_partial_index_coexist(self):
+        """测试同一列上的完整索引与部分索引可以并存，定义冲突时报错"""
+        pending = {"status": "pending"}
+        partial = 'owner WHERE {"status":"pending"}'
+        self.assertTrue(self.db.create_index("tasks", "owner", where=pending))
+        self.assertTrue(self.db.create_index("tasks", "owner", kind='sorted'))
+        self.assertTrue(self.db.create_index("tasks", "owner", where={"status": "done"}))
+        self.assertEqual(self.db.list_indexes("tasks"),
+                         [partial, "owner", 'owner WHERE {"status":"done"}'])
+        
+        # 定义相同时返回False，同名但类型不同时报错
+        self.assertFalse(self.db.create_index("tasks", "owner", where=pending))
+        self.assertFalse(self.db.create_index("tasks", "owner", kind='sorted'))
+        with self.assertRaises(ADBError):
+            self.db.create_index("tasks", "owner", kind='bitmap', where=pending)
+        with self.assertRaises(ADBError):
+            self.db.create_index("tasks", "owner")
+        
+        # 各自按 where 条件选用，结果与全表扫描一致
+        condition = {"status": "pending", "owner": "user0"}
+        self.assertIn(partial, self.db.explain_query("tasks", condition)['indexes_used'])
+        self.assertEqual(self.db.select("tasks", condition), self.scan(condition))
+        self.assertEqual(self.db.explain_query("tasks", {"owner": "user0"})['indexes_used'], ["owner"])
+        self.assertEqual(self.db.count("tasks", {"owner": {"$gte": "user3"}}), 20)
+        
+        # 重新加载（快照与日志重放）后两个索引都在
+        self.db.close()
+        self.db = ADB(db_path=self.db_path, enable_logging=False)
+        self.assertEqual(sorted(self.db.list_indexes("tasks")),
+                         sorted([partial, "owner", 'owner WHERE {"status":"done"}']))
+        self.assertEqual(self.db.indexes["tasks"][partial].column, "owner")
+        self.assertTrue(all(self.db.check_indexes("tasks").values()))
+        self.assertEqual(self.db.count("tasks", condition), 5)
+        
+        self.assertTrue(self.db.drop_index("tasks", "owner", where=pending))
+        self.assertEqual(sorted(self.db.list_indexes("tasks")), ["owner", 'owner WHERE {"status":"done"}'])
+    
+    def test_partial_index_wal_replay(self):
+        """测试 WAL 模式下部分索引的创建与删除重放后结果一致"""
+        wal_path = os.path.join(self.temp_dir, "derived_wal.json")
+        db = ADB(db_path=wal_path, enable_logging=False, journal_mode='wal', durability='sync')
+        db.create_table("docs")
+        db.insert("docs", {"body": "数据库索引", "lang": "zh"})
+        db.insert("docs", {"body": "数据库优化", "lang": "en"})
+        db.create_index("docs", "body", kind='fulltext', where={"lang": "zh"})
+        db.create_index("docs", "lang")
+        db.create_index("docs", "lang", kind='bitmap', where={"lang": "en"})
+        db.drop_index("docs", 'lang WHERE {"lang":"en"}')
+        self.assertTrue(os.path.exists(wal_path + ".wal"))
+        db.close()
+        
+        db = ADB(db_path=wal_path, enable_logging=False, journal_mode='wal', durability='sync')
+        self.assertEqual(sorted(db.list_indexes("docs")), ['body WHERE {"lang":"zh"}', "lang"])
+        self.assertEqual(len(db.select("docs", {"lang": "zh", "body": {"$text": "索引"}})), 1)
+        with self.assertRaises(ADBError):
+            db.select("docs", {"body": {"$text": "索引"}})
+        db.close()
+
+class TestOnlineIndexBuild(unittest.TestCase):
+    """在线索引构建测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "online.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.db.create_table("events")
+        self.db.data["events"] = [{"_id": i + 1, "kind": f"k{i % 20}", "n": i} for i in range(3000)]
+        self.db._index_rows("events")
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_planner_ignores_index_until_ready(self):
+        """测试构建完成前查询不使用索引，状态可见"""
+        with self.db._lock:
+            self.assertTrue(self.db.create_index("events", "kind", online=True))
+            self.assertFalse(self.db.create_index("events", "kind", online=True))
+            self.assertEqual(self.db.explain_query("events", {"kind": "k3"})['scan_type'], 'full_scan')
+            self.assertEqual(self.db.count("events", {"kind": "k3"}), 150)
+            status = self.db.list_indexes("events", with_status=True)
+            self.assertEqual(status[0]['name'], "kind")
+            self.assertEqual(status[0]['status'], 'building')
+            self.assertNotIn("kind", self.db.list_indexes("events"))
+        
+        self.assertTrue(self.db.wait_for_index("events", "kind", timeout=10))
+        self.assertEqual(self.db.list_indexes("events", with_status=True),
+                         [{'name': 'kind', 'kind': 'hash', 'status': 'ready'}])
+        self.assertEqual(self.db.explain_query("events", {"kind": "k3"})['scan_type'], 'index_scan')
+    
+    def test_concurrent_writes_captured(self):
+        """测试构建期间的插入、更新、删除和表整理都反映在索引中"""
+        with mock.patch('adb._INDEX_BUILD_CHUNK', 50):
+            self.db.create_index("events", "kind", kind='sorted', online=True)
+            for i in range(40):
+                self.db.update("events", {"n": i * 70}, {"kind": "changed"})
+                self.db.insert("events", {"kind": "new", "n": -i})
+                self.db.delete("events", {"n": i * 70 + 1})
+            self.db.delete("events", {"n": {"$lt": 2000}})  # 空位过半，触发整理
+            self.db.update("events", {"n": 2100}, {"kind": "late"})
+            self.assertTrue(self.db.wait_for_index("events", "kind", timeout=10))
+        
+        self.assertEqual(self.db.check_indexes("events"), {"kind": True})
+        self.assertEqual(self.db.count("events", {"kind": "new"}), 0)
+        self.assertEqual(self.db.count("events", {"kind": "late"}), 1)
+        
+        # 完成后记录到WAL，重新打开后索引仍在
+        self.db.close()
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.assertEqual(self.db.list_indexes("events"), ["kind"])
+        self.assertEqual(self.db.check_indexes("events"), {"kind": True})
+    
+    def test_selects_during_online_build(self):
+        """测试不持锁的查询与在线构建、删除索引并发执行时不出错且结果正确"""
+        errors = []
+        stop = threading.Event()
+        
+        def reader():
+            try:
+                while not stop.is_set():
+                    self.assertEqual(len(self.db.select("events", {"kind": "k3", "n": {"$gte": 0}})), 150)
+                    self.assertEqual(self.db.count("events", {"n": {"$lt": 100}}), 100)
+            except Exception as e:
+                errors.append(e)
+        
+        readers = [threading.Thread(target=reader) for _ in range(4)]
+        for t in readers:
+            t.start()
+        try:
+            for _ in range(10):
+                for column in ("kind", "n"):
+                    self.db.create_index("events", column, kind='sorted', online=True)
+                for column in ("kind", "n"):
+                    self.assertTrue(self.db.wait_for_index("events", column, timeout=10))
+                for column in ("kind", "n"):
+                    self.db.drop_index("events", column)
+        finally:
+            stop.set()
+            for t in readers:
+                t.join()
+        self.assertEqual(errors, [])
+    
+    def block_build(self):
+        """让在线构建线程在加入第一条记录时阻塞，返回 (已阻塞, 放行) 两个事件"""
+        entered, gate = threading.Event(), threading.Event()
+        add = adb._HashIndex.add
+        
+        def blocking_add(index, record, position):
+            if threading.current_thread().name.startswith('adb-index'):
+                entered.set()
+                gate.wait(10)
+            return add(index, record, position)
+        
+        patcher = mock.patch('adb._HashIndex.add', blocking_add)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(gate.set)
+        return entered, gate
+    
+    def test_build_does_not_block_writers(self):
+        """测试构建线程按快照构建索引时不持锁，写操作不等待"""
+        entered, gate = self.block_build()
+        self.db.create_index("events", "kind", online=True)
+        self.assertTrue(entered.wait(10))
+        writer = threading.Thread(target=self.db.insert, args=("events", {"kind": "new", "n": -1}))
+        writer.start()
+        writer.join(timeout=5)
+        self.assertFalse(writer.is_alive())
+        self.db.update("events", {"n": 5}, {"kind": "changed"})
+        gate.set()
+        
+        self.assertTrue(self.db.wait_for_index("events", "kind", timeout=10))
+        self.assertEqual(self.db.check_indexes("events"), {"kind": True})
+        self.assertEqual(self.db.count("events", {"kind": "new"}), 1)
+        self.assertEqual(self.db.count("events", {"kind": "changed"}), 1)
+    
+    def test_close_reports_cancelled_build(self):
+        """测试关闭数据库时取消进行中的构建并记录警告"""
+        entered, gate = self.block_build()
+        self.db.create_index("events", "kind", online=True)
+        self.assertTrue(entered.wait(10))
+        threading.Timer(0.1, gate.set).start()
+        with self.assertLogs('adb', level='WARNING') as logs:
+            self.db.close()
+        self.assertTrue(any("kind" in line and "取消" in line for line in logs.output))
+        self.assertEqual(self.db.list_indexes("events", with_status=True)[0]['status'], 'cancelled')
+    
+    def test_drop_and_failure(self):
+        """测试取消构建和构建失败的状态"""
+        with self.db._lock:
+            self.db.create_index("events", "n", online=True)
+            self.assertTrue(self.db.drop_index("events", "n"))
+        self.assertFalse(self.db.wait_for_index("events", "n", timeout=10))
+        self.assertEqual(self.db.list_indexes("events", with_status=True), [])
+        
+        self.db.insert("events", {"kind": ["unhashable"]})
+        self.db.create_index("events", "kind", online=True)
+        self.assertFalse(self.db.wait_for_index("events", "kind", timeout=10))
+        status = self.db.list_indexes("events", with_status=True)[0]
+        self.assertEqual(status['status'], 'failed')
+        self.assertIn('error', status)
+
+class TestIndexAdvisor(unittest.TestCase):
+    """查询负载统计与索引建议测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "advisor.json")
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.db.create_table("orders")
+        for i in range(500):
+            self.db.insert("orders", {"customer": f"c{i % 50}", "status": ("open", "closed")[i % 2],
+                                      "amount": i})
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def run_workload(self):
+        for i in range(20):
+            self.db.select("orders", {"customer": f"c{i}", "status": "open"})
+            self.db.count("orders", {"amount": {"$gte": 490}})
+    
+    def test_stats_recorded(self):
+        """测试按条件形状记录查询负载"""
+        self.run_workload()
+        self.db.create_index("orders", "customer")
+        self.db.count("orders", {"customer": "c1"})
+        stats = {tuple(map(tuple, entry['shape'])): entry for entry in self.db.query_stats("orders")}
+        entry = stats[(("customer", "eq"), ("status", "eq"))]
+        self.assertEqual(entry['calls'], 20)
+        self.assertEqual(entry['full_scans'], 20)
+        self.assertEqual(entry['rows_scanned'], 20 * 500)
+        self.assertEqual(entry['rows_matched'], 100)
+        self.assertEqual(stats[(("customer", "eq"),)]['rows_scanned'], 0)
+        self.assertEqual(stats[(("amount", "range"),)]['rows_matched'], 200)
+    
+    def test_recommendations(self):
+        """测试推荐复合、哈希和有序索引，并按建议创建"""
+        self.run_workload()
+        recommendations = self.db.advise_indexes("orders")
+        by_name = {item['name']: item for item in recommendations}
+        self.assertEqual(recommendations[0]['name'], "customer,status")
+        self.assertEqual(by_name["customer,status"]['kind'], 'hash')
+        self.assertEqual(by_name["amount"]['kind'], 'sorted')
+        self.assertIn("customer", by_name)
+        self.assertGreater(by_name["customer"]['estimated_savings'], by_name["status"]['estimated_savings'])
+        
+        applied = self.db.advise_indexes("orders", apply=True)
+        self.assertTrue(all(item.get('created') for item in applied))
+        self.assertEqual(self.db.explain_query("orders", {"customer": "c1", "status": "open"})['strategy'],
+                         'composite')
+        self.assertEqual(self.db.explain_query("orders", {"amount": {"$gte": 490}})['scan_type'],
+                         'index_range_scan')
+    
+    def test_memory_budget_and_persistence(self):
+        """测试预算限制，以及统计随数据库关闭保存"""
+        self.run_workload()
+        self.db.auto_index_memory = by_bytes = min(item['estimated_bytes']
+                                                   for item in self.db.advise_indexes("orders"))
+        created = [item for item in self.db.advise_indexes("orders", apply=True) if item.get('created')]
+        self.assertEqual(len(created), 1)
+        self.assertLessEqual(created[0]['estimated_bytes'], by_bytes)
+        
+        self.db.close()
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.assertEqual(sum(entry['calls'] for entry in self.db.query_stats("orders")), 40)
+    
+    def test_stats_saved_without_auto_index(self):
+        """测试未开启自动索引时统计也随数据库关闭保存，只是不自动创建索引"""
+        self.run_workload()
+        self.db.close()
+        self.assertTrue(os.path.exists(self.db_path + ".workload.json"))
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.assertEqual(sum(entry['calls'] for entry in self.db.query_stats("orders")), 40)
+        self.assertEqual(self.db.list_indexes("orders"), [])
+    
+    def test_advise_indexes_cli_across_processes(self):
+        """测试命令行在新进程中根据之前进程记录的查询负载给出建议"""
+        db_path = os.path.join(self.temp_dir, "cli.json")
+        cli = str(Path(__file__).parent.parent / "adb_cli.py")
+        
+        def run(*args):
+            result = subprocess.run([sys.executable, cli, "--db", db_path, *args], cwd=self.temp_dir,
+                                    capture_output=True, text=True, timeout=60)
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+            return result.stdout
+        
+        run("create-table", "t")
+        for i in range(10):
+            run("insert", "t", json.dumps({"k": i}))
+        for _ in range(3):
+            run("select", "t", "--condition", json.dumps({"k": 5}))
+        self.assertTrue(os.path.exists(db_path + ".workload.json"))
+        output = run("advise-indexes", "t")
+        self.assertNotIn("暂无索引建议", output)
+        self.assertIn("k (hash)", output)
+    
+    def test_stats_file_written_only_when_changed(self):
+        """测试统计没有变化时关闭数据库不写 .workload.json"""
+        stats_path = self.db_path + ".workload.json"
+        self.db.close()
+        self.assertFalse(os.path.exists(stats_path))
+        
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.db.select("orders", {"customer": "c1"})
+        self.db.close()
+        self.assertTrue(os.path.exists(stats_path))
+        
+        mtime = os.path.getmtime(stats_path)
+        os.utime(stats_path, (mtime - 10, mtime - 10))
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+        self.db.insert("orders", {"customer": "c0", "status": "open", "amount": 1})
+        self.db.close()
+        self.assertEqual(os.path.getmtime(stats_path), mtime - 10)
+        self.db = ADB(db_path=self.db_path, enable_logging=False, journal_mode='wal')
+    
+    def test_dropped_auto_index_releases_budget(self):
+        """测试删除自动创建的索引（或所在的表）后归还 auto_index_memory 预算"""
+        self.run_workload()
+        self.db.auto_index_memory = min(item['estimated_bytes'] for item in self.db.advise_indexes("orders"))
+        created = [item for item in self.db.advise_indexes("orders", apply=True) if item.get('created')]
+        self.assertEqual(len(created), 1)
+        self.assertEqual(self.db._auto_index_bytes, created[0]['estimated_bytes'])
+        
+        self.assertTrue(self.db.drop_index("orders", created[0]['columns']))
+        self.assertEqual(self.db._auto_index_bytes, 0)
+        created = [item for item in self.db.advise_indexes("orders", apply=True) if item.get('created')]
+        self.assertEqual(len(created), 1)
+        
+        self.db.rename_table("orders", "archived")
+        self.assertTrue(self.db.drop_table("archived"))
+        self.assertEqual(self.db._auto_index_bytes, 0)
+        self.assertEqual(self.db._auto_index_sizes, {})
+    
+    def test_auto_index(self):
+        """测试自动索引模式在后台创建索引"""
+        self.db.auto_index = True
+        with mock.patch.object(self.db, '_advise_and_create', wraps=self.db._advise_and_create) as advise:
+            for i in range(100):
+                self.db.select("orders", {"customer": f"c{i % 50}"})
+            # 评估在后台线程中进行，不占用查询线程
+            advisor = self.db._advisor_threads.get("orders")
+            if advisor is not None:
+                advisor.join(timeout=10)
+            self.assertEqual(advise.call_count, 1)
+        self.assertTrue(self.db.wait_for_index("orders", "customer", timeout=10))
+        self.assertEqual(self.db.explain_query("orders", {"customer": "c1"})['scan_type'], 'index_scan')
+
+class TestCostBasedPlanner(unittest.TestCase):
+    """基于代价的查询规划测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "planner_db.json"), enable_logging=False,
+                      journal_mode='wal')
+        self.db.create_table("people")
+        for i in range(1000):
+            record = {"age": i % 100, "city": ("北京", "上海", "广州", "深圳")[i % 4],
+                      "name": f"user{i}", "vip": i % 25 == 0}
+            if i % 10 == 0:
+                record["nickname"] = None
+            self.db.insert("people", record)
+        self.db.create_index("people", "age", kind='sorted')
+        self.db.create_index("people", "city")
+        self.db.create_index("people", "vip")
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def expected(self, condition):
+        """全表扫描的结果"""
+        return [r for r in self.db.data["people"] if r is not None and self.db._match_condition(r, condition)]
+    
+    def test_column_statistics(self):
+        """测试 analyze_table 收集直方图、最常见值和空值比例"""
+        stats = self.db.analyze_table("people")['statistics']
+        self.assertEqual(stats['age']['row_count'], 1000)
+        self.assertEqual(stats['age']['distinct'], 100)
+        self.assertEqual(len(stats['age']['histogram']), 33)
+        self.assertEqual(stats['age']['histogram'][0], 0)
+        self.assertEqual(stats['age']['histogram'][-1], 99)
+        self.assertEqual(sorted(value for value, _ in stats['city']['mcv']), sorted(["北京", "上海", "广州", "深圳"]))
+        self.assertAlmostEqual(stats['nickname']['null_fraction'], 0.1)
+        self.assertAlmostEqual(stats['nickname']['missing_fraction'], 0.9)
+    
+    def test_selectivity_estimates(self):
+        """测试等值、范围和 $like 条件的行数估计"""
+        self.db.analyze_table("people")
+        cases = [({"city": "北京"}, 250), ({"age": {"$gte": 20, "$lt": 60}}, 400),
+                 ({"name": {"$like": "user1"}}, 111), ({"nickname": None}, 100)]
+        for condition, actual in cases:
+            self.assertEqual(len(self.expected(condition)), actual)
+            # 对不建索引的列估计
+            estimate = self.db._plan_tree("people", condition, None)['estimated_rows']
+            self.assertLess(abs(estimate - actual), actual * 0.5 + 10, condition)
+    
+    def test_unselective_index_uses_full_scan(self):
+        """测试候选记录太多时放弃索引"""
+        plan = self.db.explain_query("people", {"age": {"$gt": 5}})
+        self.assertEqual(plan['scan_type'], 'full_scan')
+        self.assertEqual(plan['plan']['node'], 'full_scan')
+        plan = self.db.explain_query("people", {"age": {"$lt": 5}})
+        self.assertEqual(plan['scan_type'], 'index_range_scan')
+        self.assertLess(plan['estimated_cost'], plan['full_scan_cost'])
+        for condition in ({"age": {"$gt": 5}}, {"age": {"$lt": 5}}):
+            self.assertEqual(self.db.select("people", condition), self.expected(condition))
+    
+    def test_intersection_only_when_cheaper(self):
+        """测试只在降低代价时求交集"""
+        # vip 的候选很少，再取出 age 的范围求交集不划算
+        plan = self.db.explain_query("people", {"vip": True, "age": {"$lt": 50}})
+        self.assertEqual(plan['indexes_used'], ["vip"])
+        self.assertEqual(plan['plan']['node'], 'filter')
+        self.assertEqual(plan['plan']['filter'], ["age"])
+        # 两个等值索引求交集后无需逐条检查，比只用 vip 更便宜
+        self.assertEqual(self.db.explain_query("people", {"vip": True, "city": "北京"})['strategy'], 'intersection')
+        
+        condition = {"city": "北京", "age": {"$lt": 50}}
+        plan = self.db.explain_query("people", condition)
+        self.assertEqual(plan['scan_type'], 'index_intersection')
+        self.assertEqual(plan['plan']['children'][0]['node'], 'intersection')
+        self.assertEqual([child['index'] for child in plan['plan']['children'][0]['children']], ["city", "age"])
+        self.assertEqual(self.db.select("people", condition), self.expected(condition))
+    
+    def test_plan_tree_costs(self):
+        """测试执行计划树给出各节点的估算代价"""
+        plan = self.db.explain_query("people", {"city": "上海"})
+        self.assertEqual(plan['plan'], {'node': 'hash_index_scan', 'index': 'city', 'type': 'eq',
+                                        'estimated_rows': 250, 'cost': 25.0})
+        self.assertEqual(plan['estimated_cost'], 25.0)
+        self.assertEqual(plan['full_scan_cost'], 1000)
+        self.assertFalse(plan['analyzed'])
+        self.assertEqual(self.db.explain_query("people", {"_id": 3})['plan']['node'], 'primary_key_lookup')
+    
+    def test_statistics_follow_table(self):
+        """测试统计信息随表重命名和删除"""
+        self.db.analyze_table("people")
+        self.db.rename_table("people", "members")
+        self.assertTrue(self.db.explain_query("members", {"age": 1})['analyzed'])
+        self.db.drop_table("members")
+        self.assertNotIn("members", self.db._table_stats)
+
+class TestCompiledPredicate(unittest.TestCase):
+    """条件编译测试"""
+    
+    RECORDS = [
+        {"name": "Alice", "age": 30, "tags": ["a"], "address": {"city": "BJ"}},
+        {"name": "bob", "age": 17, "score": None},
+        {"name": "Carol", "age": 45.5, "address": {"city": "sh"}},
+        {"age": "unknown", "tags": ["b"]},
+        {"name": "dave"},
+        {},
+    ]
+    
+    def test_matches_interpreter(self):
+        """测试编译后的谓词与逐条解释执行结果一致"""
+        conditions = [
+            {"name": "bob"},
+            {"age": {"$gte": 18, "$lt": 40}},
+            {"name": {"$like": "A"}},
+            {"name": {"$in": ["bob", "dave"]}},
+            {"tags": {"$in": [["a"], ["c"]]}},
+            {"name": {"$in": "Alice Carol"}},
+            {"score": None},
+            {"lower(name)": "alice"},
+            {"path(address.city)": {"$like": "s"}},
+            {"name": {"$like": "o"}, "age": {"$gt": 10}},
+            {"name": {"$text": "bob"}},
+            {"name": {}},
+        ]
+        for condition in conditions:
+            predicate = _compile_condition(condition)
+            for record in self.RECORDS:
+                try:
+                    expected = _match_condition(record, condition)
+                except TypeError:
+                    with self.assertRaises(TypeError):
+                        predicate(record)
+                    continue
+                self.assertEqual(predicate(record), expected, (condition, record))
+    
+    def test_cached_by_shape(self):
+        """测试相同结构、不同取值的条件复用已编译的谓词"""
+        _compile_condition({"qty": {"$gt": 1}, "sku": "a"})
+        before = _predicate_factory.cache_info()
+        predicate = _compile_condition({"qty": {"$gt": 5}, "sku": "b"})
+        after = _predicate_factory.cache_info()
+        self.assertEqual(after.hits, before.hits + 1)
+        self.assertEqual(after.misses, before.misses)
+        self.assertTrue(predicate({"qty": 6, "sku": "b"}))
+        self.assertFalse(predicate({"qty": 2, "sku": "b"}))
+        
+        # 列的顺序或操作符不同即为不同的结构
+        _compile_condition({"sku": "b", "qty": {"$gt": 5}})
+        self.assertEqual(_predicate_factory.cache_info().misses, after.misses + 1)
+
+class TestLimitPushdown(unittest.TestCase):
+    """limit 下推测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "limit_db.json"), enable_logging=False,
+                      journal_mode='wal')
+        self.db.create_table("logs")
+        for i in range(1000):
+            self.db.insert("logs", {"level": ("info", "warn", "error")[i % 3], "seq": i})
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def rows_scanned(self, condition):
+        """最近一次同形状查询累计检查的记录数"""
+        self.db._query_stats.clear()
+        self.db.select("logs", condition, limit=5, offset=10)
+        return self.db.query_stats("logs")[0]['rows_scanned']
+    
+    def test_full_scan_stops_early(self):
+        """测试全表扫描找到 offset + limit 条匹配即停止"""
+        condition = {"level": "warn"}
+        expected = [r for r in self.db.data["logs"] if r["level"] == "warn"][10:15]
+        self.assertEqual(self.db.select("logs", condition, limit=5, offset=10), expected)
+        self.assertEqual(self.rows_scanned(condition), 44)
+        self.assertEqual(self.db.select("logs", condition, limit=5, offset=400), [])
+    
+    def test_index_path_stops_early(self):
+        """测试索引候选记录同样提前停止检查"""
+        self.db.create_index("logs", "seq", kind='sorted')
+        condition = {"seq": {"$lt": 100}, "level": "error"}
+        expected = [r for r in self.db.data["logs"] if r["seq"] < 100 and r["level"] == "error"]
+        self.assertEqual(self.db.select("logs", condition, limit=5, offset=10), expected[10:15])
+        self.assertEqual(self.rows_scanned(condition), 45)
+        self.assertEqual(self.db.select("logs", condition, offset=30), expected[30:])
+    
+    def test_export_limit(self):
+        """测试导出指定数量的记录"""
+        exported = self.db.export_data("logs", {"level": "info"}, format='list', limit=3)
+        self.assertEqual([r["seq"] for r in exported], [0, 3, 6])
+        self.assertEqual(len(json.loads(self.db.export_data("logs", None, limit=7))), 7)
+
+class TestOrderBy(unittest.TestCase):
+    """排序查询测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "order_db.json"), enable_logging=False,
+                      journal_mode='wal')
+        self.db.create_table("items")
+        for i in range(300):
+            record = {"price": (i * 37) % 50, "name": f"item{i % 7}", "group": ("a", "b", "c")[i % 3]}
+            if i % 40 == 0:
+                del record["price"]
+            self.db.insert("items", record)
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def expected(self, condition, keys):
+        """先按 _id 排好，再从最后一个排序列开始逐列稳定排序"""
+        records = [r for r in self.db.data["items"] if r is not None and _match_condition(r, condition or {})]
+        for column, descending in reversed(keys):
+            present = [r for r in records if column in r]
+            missing = [r for r in records if column not in r]
+            present.sort(key=lambda r: r[column], reverse=descending)
+            records = present + missing if descending else missing + present
+        return records
+    
+    def test_sort_without_limit(self):
+        """测试没有 limit 时一次稳定排序"""
+        order = [("price", "desc"), ("name", "asc")]
+        self.assertEqual(self.db.select("items", None, order_by=order),
+                         self.expected(None, [("price", True), ("name", False)]))
+        self.assertEqual(self.db.select("items", {"group": "b"}, order_by="price"),
+                         self.expected({"group": "b"}, [("price", False)]))
+        self.assertEqual(self.db.explain_query("items", None, order_by="price")['sort']['strategy'], 'sort')
+    
+    def test_top_k_heap(self):
+        """测试有 limit 且没有可用有序索引时使用堆"""
+        order = [("name", "desc"), ("price", "asc")]
+        expected = self.expected({"group": "a"}, [("name", True), ("price", False)])
+        self.assertEqual(self.db.select("items", {"group": "a"}, limit=10, offset=5, order_by=order),
+                         expected[5:15])
+        plan = self.db.explain_query("items", {"group": "a"}, order_by=order, limit=10)
+        self.assertEqual(plan['sort'], {'strategy': 'top_k_heap', 'order_by': [["name", "desc"], ["price", "asc"]]})
+    
+    def test_index_order(self):
+        """测试首个排序列有有序索引时按索引顺序读取并提前停止"""
+        self.db.create_index("items", "price", kind='sorted')
+        for order, keys in (([("price", "asc"), ("name", "desc")], [("price", False), ("name", True)]),
+                            ([("price", "desc")], [("price", True)])):
+            for condition in (None, {"group": "c"}):
+                expected = self.expected(condition, keys)
+                self.assertEqual(self.db.select("items", condition, limit=12, offset=3, order_by=order),
+                                 expected[3:15])
+                plan = self.db.explain_query("items", condition, order_by=order, limit=12)
+                self.assertEqual(plan['sort']['strategy'], 'index_order')
+                self.assertEqual(plan['sort']['index'], "price")
+        
+        # 有 null 值的记录不在有序索引中，改用堆
+        self.db.insert("items", {"price": None, "name": "x", "group": "a"})
+        self.assertEqual(self.db.explain_query("items", None, order_by="price", limit=5)['sort']['strategy'],
+                         'top_k_heap')
+        # null 与缺失的记录一起排在最前（8条缺少 price 的记录之后）
+        first = self.db.select("items", None, limit=9, order_by="price")
+        self.assertTrue(all("price" not in r for r in first[:8]))
+        self.assertIsNone(first[8]["price"])
+    
+    def test_invalid_order_by(self):
+        """测试无效的排序参数"""
+        with self.assertRaises(ValidationError):
+            self.db.select("items", None, order_by=[("price", "up")])
+        with self.assertRaises(ValidationError):
+            self.db.select("items", None, order_by=[])
+
+class TestCursor(unittest.TestCase):
+    """游标查询与流式导出测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "cursor_db.json"), enable_logging=False,
+                      journal_mode='wal')
+        self.db.create_table("events")
+        for i in range(50):
+            self.db.insert("events", {"kind": ("click", "view")[i % 2], "seq": i, "note": "第\n\"行\""})
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def test_fetch_and_projection(self):
+        """测试分批取出和投影"""
+        cursor = self.db.iter_select("events", {"kind": "view"}, batch_size=10, columns=["seq"])
+        self.assertEqual(cursor.fetchone(), {"seq": 1})
+        self.assertEqual(len(cursor.fetchmany()), 10)
+        self.assertEqual([r["seq"] for r in cursor.fetchmany(3)], [23, 25, 27])
+        self.assertEqual(len(list(cursor)), 11)
+        self.assertEqual(cursor.fetchmany(), [])
+        self.assertEqual(cursor.rownumber, 25)
+        
+        self.db.create_index("events", "kind")
+        with self.db.iter_select("events", {"kind": "click"}) as cursor:
+            self.assertEqual(cursor.fetchall(), self.db.select("events", {"kind": "click"}))
+        with self.assertRaises(TableNotFoundError):
+            self.db.iter_select("missing")
+    
+    def test_snapshot_isolation(self):
+        """测试游标不受创建之后的写操作影响"""
+        expected = [dict(r) for r in self.db.select("events", {"kind": "click"})]
+        cursor = self.db.iter_select("events", {"kind": "click"}, batch_size=5)
+        first = cursor.fetchmany()
+        self.db.update("events", {"kind": "click"}, {"kind": "view"})
+        self.db.delete("events", {"seq": {"$gte": 40}})
+        self.db.insert("events", {"kind": "click", "seq": 100})
+        self.assertEqual(first + cursor.fetchall(), expected)
+        self.assertEqual(self.db.count("events", {"kind": "click"}), 1)
+    
+    def test_export_stream(self):
+        """测试流式导出与 export_data 结果一致"""
+        for condition in (None, {"kind": "view", "seq": {"$lt": 10}}, {"seq": -1}):
+            output = io.StringIO()
+            count = self.db.export_stream("events", output, condition, batch_size=7)
+            self.assertEqual(output.getvalue(), self.db.export_data("events", condition))
+            self.assertEqual(count, len(self.db.select("events", condition)))
+        
+        output = io.StringIO()
+        self.db.export_stream("events", output, {"kind": "click"}, format='jsonl')
+        lines = output.getvalue().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.db.select("events", {"kind": "click"}))
+        with self.assertRaises(ValidationError):
+            self.db.export_stream("events", io.StringIO(), format='csv')
+
+class TestKeysetPagination(unittest.TestCase):
+    """游标分页测试"""
+    
+    def setUp(self):
+        """测试前准备"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.db = ADB(db_path=os.path.join(self.temp_dir, "page_db.json"), enable_logging=False,
+                      journal_mode='wal')
+        self.db.create_table("orders")
+        for i in range(200):
+            record = {"amount": (i * 7) % 40, "status": ("open", "paid")[i % 2]}
+            if i % 50 == 0:
+                del record["amount"]
+            self.db.insert("orders", record)
+    
+    def tearDown(self):
+        """测试后清理"""
+        self.db.close()
+        shutil.rmtree(self.temp_dir)
+    
+    def read_all(self, condition=None, order_by=None, limit=15):
+        """逐页读取全部记录"""
+        result, cursor = [], None
+        while True:
+            page = self.db.select_page("orders", condition, limit, order_by=order_by, cursor=cursor)
+            result.extend(page['records'])
+            if not page['has_more']:
+                self.assertIsNone(page['next_cursor'])
+                return result
+            cursor = page['next_cursor']
+    
+    def test_pages_match_select(self):
+        """测试逐页读取与一次查询的结果一致"""
+        cases = [(None, None), ({"status": "paid"}, None), (None, [("amount", "desc")]),
+                 ({"status": "open"}, ["amount", ("_id", "desc")])]
+        for condition, order_by in cases:
+            expected = self.db.select("orders", condition, order_by=order_by)
+            self.assertEqual(self.read_all(condition, order_by), expected)
+        
+        self.db.create_index("orders", "amount", kind='sorted')
+        for condition, order_by in cases:
+            expected = self.db.select("orders", condition, order_by=order_by)
+            self.assertEqual(self.read_all(condition, order_by), expected)
+    
+    def test_resume_uses_id_map(self):
+        """测试从上一页最后一条记录之后继续，不重新检查之前的记录"""
+        page = self.db.select_page("orders", {"status": "paid"}, 10)
+        self.assertEqual(page['records'][-1]['_id'], 20)
+        self.db._query_stats.clear()
+        page = self.db.select_page("orders", {"status": "paid"}, 10, cursor=page['next_cursor'])
+        self.assertEqual([r['_id'] for r in page['records']], list(range(22, 42, 2)))
+        # 从上一页最后一条记录之后开始，多检查到第11条匹配记录以判断是否还有下一页
+        self.assertEqual(self.db.query_stats("orders")[0]['rows_scanned'], 22)
+    
+    def test_cursor_survives_writes(self):
+        """测试游标对应的记录被删除或表被整理后仍能继续"""
+        page = self.db.select_page("orders", None, 30, order_by=[("amount", "asc")])
+        seen = page['records']
+        self.db.delete("orders", {"_id": seen[-1]['_id']})
+        self.db.delete("orders", {"status": "paid"})
+        self.db.delete("orders", {"amount": {"$gt": 35}})  # 超过一半的空位，整理表
+        self.assertFalse(any(r is None for r in self.db.data["orders"]))
+        rest = self.read_all(None, [("amount", "asc")])
+        page = self.db.select_page("orders", None, None, order_by=[("amount", "asc")], cursor=page['next_cursor'])
+        last = (seen[-1].get("amount", -1), seen[-1]['_id'])
+        self.assertEqual(page['records'], [r for r in rest if (r.get("amount", -1), r['_id']) > last])
+    
+    def test_resume_after_deleted_cursor_and_compaction(self):
+        """测试游标记录被删除且表被整理后，按 _id 继续而不跳过记录"""
+        self.db.truncate_table("orders")
+        for i in range(10):
+            self.db.insert("orders", {"amount": i % 3})
+        for order_by in (None, [("amount", "asc")]):
+            page = self.db.select_page("orders", None, 3, order_by=order_by)
+            expected = self.db.select("orders", order_by=order_by)[3:]
+            self.db.delete("orders", {"_id": {"$in": [r["_id"] for r in page['records']]}})
+            deleted = [r["_id"] for r in self.db.select("orders", order_by=order_by)][:3]
+            self.db.delete("orders", {"_id": {"$in": deleted}})  # 超过一半的空位，整理表
+            self.assertFalse(any(r is None for r in self.db.data["orders"]))
+            rest = self.db.select_page("orders", None, None, order_by=order_by, cursor=page['next_cursor'])
+            self.assertEqual(rest['records'], [r for r in expected if r["_id"] not in deleted])
+            self.db.truncate_table("orders")
+            for i in range(10):
+                self.db.insert("orders", {"amount": i % 3})
+    
+    def test_missing_table_returns_empty_page(self):
+        """测试表不存在时与 select 一样返回空页"""
+        self.assertEqual(self.db.select_page("missing", None, 5),
+                         {'records': [], 'has_more': False, 'next_cursor': None})
+    
+    def test_invalid_cursor(self):
+        """测试无效或与排序不一致的游标"""
+        page = self.db.select_page("orders", None, 5, order_by="amount")
+        with self.assertRaises(ValidationError):
+            self.db.select_page("orders", None, 5, cursor=page['next_cursor'])
+        with self.assertRaises(ValidationError):
+            self.db.select_page("orders", None, 5, cursor="not-a-cursor")
+        with self.assertRaises(ValidationError):
+            self.db.select_page("orders", None, 0)
+    
+    def test_positional_arguments_match_select(self):
+        """测试 select_page 的位置参数顺序与 select 相同，cursor 只能按关键字传入"""
+        condition = {"status": "paid"}
+        page = self.db.select_page("orders", condition, 5, 3, "amount")
+        self.assertEqual(page['records'], self.db.select("orders", condition, 5, 3, "amount"))
+        with self.assertRaises(TypeError):
+            self.db.select_page("orders", condition, 5, 0, "amount", page['next_cursor'])
+
 if __name__ == '__main__':
     unittest.main()
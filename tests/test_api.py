@@ -125,6 +125,113 @@ class TestADBAPI(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertEqual(data['success_count'], 2)
+    
+    def test_get_records_by_ids(self):
+        """测试按ID批量获取记录"""
+        self.db.create_table("users")
+        for name in ("张三", "李四", "王五"):
+            self.db.insert("users", {"name": name})
+        
+        response = self.app.get('/api/tables/users/records?ids=3,1,9', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual([r['name'] for r in data['records']], ['王五', '张三'])
+        
+        response = self.app.get('/api/tables/users/records?ids=a,b', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.app.get('/api/tables/missing/records?ids=1', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+    
+    def test_text_search(self):
+        """测试通过 condition 参数进行全文检索"""
+        self.db.create_table("docs")
+        for body in ("无线耳机 降噪", "有线耳机", "无线鼠标", "键盘"):
+            self.db.insert("docs", {"body": body})
+        response = self.app.post('/api/tables/docs/indexes', headers=self.headers,
+                                 data=json.dumps({"column": "body", "kind": "fulltext"}))
+        self.assertEqual(response.status_code, 200)
+        
+        condition = json.dumps({"body": {"$text": "无线耳机"}})
+        response = self.app.get(f'/api/tables/docs/records?condition={condition}&limit=2', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['records'][0]['body'], "无线耳机 降噪")
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['total_count'], 3)
+    
+    def test_index_advice(self):
+        """测试索引建议与索引状态接口"""
+        self.db.create_table("orders")
+        for i in range(100):
+            self.db.insert("orders", {"customer": f"c{i % 10}"})
+        for i in range(5):
+            self.db.select("orders", {"customer": f"c{i}"})
+        
+        response = self.app.get('/api/tables/orders/indexes/advice', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['recommendations'][0]['name'], 'customer')
+        self.assertEqual(data['workload'][0]['calls'], 5)
+        
+        response = self.app.post('/api/tables/orders/indexes/advice', headers=self.headers)
+        self.assertTrue(json.loads(response.data)['recommendations'][0]['created'])
+        response = self.app.get('/api/tables/orders/indexes', headers=self.headers)
+        self.assertEqual(json.loads(response.data)['indexes'],
+                         [{'name': 'customer', 'kind': 'hash', 'status': 'ready'}])
+
+    def test_order_by(self):
+        """测试 order_by 参数排序"""
+        self.db.create_table("products")
+        for price in (30, 10, 20, 10):
+            self.db.insert("products", {"price": price})
+        response = self.app.get('/api/tables/products/records?order_by=price:desc,_id:desc&limit=3',
+                                headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        records = json.loads(response.data)['records']
+        self.assertEqual([(r['price'], r['_id']) for r in records], [(30, 1), (20, 3), (10, 4)])
+        
+        response = self.app.get('/api/tables/products/records?order_by=price:up', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_streaming_export(self):
+        """测试完整导出逐批流式返回"""
+        self.db.create_table("logs")
+        for i in range(30):
+            self.db.insert("logs", {"seq": i})
+        response = self.app.get('/api/tables/logs/export', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True), self.db.export_data("logs"))
+        
+        response = self.app.get('/api/tables/logs/export?format=jsonl', headers=self.headers)
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 30)
+        response = self.app.get('/api/tables/missing/export', headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_keyset_pagination(self):
+        """测试 next_cursor 分页和可选的 total_count"""
+        self.db.create_table("items")
+        for i in range(25):
+            self.db.insert("items", {"price": i % 6})
+        seen, cursor = [], ''
+        while True:
+            response = self.app.get(f'/api/tables/items/records?limit=10&order_by=price:desc&with_total=false'
+                                    f'&cursor={cursor}', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertNotIn('total_count', data)
+            seen.extend(data['records'])
+            if not data['has_more']:
+                break
+            cursor = data['next_cursor']
+        self.assertEqual(seen, self.db.select("items", order_by=[("price", "desc")]))
+        
+        response = self.app.get('/api/tables/items/records?limit=10&cursor=bad', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(self.app.get('/api/tables/items/records?limit=10&offset=20', headers=self.headers).data)
+        self.assertEqual((data['count'], data['total_count'], data['has_more']), (5, 25, False))
+        response = self.app.get('/api/tables/missing/records?limit=10', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['records'], [])
 
 if __name__ == '__main__':
     unittest.main()